@@ -1,35 +1,40 @@
 // Grid gallery with hover enlarge and image swap (original/current)
-// Assumes spaces.json has [{ images: [original, current, ...], ... }]
+// Reads spaces_optimized.json: [{ original_image, artist: [{ final_image }], ... }].
+// Images are set with setImage() from images.js (load it first).
 
-fetch('spaces_new.json')
+// 4, 6 or 8 columns (style.css)
+const GRID_SIZES = '(max-width: 600px) 25vw, (max-width: 1024px) 17vw, 13vw';
+
+fetch('spaces_optimized.json')
   .then(r => r.json())
   .then(data => {
     const gallery = document.getElementById('grid-gallery');
     data.forEach(space => {
-      // Use first two images: [original, current]
-      const original = space.images && space.images[0];
-      const current = space.images && space.images[1] ? space.images[1] : space.images[0];
+      // original image, and the latest artist's final image if there is one
+      const original = space.original_image;
+      const finals = (space.artist || []).map(a => a.final_image).filter(Boolean);
+      const current = finals.length ? finals[finals.length - 1] : original;
       if (!original) return;
       const item = document.createElement('div');
       item.className = 'grid-item';
       const img = document.createElement('img');
       img.className = 'grid-img';
-      img.src = original;
+      setImage(img, original, GRID_SIZES);
       img.alt = '';
       let swapTimer = null;
       let showingCurrent = false;
       // On hover, enlarge and start swapping
       item.addEventListener('mouseenter', () => {
-        if (original !== current) {
+        if (original.src !== current.src) {
           swapTimer = setInterval(() => {
-            img.src = showingCurrent ? original : current;
+            setImage(img, showingCurrent ? original : current, GRID_SIZES);
             showingCurrent = !showingCurrent;
           }, 600);
         }
       });
       item.addEventListener('mouseleave', () => {
         clearInterval(swapTimer);
-        img.src = original;
+        if (showingCurrent) setImage(img, original, GRID_SIZES);
         showingCurrent = false;
       });
       item.appendChild(img);
@@ -0,0 +1,56 @@
+// Image helpers shared by the catalogue pages: load before spaces.js,
+// timeline-gallery.js and grid-gallery.js (styles in images.css).
+
+// Image objects may carry srcset strings per format ({avif, webp, jpeg}) made by
+// scripts/derivatives.py; browsers then fetch the width their layout needs.
+// Their width/height and placeholder (a tiny data: URI) let the page lay out
+// and paint before the image arrives.
+function imageSrc(obj) {
+  return typeof obj === 'string' ? obj : ((obj && obj.src) || '');
+}
+
+function sizeAttrs(obj) {
+  if (!obj || !obj.width || !obj.height) return '';
+  const lqip = obj.placeholder
+    ? ` data-lqip style="background-image:url(${obj.placeholder})" onload="this.style.backgroundImage=''"`
+    : '';
+  return ` width="${obj.width}" height="${obj.height}"${lqip}`;
+}
+
+function pictureHtml(obj, attrs, sizes) {
+  const img = `<img src="${imageSrc(obj)}"${sizeAttrs(obj)}`;
+  const sets = obj && obj.srcset;
+  if (!sets) return `${img} ${attrs}>`;
+  const sources = [['avif', 'image/avif'], ['webp', 'image/webp']]
+    .filter(([fmt]) => sets[fmt])
+    .map(([fmt, type]) => `<source type="${type}" srcset="${sets[fmt]}" sizes="${sizes}">`)
+    .join('');
+  const jpeg = sets.jpeg ? ` srcset="${sets.jpeg}" sizes="${sizes}"` : '';
+  return `<picture>${sources}${img}${jpeg} ${attrs}></picture>`;
+}
+
+// For an existing <img> element (JPEG variants only)
+function setImage(imgEl, obj, sizes) {
+  const jpeg = obj && obj.srcset && obj.srcset.jpeg;
+  if (jpeg) {
+    imgEl.sizes = sizes;
+    imgEl.srcset = jpeg;
+  } else {
+    imgEl.removeAttribute('srcset');
+  }
+  if (obj && obj.width && obj.height) {
+    imgEl.width = obj.width;
+    imgEl.height = obj.height;
+  } else {
+    imgEl.removeAttribute('width');
+    imgEl.removeAttribute('height');
+  }
+  if (obj && obj.placeholder) {
+    imgEl.dataset.lqip = '';
+    imgEl.style.backgroundImage = `url(${obj.placeholder})`;
+    imgEl.addEventListener('load', () => { imgEl.style.backgroundImage = ''; }, { once: true });
+  } else {
+    imgEl.style.backgroundImage = '';
+  }
+  imgEl.src = imageSrc(obj);
+}
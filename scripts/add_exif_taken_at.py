@@ -1,63 +1,69 @@
 #!/usr/bin/env python3
+"""Fill in the taken_at of space images that have none from their EXIF date.
 
-import json
+Usage:
+  python scripts/add_exif_taken_at.py spaces_new.json [img_base_dir]
+
+The changes go through the space store (one journal batch of 'exif_dates'
+records, or the SQLite backend), so edits made meanwhile are kept.
+"""
 import os
-import subprocess
-from datetime import datetime
+import time
+
+from image_meta_cache import get_cache
+from space_model import is_mapping, plain
+from space_store import get_store
 
 
 def get_exif_taken_at(img_path):
-    # Use exiftool to extract Create Date or Date/Time Original
-    try:
-        result = subprocess.run([
-            'exiftool',
-            '-CreateDate',
-            '-DateTimeOriginal',
-            img_path
-        ], capture_output=True, text=True, check=True)
-        lines = result.stdout.splitlines()
-        date_value = None
-        for line in lines:
-            if 'Date/Time Original' in line or 'Create Date' in line:
-                # exiftool output: 'Create Date                     : 2025:08:21 09:21:34'
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    date_str = parts[1].strip()
-                    # Convert 'YYYY:MM:DD HH:MM:SS' to ISO 8601 'YYYY-MM-DDTHH:MM:SS'
-                    try:
-                        dt = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                        date_value = dt.isoformat()
-                    except Exception:
-                        date_value = date_str.replace(' ', 'T').replace(':', '-', 2)
-                    break
-        if date_value:
-            return date_value
-        else:
-            print(f"No EXIF date found for {img_path}")
-            return None
-    except Exception as e:
-        print(f"Error running exiftool on {img_path}: {e}")
+    # Cached per (path, size, mtime); unchanged files are not opened again
+    meta = get_cache().get(os.path.abspath(img_path))
+    date_value = meta and meta['taken_at']
+    if date_value:
+        return date_value
+    else:
+        print(f"No EXIF date found for {img_path}")
         return None
 
 def update_json_with_exif(json_path, img_base_dir=None):
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    for space in data:
-        for img in space.get('images', []):
-            if isinstance(img, dict) and (not img.get('taken_at') or img['taken_at'] is None):
+    started = time.perf_counter()
+    checked = 0
+    store = get_store(json_path)
+    # src -> EXIF date, read before the batch so the journal lock is held briefly
+    found = {}
+    for space in store.spaces():
+        for img in space.get('images') or []:
+            if is_mapping(img) and not img.get('taken_at') and img.get('src') not in found:
                 img_path = img['src']
                 if img_base_dir and not os.path.isabs(img_path):
                     if not img_path.startswith(img_base_dir + os.sep):
                         img_path = os.path.join(img_base_dir, img_path)
                 if os.path.exists(img_path):
+                    checked += 1
                     taken_at = get_exif_taken_at(img_path)
                     if taken_at:
-                        img['taken_at'] = taken_at
+                        found[img['src']] = taken_at
                         print(f"Updated {img_path} with taken_at: {taken_at}")
                 else:
                     print(f"Image not found: {img_path}")
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    changed = 0
+    if found:
+        with store.batch() as tx:
+            for header in store.headers():
+                # read again inside the batch: images may have changed meanwhile
+                space = tx.get(header.get('id'))
+                images = plain(space.get('images')) if space is not None else None
+                if not images:
+                    continue
+                dated = 0
+                for img in images:
+                    if isinstance(img, dict) and not img.get('taken_at') and img.get('src') in found:
+                        img['taken_at'] = found[img['src']]
+                        dated += 1
+                if dated:
+                    tx.apply('exif_dates', space.get('id'), {'set': {'images': images}})
+                    changed += 1
+    print(f"Checked {checked} images in {time.perf_counter() - started:.2f}s; {changed} spaces updated")
 
 if __name__ == '__main__':
     import sys
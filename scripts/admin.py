@@ -1,42 +1,37 @@
 from flask import abort
-def optimize_image(path, max_size=1080, quality=80):
-    if Image is None:
-        return
-    try:
-        img = Image.open(path)
-        img = img.convert('RGB')
-        # Resize to fit max_size on long edge
-        w, h = img.size
-        if max(w, h) > max_size:
-            if w > h:
-                new_w = max_size
-                new_h = int(h * max_size / w)
-            else:
-                new_h = max_size
-                new_w = int(w * max_size / h)
-            img = img.resize((new_w, new_h), Image.LANCZOS)
-        img.save(path, 'JPEG', quality=quality, optimize=True)
-    except Exception as e:
-        print(f'Image optimization failed: {e}')
 #!/usr/bin/env python3
 """Local admin web UI for adding updates to spaces_new.json.
 
 Run:
   python3 scripts/admin.py
 
-Open http://127.0.0.1:5000 in your browser. The app is local-only and will write to
-`spaces_new.json` (and a compatibility `spaces.json`). It creates a timestamped backup
-before overwriting. By default it does NOT git commit; pass --commit to enable commit.
+Open http://127.0.0.1:5000 in your browser. The app is local-only. Each change is
+appended to `spaces_new.journal.jsonl` and periodically folded into `spaces_new.json`
+(see scripts/space_journal.py); a timestamped backup is taken at each fold.
+By default it does NOT git commit; pass --commit to enable commit.
 """
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import os, json, shutil, argparse
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+import os, argparse, copy, time
+import codec
 from datetime import datetime
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from space_store import get_store
+from space_journal import apply_patch
+from space_model import is_mapping, plain
+from space_writer import get_writer
+from export_worker import get_export_worker
+import backup_store
+import blob_store
+import ingest
+import resize_cache
+import space_search
+
 try:
-    from PIL import Image
-    from PIL.ExifTags import TAGS
+    import similar_spaces
 except Exception:
-    Image = None
+    # needs numpy
+    similar_spaces = None
 
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -44,60 +39,41 @@ IMG_DIR = os.path.join(ROOT, 'img')
 BACKUP_DIR = os.path.join(ROOT, 'backups')
 os.makedirs(BACKUP_DIR, exist_ok=True)
 SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+STORE = get_store(SP_NEW)
+# All mutations go through one writer thread that group-commits them
+WRITER = get_writer(STORE)
+# spaces_optimized.json / spaces_timeline.json are rebuilt in the background
+EXPORTS = get_export_worker()
 
 app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), 'templates'), static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
 def read_spaces():
-    path = SP_NEW if os.path.exists(SP_NEW) else SP
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return STORE.spaces()
+
+def read_space_headers():
+    # listings only need id/status/description/artists, not the update history
+    return STORE.headers()
 
 def backup_spaces():
     if os.path.exists(SP_NEW):
-        bak = os.path.join(BACKUP_DIR, 'spaces_new.json.bak.' + datetime.utcnow().strftime('%Y%m%d%H%M%S'))
-        shutil.copy2(SP_NEW, bak)
-        # Keep only the latest 3 backups
-        baks = sorted([f for f in os.listdir(BACKUP_DIR) if f.startswith('spaces_new.json.bak.')])
-        for old in baks[:-3]:
-            try:
-                os.remove(os.path.join(BACKUP_DIR, old))
-            except Exception:
-                pass
-
-def write_both(data):
-    backup_spaces()
-    with open(SP_NEW, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    # Also write spaces_optimized.json for frontend
-    try:
-        from scripts.export_optimized import export_optimized
-        export_optimized(data)
-    except Exception as e:
-        print(f"[WARN] Could not update spaces_optimized.json: {e}")
-    # Also write spaces_timeline.json for timeline gallery
-    try:
-        from scripts.export_timeline import export_timeline
-        export_timeline(data)
-    except Exception as e:
-        print(f"[WARN] Could not update spaces_timeline.json: {e}")
+        # Deduplicated into backups/store/ and pruned (hourly for a day, daily for a month)
+        backup_store.backup_spaces(SP_NEW)
 
-def exif_taken(path):
-    if Image is None:
-        return None
-    try:
-        img = Image.open(path)
-        info = img._getexif() or {}
-        for k, v in info.items():
-            name = TAGS.get(k, k)
-            if name == 'DateTimeOriginal':
-                return v.replace(':', '-', 2)
-    except Exception:
-        return None
+# Back up the previous snapshot whenever the journal is folded into a new one
+STORE.on_compact = lambda store: backup_spaces()
+
+def refresh_exports(changed_ids=None):
+    """Queue the frontend JSON files for the spaces that changed.
+
+    The export runs on the background worker so the request can be answered
+    as soon as its write is committed; see /export/status for progress.
+    """
+    EXPORTS.request(changed_ids)
 
 @app.route('/')
 def index():
     try:
-        spaces = read_spaces()
+        spaces = read_space_headers()
         print(f"DEBUG: Loaded {len(spaces)} spaces")
         return render_template('admin.html', spaces=spaces)
     except Exception as e:
@@ -109,7 +85,7 @@ def index():
 @app.route('/template')
 def template():
     try:
-        spaces = read_spaces()
+        spaces = read_space_headers()
         return render_template('admin.html', spaces=spaces)
     except Exception as e:
         return f"<h1>Template Error</h1><p>{str(e)}</p>"
@@ -131,38 +107,27 @@ def save():
     no_append = request.form.get('no_append') == '1'
 
     files = request.files.getlist('files')
-    if not files:
+    manifest = request.form.get('files_manifest')
+    if not files and not manifest:
         return jsonify({'ok': False, 'error': 'No files uploaded'})
 
-    # determine folder name
-    slug = secure_filename(request.form.get('slug') or ('upload-' + datetime.utcnow().strftime('%Y%m%d%H%M%S')))
-    spaces = read_spaces()
+    # Files are stored by content (img/blobs/); bytes stored before become references
+    try:
+        order, staged = ingest.stage_uploads(files, manifest)
+        saved, records = ingest.store_uploads(order, staged, meta=True)
+    except LookupError as e:
+        return jsonify({'ok': False, 'error': str(e)})
 
+    new_space = None
     if create_new or not title_id:
-        maxid = max((int(s.get('id', 0)) for s in spaces), default=0)
-        new_id = maxid + 1
-        folder = f"{new_id}-{slug}"
-        space = {'id': new_id, 'images': [], 'created_by': author, 'created_at': datetime.utcnow().isoformat(), 'status': status, 'updates': []}
-        spaces.append(space)
+        new_id = STORE.next_id()
+        new_space = {'id': new_id, 'images': [], 'created_by': author, 'created_at': datetime.utcnow().isoformat(), 'status': status, 'updates': []}
         title_id = str(new_id)
-    else:
-        folder = f"{title_id}-{slug}"
-
-    target_dir = os.path.join(IMG_DIR, folder)
-    os.makedirs(target_dir, exist_ok=True)
-
-    saved = []
-    for f in files:
-        filename = secure_filename(f.filename)
-        path = os.path.join(target_dir, filename)
-        f.save(path)
-        rel = os.path.relpath(path, ROOT).replace('\\', '/')
-        saved.append({'src': rel, 'taken_at': exif_taken(path)})
 
     # build update object; client should indicate primary filename
     primary = request.form.get('primary')
     ordered = []
-    name_map = {os.path.basename(s['src']): s for s in saved}
+    name_map = {name: s for (_, name), s in zip(order, saved)}
     if primary and primary in name_map:
         o = dict(name_map.pop(primary)); o['role'] = 'primary'; ordered.append(o)
     for k, v in name_map.items():
@@ -171,41 +136,31 @@ def save():
     upd = {'author': author, 'text': text, 'action': request.form.get('action'), 'images': ordered, 'created_at': datetime.utcnow().isoformat(), 'status': status, 'related': related_ids}
 
     # attach to space
-    target = None
-    for s in spaces:
-        if str(s.get('id')) == str(title_id):
-            target = s
-            break
+    target = new_space if new_space is not None else STORE.get(title_id)
     if not target:
         return jsonify({'ok': False, 'error': 'target id not found after creation: ' + str(title_id)})
 
+    patch = {'extend': {'updates': [upd]},
+             'set': {'modified_by': author, 'modified_at': datetime.utcnow().isoformat(), 'status': status}}
+    if not no_append:
+        patch['extend']['images'] = saved
+
     # apply changes or dry-run preview
     dry_run = request.form.get('dry_run') == 'on' or request.form.get('dry_run') == '1'
 
-    # produce preview object
-    preview_spaces = json.loads(json.dumps(spaces))
-    target_preview = None
-    for s in preview_spaces:
-        if str(s.get('id')) == str(title_id):
-            target_preview = s
-            break
-
     if dry_run:
-        # attach but do not write
-        if target_preview is not None:
-            target_preview.setdefault('updates', []).append(upd)
-            if not no_append:
-                target_preview.setdefault('images', []).extend(saved)
+        # preview a copy so the resident store is left untouched
+        target_preview = codec.loads(codec.dumps(target))
+        apply_patch(target_preview, patch)
         return jsonify({'ok': True, 'preview': target_preview, 'dry_run': True})
 
-    target.setdefault('updates', []).append(upd)
-    if not no_append:
-        target.setdefault('images', []).extend(saved)
-    target['modified_by'] = author
-    target['modified_at'] = datetime.utcnow().isoformat()
-    target['status'] = status
+    if new_space is not None:
+        apply_patch(new_space, patch)
+        WRITER.apply('create_space', space=new_space)
+    else:
+        WRITER.apply('add_update', target.get('id'), patch)
 
-    write_both(spaces)
+    refresh_exports([target.get('id')])
 
     # optional git commit
     do_commit = request.form.get('commit') == '1'
@@ -214,13 +169,16 @@ def save():
     if do_commit:
         try:
             import subprocess
-            subprocess.check_call(['git', 'add', SP_NEW, SP])
+            # fold pending journal records into spaces_new.json before committing it
+            STORE.compact(force=True)
+            subprocess.check_call(['git', 'add', SP_NEW])
             subprocess.check_call(['git', 'commit', '-m', commit_msg])
             commit_result = 'committed'
         except Exception as e:
             commit_result = f'git failed: {e}'
 
-    return jsonify({'ok': True, 'id': title_id, 'folder': folder, 'commit': commit_result})
+    return jsonify({'ok': True, 'id': title_id, 'images': [s['src'] for s in saved], 'meta': records,
+                    'commit': commit_result})
 
 
 @app.route('/mark_multiple', methods=['POST'])
@@ -242,64 +200,42 @@ def mark_multiple():
     if not ids:
         return jsonify({'ok': False, 'error': 'No valid space IDs provided'})
 
-    spaces = read_spaces()
     marked_spaces = []
     errors = []
 
     # Handle instruction images if provided
-    instruction_images = []
+    instruction_images, instruction_meta = [], []
     instruction_files = request.files.getlist('instruction_files')
-    if instruction_files:
-        # Create instruction folder
-        instruction_folder = f"instruction-{taken_by.replace(' ', '_')}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-        target_dir = os.path.join(IMG_DIR, instruction_folder)
-        os.makedirs(target_dir, exist_ok=True)
-
-        for f in instruction_files:
-            if f.filename:
-                filename = secure_filename(f.filename)
-                path = os.path.join(target_dir, filename)
-                f.save(path)
-                optimize_image(path)
-                rel = os.path.relpath(path, ROOT).replace('\\', '/')
-                instruction_images.append({'src': rel, 'taken_at': exif_taken(path)})
-
-    for space_id in ids:
-        target = None
-        for s in spaces:
-            if s.get('id') == space_id:
-                target = s
-                break
-
-        if not target:
-            errors.append(f'Space {space_id} not found')
-            continue
-
-        # Track taken info per artist
-        if 'taken_artists' not in target:
-            target['taken_artists'] = []
-
-        # Check if this artist already marked this space
-        existing_artist = None
-        for artist in target['taken_artists']:
-            if artist.get('name') == taken_by:
-                existing_artist = artist
-                break
-
-        # If already marked by this artist, only append new data if provided
-        if existing_artist:
-            appended = False
-            if note:
-                existing_artist.setdefault('notes', []).append(note)
-                appended = True
-            if instruction_text:
-                existing_artist.setdefault('instructions', []).append(instruction_text)
-                appended = True
-            if instruction_images:
-                existing_artist.setdefault('instruction_images', []).extend(instruction_images)
-                appended = True
-            # Always append update if new data
-            if (instruction_text or instruction_images):
+    manifest = request.form.get('instruction_files_manifest')
+    if instruction_files or manifest:
+        try:
+            instruction_images, instruction_meta = ingest.save_uploads(
+                instruction_files, optimize=True, manifest=manifest, meta=True)
+        except LookupError as e:
+            return jsonify({'ok': False, 'error': str(e)})
+
+    # Decide and apply on the writer thread so concurrent marks see each other
+    def mark(tx):
+        for space_id in ids:
+            target = tx.get(space_id)
+
+            if not target:
+                errors.append(f'Space {space_id} not found')
+                continue
+
+            # Track taken info per artist (work on a copy; the store applies it)
+            artists = copy.deepcopy(target.get('taken_artists') or [])
+
+            # Check if this artist already marked this space
+            existing_artist = None
+            for artist in artists:
+                if artist.get('name') == taken_by:
+                    existing_artist = artist
+                    break
+
+            # Instruction update for the timeline
+            upd = None
+            if instruction_text or instruction_images:
                 upd = {
                     'author': taken_by,
                     'text': instruction_text,
@@ -309,61 +245,66 @@ def mark_multiple():
                     'status': 'instruction',
                     'related': []
                 }
-                target.setdefault('updates', []).append(upd)
-                appended = True
-            if appended:
-                marked_spaces.append(space_id)
-            # If no new data, skip
-            continue
-
-        # If marked by a different artist, warn (frontend should handle confirmation)
-        if target['taken_artists']:
-            errors.append(f"Space {space_id} already taken by another artist. If you want to add a second artist, please confirm and resubmit.")
-            continue
-
-        # New artist marking this space
-        artist_entry = {
-            'name': taken_by,
-            'taken_at': datetime.utcnow().isoformat(),
-            'notes': [note] if note else [],
-            'instructions': [instruction_text] if instruction_text else [],
-            'instruction_images': instruction_images if instruction_images else []
-        }
-        target['taken_artists'].append(artist_entry)
-        target['status'] = 'taken'
-        # For backward compatibility, keep these fields for the most recent artist
-        target['taken_by'] = taken_by
-        target['taken_at'] = artist_entry['taken_at']
-        if note:
-            target['taken_note'] = note
-        if instruction_text:
-            target['instruction_text'] = instruction_text
-        if instruction_images:
-            target['instruction_images'] = instruction_images
-
-        # Create instruction update for timeline
-        if instruction_text or instruction_images:
-            upd = {
-                'author': taken_by,
-                'text': instruction_text,
-                'action': 'instruction',
-                'images': [{'src': img['src'], 'role': 'instruction', 'taken_at': img['taken_at']} for img in instruction_images],
-                'created_at': datetime.utcnow().isoformat(),
-                'status': 'instruction',
-                'related': []
+
+            # If already marked by this artist, only append new data if provided
+            if existing_artist:
+                if note:
+                    existing_artist.setdefault('notes', []).append(note)
+                if instruction_text:
+                    existing_artist.setdefault('instructions', []).append(instruction_text)
+                if instruction_images:
+                    existing_artist.setdefault('instruction_images', []).extend(instruction_images)
+                # If no new data, skip
+                if note or upd:
+                    patch = {'set': {'taken_artists': artists}}
+                    if upd:
+                        patch['extend'] = {'updates': [upd]}
+                    tx.apply('instructions', space_id, patch)
+                    marked_spaces.append(space_id)
+                continue
+
+            # If marked by a different artist, warn (frontend should handle confirmation)
+            if artists:
+                errors.append(f"Space {space_id} already taken by another artist. If you want to add a second artist, please confirm and resubmit.")
+                continue
+
+            # New artist marking this space
+            artist_entry = {
+                'name': taken_by,
+                'taken_at': datetime.utcnow().isoformat(),
+                'notes': [note] if note else [],
+                'instructions': [instruction_text] if instruction_text else [],
+                'instruction_images': instruction_images if instruction_images else []
             }
-            target.setdefault('updates', []).append(upd)
+            artists.append(artist_entry)
+            fields = {'taken_artists': artists, 'status': 'taken'}
+            # For backward compatibility, keep these fields for the most recent artist
+            fields['taken_by'] = taken_by
+            fields['taken_at'] = artist_entry['taken_at']
+            if note:
+                fields['taken_note'] = note
+            if instruction_text:
+                fields['instruction_text'] = instruction_text
+            if instruction_images:
+                fields['instruction_images'] = instruction_images
+            patch = {'set': fields}
+            if upd:
+                patch['extend'] = {'updates': [upd]}
+            tx.apply('mark_taken', space_id, patch)
 
-        marked_spaces.append(space_id)
+            marked_spaces.append(space_id)
+
+    WRITER.transact(mark)
 
     if marked_spaces:
-        write_both(spaces)
+        refresh_exports(marked_spaces)
 
     return jsonify({
         'ok': True,
         'marked': marked_spaces,
         'errors': errors,
-        'instruction_images': len(instruction_images) if instruction_images else 0
+        'instruction_images': len(instruction_images) if instruction_images else 0,
+        'meta': instruction_meta,
     })
 
 
@@ -376,69 +317,23 @@ def publish_update():
     if not space_id:
         return jsonify({'ok': False, 'error': 'space_id required'})
 
-    spaces = read_spaces()
-    target = None
-    for s in spaces:
-        if str(s.get('id')) == str(space_id):
-            target = s
-            break
+    target = STORE.get(space_id)
 
     if not target:
         return jsonify({'ok': False, 'error': 'space not found'})
 
     # Handle published update images
     update_files = request.files.getlist('update_files')
-    if not update_files or not any(f.filename for f in update_files):
+    manifest = request.form.get('update_files_manifest')
+    if not manifest and not any(f.filename for f in update_files):
         return jsonify({'ok': False, 'error': 'No update images provided'})
 
-    # Create update folder
-    update_folder = f"{space_id}-update-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-    target_dir = os.path.join(IMG_DIR, update_folder)
-    os.makedirs(target_dir, exist_ok=True)
-
-    saved_images = []
-    for f in update_files:
-        if f.filename:
-            filename = secure_filename(f.filename)
-            path = os.path.join(target_dir, filename)
-            f.save(path)
-            optimize_image(path)
-            rel = os.path.relpath(path, ROOT).replace('\\', '/')
-            saved_images.append({'src': rel, 'taken_at': exif_taken(path), 'role': 'update'})
-# API endpoint for minimal space info
-@app.route('/api/space/<int:space_id>')
-def api_space(space_id):
-    spaces = read_spaces()
-    for s in spaces:
-        if int(s.get('id')) == space_id:
-            # Compose minimal info
-            out = {
-                'id': s.get('id'),
-                'description': s.get('description', {}),
-                'status': s.get('status'),
-                'artist': [],
-                'original_image': None,
-                'final_image': None
-            }
-            # Original image: first in images[]
-            imgs = s.get('images', [])
-            if imgs:
-                out['original_image'] = imgs[0]
-            # Final image: last published update image
-            for upd in reversed(s.get('updates', [])):
-                if upd.get('status') == 'published' and upd.get('images'):
-                    out['final_image'] = upd['images'][-1]
-                    break
-            # Artists and their instructions/images
-            for artist in s.get('taken_artists', []):
-                out['artist'].append({
-                    'name': artist.get('name'),
-                    'taken_at': artist.get('taken_at'),
-                    'instructions': artist.get('instructions', []),
-                    'instruction_images': artist.get('instruction_images', [])
-                })
-            return jsonify(out)
-    abort(404)
+    # new images are processed on the ingest pool (one decode each), one file per core
+    try:
+        saved_images, records = ingest.save_uploads(update_files, optimize=True, role='update',
+                                                    manifest=manifest, meta=True)
+    except LookupError as e:
+        return jsonify({'ok': False, 'error': str(e)})
 
     # Create published update
     upd = {
@@ -451,16 +346,81 @@ def api_space(space_id):
         'related': []
     }
 
-    target.setdefault('updates', []).append(upd)
-    target['status'] = 'published'
-    target['modified_by'] = author
-    target['modified_at'] = datetime.utcnow().isoformat()
+    # Add update images to the space's main images as well
+    WRITER.apply('publish', target.get('id'), {
+        'extend': {'updates': [upd], 'images': saved_images},
+        'set': {'status': 'published', 'modified_by': author, 'modified_at': datetime.utcnow().isoformat()},
+    })
+
+    refresh_exports([target.get('id')])
+    return jsonify({'ok': True, 'id': space_id, 'images': len(saved_images), 'meta': records})
 
-    # Add update images to the space's main images
-    target.setdefault('images', []).extend(saved_images)
 
-    write_both(spaces)
-    return jsonify({'ok': True, 'id': space_id, 'images': len(saved_images)})
+# API endpoint for minimal space info
+@app.route('/api/space/<int:space_id>')
+def api_space(space_id):
+    s = STORE.get(space_id)
+    if s is None:
+        abort(404)
+    # Compose minimal info
+    out = {
+        'id': s.get('id'),
+        'description': s.get('description', {}),
+        'status': s.get('status'),
+        'artist': [],
+        'original_image': None,
+        'final_image': None
+    }
+    # Original image: first in images[]
+    imgs = s.get('images', [])
+    if imgs:
+        out['original_image'] = imgs[0]
+    # Final image: last published update image
+    for upd in reversed(s.get('updates', [])):
+        if upd.get('status') == 'published' and upd.get('images'):
+            out['final_image'] = upd['images'][-1]
+            break
+    # Artists and their instructions/images
+    for artist in s.get('taken_artists', []):
+        out['artist'].append({
+            'name': artist.get('name'),
+            'taken_at': artist.get('taken_at'),
+            'instructions': artist.get('instructions', []),
+            'instruction_images': artist.get('instruction_images', [])
+        })
+    return jsonify(plain(out))
+
+
+@app.route('/api/space/<int:space_id>/similar')
+def api_space_similar(space_id):
+    """Spaces whose first image looks most like this one's (CLIP embeddings, see similar_spaces.py)"""
+    if STORE.get(space_id) is None:
+        abort(404)
+    if similar_spaces is None:
+        return jsonify({'ok': False, 'error': 'similar spaces need numpy'}), 503
+    k = min(max(request.args.get('k', similar_spaces.SIMILAR_K, type=int), 1), 100)
+    found = similar_spaces.get_similar_index(STORE).similar(space_id, k)
+    if found is None:
+        return jsonify({'ok': False, 'error': 'no embedding for this space yet '
+                                              '(run scripts/clip_embeddings.py update)'}), 404
+    # spaces deleted since the index was built are left out
+    return jsonify({'ok': True, 'id': space_id,
+                    'similar': [{'id': i, 'score': round(score, 4)} for i, score in found
+                                if STORE.get(i) is not None]})
+
+
+@app.route('/api/search')
+def api_search():
+    """Spaces ranked by how well their photo (CLIP) and texts match ?q= (see space_search.py)"""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'ok': False, 'error': 'q required'}), 400
+    limit = min(max(request.args.get('limit', space_search.LIMIT, type=int), 1), 200)
+    started = time.perf_counter()
+    results, mode = space_search.search(q, STORE, limit)
+    return jsonify({'ok': True, 'q': q, 'mode': mode,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                    'results': [{'id': i, 'score': round(score, 4)} for i, score in results]})
 
 
 @app.route('/revert', methods=['POST'])
@@ -468,51 +428,53 @@ def revert():
     space_id = request.form.get('revert_id')
     if not space_id:
         return jsonify({'ok': False, 'error': 'revert_id required'})
-    spaces = read_spaces()
-    target = None
-    for s in spaces:
-        if str(s.get('id')) == str(space_id):
-            target = s
-            break
+    target = STORE.get(space_id)
     if not target:
         return jsonify({'ok': False, 'error': 'space id not found'})
 
-    # check if there are updates to revert
-    updates = target.get('updates') or []
-    if not updates:
-        return jsonify({'ok': False, 'error': 'no updates to revert'})
+    def pop_last(tx):
+        target = tx.get(space_id)
+        # check if there are updates to revert
+        updates = target.get('updates') or []
+        if not updates:
+            return None, None
 
-    # pop last update
-    last_upd = updates.pop()
-    target['updates'] = updates
+        # pop last update
+        last_upd = updates[-1]
+        patch = {'pop_update': True}
 
-    # remove last prepended image if it matches the update's primary
-    imgs = target.get('images') or []
-    if imgs and last_upd.get('images'):
+        # remove last prepended image if it matches the update's primary
         primary_src = None
-        for im in last_upd['images']:
-            if im.get('role') == 'primary':
-                primary_src = im.get('src')
-                break
-        if primary_src and imgs[0].get('src') == primary_src:
-            imgs.pop(0)
-            target['images'] = imgs
-
-    # optionally delete image file (if it exists and is in img/<id>-manual-update/)
-    if primary_src and primary_src.startswith('img/'):
+        imgs = target.get('images') or []
+        if imgs and last_upd.get('images'):
+            for im in last_upd['images']:
+                if im.get('role') == 'primary':
+                    primary_src = im.get('src')
+                    break
+            if primary_src and imgs[0].get('src') == primary_src:
+                patch['drop_image'] = primary_src
+
+        # reset status if no more updates
+        if len(updates) == 1:
+            patch['set'] = {'status': 'available'}
+            patch['unset'] = ['taken_by', 'taken_at', 'taken_note']
+
+        tx.apply('revert', target.get('id'), patch)
+        return last_upd, primary_src
+
+    last_upd, primary_src = WRITER.transact(pop_last)
+    if last_upd is None:
+        return jsonify({'ok': False, 'error': 'no updates to revert'})
+
+    # optionally delete image file (if it exists and is in img/<id>-manual-update/);
+    # blobs may be shared with other updates and are left to `blob_store.py gc`
+    if primary_src and primary_src.startswith('img/') and not blob_store.is_blob(primary_src):
         try:
             os.remove(os.path.join(ROOT, primary_src))
         except OSError:
             pass  # ignore if file not found
 
-    # reset status if no more updates
-    if not updates:
-        target['status'] = 'available'
-        target.pop('taken_by', None)
-        target.pop('taken_at', None)
-        target.pop('taken_note', None)
-
-    write_both(spaces)
+    refresh_exports([target.get('id')])
     return jsonify({'ok': True, 'id': space_id, 'reverted': last_upd.get('created_at')})
 
 
@@ -523,19 +485,14 @@ def mark_preview():
     f = request.files.get('taken_file')
     if not space_id:
         return jsonify({'ok': False, 'error': 'mark_id required'})
-    spaces = read_spaces()
-    target = None
-    for s in spaces:
-        if str(s.get('id')) == str(space_id):
-            target = s
-            break
+    target = STORE.get(space_id)
     if not target:
         return jsonify({'ok': False, 'error': 'space id not found'})
 
     old_img = None
     if target.get('images') and len(target['images'])>0:
         img = target['images'][0]
-        old_img = img if isinstance(img, dict) else {'src': img}
+        old_img = plain(img) if is_mapping(img) else {'src': img}
 
     new_img = None
     if f:
@@ -548,8 +505,55 @@ def mark_preview():
 
 @app.route('/img/<path:filename>')
 def serve_image(filename):
-    """Serve image files from the img directory"""
-    return send_from_directory(IMG_DIR, filename)
+    """Serve image files from the img directory.
+
+    With ?w=<width> (and optionally fmt=webp|jpeg) a resized copy is served
+    from the resize cache, rendered on first request (see resize_cache.py).
+    """
+    width = request.args.get('w', type=int)
+    fmt = request.args.get('fmt')
+    if not width or not resize_cache.formats():
+        return send_from_directory(IMG_DIR, filename)
+    vary = fmt is None
+    if vary:
+        accepts_webp = 'image/webp' in request.headers.get('Accept', '')
+        fmt = 'webp' if accepts_webp and 'webp' in resize_cache.formats() else 'jpeg'
+    source = safe_join(IMG_DIR, filename)
+    if source is None or not os.path.isfile(source):
+        abort(404)
+    cache = resize_cache.get_resize_cache()
+    for attempt in range(2):
+        try:
+            path, etag, mimetype = cache.get(source, width, fmt)
+            resp = send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+            break
+        except ValueError as e:
+            return jsonify({'ok': False, 'error': str(e)}), 400
+        except resize_cache.UnsupportedImage as e:
+            return jsonify({'ok': False, 'error': str(e)}), 415
+        except FileNotFoundError:
+            # the source is gone, or the variant was evicted before send_file opened it (render it again)
+            if attempt or not os.path.isfile(source):
+                abort(404)
+    if blob_store.is_blob(os.path.relpath(source, ROOT)):
+        # content-addressed: this URL always means these bytes
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        resp.headers['Cache-Control'] = 'public, max-age=604800'
+    if vary:
+        resp.headers['Vary'] = 'Accept'
+    return resp
+
+@app.route('/blob/<sha>', methods=['HEAD'])
+def blob_exists(sha):
+    """200 if an upload with this sha256 can be left out (list it in the <field>_manifest)"""
+    optimize = request.args.get('optimize') == '1'
+    return ('', 200) if blob_store.get_blob_store().has(sha.lower(), optimize) else ('', 404)
+
+@app.route('/export/status')
+def export_status():
+    """Generation and timing of the last background export"""
+    return jsonify({'ok': True, 'export': EXPORTS.status(), 'writer': WRITER.status()})
 
 def main():
     ap = argparse.ArgumentParser()
@@ -559,6 +563,8 @@ def main():
     args = ap.parse_args()
     # pass commit flag through config
     app.config['ALLOW_COMMIT'] = args.commit
+    # bring the exports up to date with any journaled changes
+    refresh_exports()
     app.run(host=args.host, port=args.port)
 
 if __name__ == '__main__':
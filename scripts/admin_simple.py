@@ -7,15 +7,24 @@ Three main functions:
 3. Mark space as updated
 """
 from flask import Flask, render_template_string, request, jsonify, send_from_directory
-import os, json, shutil, argparse, subprocess
+import os, argparse
 from datetime import datetime
-from werkzeug.utils import secure_filename
+from space_store import get_store
+from space_writer import get_writer
+from export_worker import get_export_worker
+import backup_store
+import blob_store
+import ingest
 
 # Paths
 ROOT = os.path.dirname(os.path.dirname(__file__))
 IMG_DIR = os.path.join(ROOT, 'img')
 BACKUP_DIR = os.path.join(ROOT, 'backups')
 SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+STORE = get_store(SP_NEW)
+# Mutations from concurrent requests are group-committed by one writer thread
+WRITER = get_writer(STORE)
+EXPORTS = get_export_worker()
 
 # Ensure directories exist
 os.makedirs(BACKUP_DIR, exist_ok=True)
@@ -398,96 +407,35 @@ ADMIN_TEMPLATE = """
 """
 
 def read_spaces():
-    """Read spaces from JSON file"""
-    try:
-        with open(SP_NEW, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-    except json.JSONDecodeError:
-        return []
-
-def backup_and_write_spaces(spaces):
-    """Backup existing file and write new data"""
-    # Create backup
+    """Return the resident list of spaces (reloaded only if the file changed)"""
+    return STORE.spaces()
+
+def backup_spaces(store=None):
+    """Backup the current snapshot (called each time the journal is compacted)"""
     if os.path.exists(SP_NEW):
-        backup_name = f'spaces_new.json.bak.{datetime.utcnow().strftime("%Y%m%d%H%M%S")}'
-        backup_path = os.path.join(BACKUP_DIR, backup_name)
-        shutil.copy2(SP_NEW, backup_path)
-    
-    # Write new data
-    with open(SP_NEW, 'w', encoding='utf-8') as f:
-        json.dump(spaces, f, ensure_ascii=False, indent=2)
-    
-    # Update optimized and timeline files
-    try:
-        # Run export scripts directly
-        os.system(f'cd "{ROOT}" && python3 scripts/export_optimized.py')
-        os.system(f'cd "{ROOT}" && python3 scripts/export_timeline.py')
-        print("✅ Updated optimized and timeline files")
-    except Exception as e:
-        print(f"⚠️  Warning: Could not update export files: {e}")
+        # Only the spaces that changed are stored again; see backup_store.py
+        backup_store.backup_spaces(SP_NEW)
 
-def get_exif_taken_at(img_path):
-    """Extract EXIF timestamp from image file"""
-    import subprocess
-    try:
-        result = subprocess.run([
-            'exiftool',
-            '-CreateDate',
-            '-DateTimeOriginal',
-            img_path
-        ], capture_output=True, text=True, check=True)
-        lines = result.stdout.splitlines()
-        date_value = None
-        for line in lines:
-            if 'Date/Time Original' in line or 'Create Date' in line:
-                # exiftool output: 'Create Date                     : 2025:08:21 09:21:34'
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    date_str = parts[1].strip()
-                    # Convert 'YYYY:MM:DD HH:MM:SS' to ISO 8601 'YYYY-MM-DDTHH:MM:SS'
-                    try:
-                        dt = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                        return dt.isoformat()
-                    except Exception:
-                        # If parsing fails, try alternative format
-                        date_value = date_str.replace(' ', 'T').replace(':', '-', 2)
-                    break
-        return date_value
-    except Exception as e:
-        print(f"Error extracting EXIF from {img_path}: {e}")
-        return None
+STORE.on_compact = backup_spaces
 
-def save_uploaded_files(files, folder_name):
-    """Save uploaded files and return file info"""
-    folder_path = os.path.join(IMG_DIR, folder_name)
-    os.makedirs(folder_path, exist_ok=True)
-    
-    saved_files = []
-    for file in files:
-        if file.filename:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(folder_path, filename)
-            file.save(file_path)
-            
-            rel_path = os.path.relpath(file_path, ROOT).replace('\\', '/')
-            
-            # Try to extract EXIF timestamp, fallback to upload time
-            exif_timestamp = get_exif_taken_at(file_path)
-            taken_at = exif_timestamp if exif_timestamp else datetime.utcnow().isoformat()
-            
-            saved_files.append({
-                'src': rel_path,
-                'taken_at': taken_at
-            })
+def commit_change(op, space_id=None, patch=None, space=None):
+    """Journal one change to the spaces data and queue the export files"""
+    WRITER.apply(op, space_id, patch, space=space)
     
-    return saved_files
+    # Update optimized and timeline files in the background
+    EXPORTS.request([space_id if space is None else space.get('id')])
+
+def save_uploaded_files(files, manifest=None):
+    """Save uploaded files and return file info (in upload order)"""
+    # Stored by content under img/blobs/; new files are processed on the ingest
+    # pool. Upload time if the file has no EXIF date.
+    return ingest.save_uploads(files, default_now=True, manifest=manifest)
 
 @app.route('/')
 def index():
     """Main admin page"""
-    spaces = read_spaces()
+    # The listing only shows header fields; updates stay paged out
+    spaces = STORE.headers()
     return render_template_string(ADMIN_TEMPLATE, spaces=spaces)
 
 @app.route('/create_space', methods=['POST'])
@@ -498,18 +446,14 @@ def create_space():
         created_by = request.form.get('created_by', 'Admin')
         files = request.files.getlist('files')
         
-        if not files or not any(f.filename for f in files):
+        if not request.form.get('files_manifest') and not any(f.filename for f in files):
             return jsonify({'ok': False, 'error': 'No files uploaded'})
         
-        spaces = read_spaces()
-        
         # Get next ID
-        max_id = max((s.get('id', 0) for s in spaces), default=0)
-        new_id = max_id + 1
+        new_id = STORE.next_id()
         
         # Save files
-        folder_name = f"{new_id}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-        saved_files = save_uploaded_files(files, folder_name)
+        saved_files = save_uploaded_files(files, request.form.get('files_manifest'))
         
         # Create new space
         new_space = {
@@ -522,8 +466,7 @@ def create_space():
             'updates': []
         }
         
-        spaces.append(new_space)
-        backup_and_write_spaces(spaces)
+        commit_change('create_space', space=new_space)
         
         return jsonify({'ok': True, 'id': new_id})
         
@@ -539,32 +482,25 @@ def mark_taken():
         instructions = request.form.get('instructions', '')
         instruction_files = request.files.getlist('instruction_files')
         
-        spaces = read_spaces()
-        
         # Find the space
-        space = None
-        for s in spaces:
-            if s.get('id') == space_id:
-                space = s
-                break
+        space = STORE.get(space_id)
         
         if not space:
             return jsonify({'ok': False, 'error': f'Space {space_id} not found'})
         
         # Save instruction files if any
         instruction_images = []
-        if instruction_files and any(f.filename for f in instruction_files):
-            folder_name = f"instruction-{space_id}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-            instruction_images = save_uploaded_files(instruction_files, folder_name)
+        if request.form.get('instruction_files_manifest') or any(f.filename for f in instruction_files):
+            instruction_images = save_uploaded_files(instruction_files, request.form.get('instruction_files_manifest'))
         
         # Update space
-        space['status'] = 'taken'
-        space['taken_by'] = artist_name
-        space['taken_at'] = datetime.utcnow().isoformat()
-        space['instruction_text'] = instructions
-        space['instruction_images'] = instruction_images
-        
-        backup_and_write_spaces(spaces)
+        commit_change('mark_taken', space_id, {'set': {
+            'status': 'taken',
+            'taken_by': artist_name,
+            'taken_at': datetime.utcnow().isoformat(),
+            'instruction_text': instructions,
+            'instruction_images': instruction_images
+        }})
         
         return jsonify({'ok': True})
         
@@ -581,24 +517,17 @@ def add_update():
         status = request.form.get('status', 'draft')
         final_files = request.files.getlist('final_files')
         
-        if not final_files or not any(f.filename for f in final_files):
+        if not request.form.get('final_files_manifest') and not any(f.filename for f in final_files):
             return jsonify({'ok': False, 'error': 'No files uploaded'})
         
-        spaces = read_spaces()
-        
         # Find the space
-        space = None
-        for s in spaces:
-            if s.get('id') == space_id:
-                space = s
-                break
+        space = STORE.get(space_id)
         
         if not space:
             return jsonify({'ok': False, 'error': f'Space {space_id} not found'})
         
         # Save final files
-        folder_name = f"update-{space_id}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-        saved_files = save_uploaded_files(final_files, folder_name)
+        saved_files = save_uploaded_files(final_files, request.form.get('final_files_manifest'))
         
         # Add primary role to first image
         if saved_files:
@@ -616,19 +545,14 @@ def add_update():
             'status': status
         }
         
-        # Add update to space
-        if 'updates' not in space:
-            space['updates'] = []
-        space['updates'].append(update)
-        
-        # Update space status if published
+        # Add update to space, and update space status if published
+        fields = {}
         if status == 'published':
-            space['status'] = 'published'
+            fields['status'] = 'published'
+        fields['modified_by'] = artist_name
+        fields['modified_at'] = datetime.utcnow().isoformat()
         
-        space['modified_by'] = artist_name
-        space['modified_at'] = datetime.utcnow().isoformat()
-        
-        backup_and_write_spaces(spaces)
+        commit_change('add_update', space_id, {'extend': {'updates': [update]}, 'set': fields})
         
         return jsonify({'ok': True})
         
@@ -642,22 +566,18 @@ def manage_space():
         space_id = int(request.form.get('space_id'))
         action = request.form.get('action')
         
-        spaces = read_spaces()
-        
         # Find the space
-        space = None
-        for s in spaces:
-            if s.get('id') == space_id:
-                space = s
-                break
+        space = STORE.get(space_id)
         
         if not space:
             return jsonify({'ok': False, 'error': f'Space {space_id} not found'})
         
         if action == 'unpublish':
             # Change status back to taken
-            space['status'] = 'taken'
-            space['unpublished_at'] = datetime.utcnow().isoformat()
+            commit_change('unpublish', space_id, {'set': {
+                'status': 'taken',
+                'unpublished_at': datetime.utcnow().isoformat()
+            }})
             
         elif action == 'add_instructions':
             instructions = request.form.get('instructions', '')
@@ -665,29 +585,37 @@ def manage_space():
             
             # Save instruction files if any
             instruction_images = []
-            if instruction_files and any(f.filename for f in instruction_files):
-                folder_name = f"instruction-{space_id}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-                instruction_images = save_uploaded_files(instruction_files, folder_name)
+            if request.form.get('instruction_files_manifest') or any(f.filename for f in instruction_files):
+                instruction_images = save_uploaded_files(instruction_files, request.form.get('instruction_files_manifest'))
             
             # Update instructions
-            space['instruction_text'] = instructions
+            patch = {'set': {
+                'instruction_text': instructions,
+                'instructions_updated_at': datetime.utcnow().isoformat()
+            }}
             if instruction_images:
-                if 'instruction_images' not in space:
-                    space['instruction_images'] = []
-                space['instruction_images'].extend(instruction_images)
-            
-            space['instructions_updated_at'] = datetime.utcnow().isoformat()
+                patch['extend'] = {'instruction_images': instruction_images}
+            commit_change('instructions', space_id, patch)
         
         else:
             return jsonify({'ok': False, 'error': 'Invalid action'})
         
-        backup_and_write_spaces(spaces)
-        
         return jsonify({'ok': True})
         
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)})
 
+@app.route('/blob/<sha>', methods=['HEAD'])
+def blob_exists(sha):
+    """200 if an upload with this sha256 can be left out (list it in the <field>_manifest)"""
+    optimize = request.args.get('optimize') == '1'
+    return ('', 200) if blob_store.get_blob_store().has(sha.lower(), optimize) else ('', 404)
+
+@app.route('/export/status')
+def export_status():
+    """Generation and timing of the last background export"""
+    return jsonify({'ok': True, 'export': EXPORTS.status(), 'writer': WRITER.status()})
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--host', default='127.0.0.1')
@@ -698,6 +626,8 @@ def main():
     print("📁 Data will be saved to:", SP_NEW)
     print("🖼️  Images will be saved to:", IMG_DIR)
     
+    # Bring the export files up to date with any journaled changes
+    EXPORTS.request()
     app.run(host=args.host, port=args.port, debug=True)
 
 if __name__ == '__main__':
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Deduplicated, compressed backups of spaces_new.json with point-in-time restore.
+
+Instead of a full copy per backup, a version is a small manifest listing the
+sha256 of its chunks. A chunk is one top-level element of the JSON list (one
+space), cut at the exact byte boundaries of the indent-2 file, so joining the
+chunks gives the file back byte for byte. Chunks are stored once under
+backups/store/objects/ (zstd when the zstandard package is installed, gzip
+otherwise); a backup after editing one space only writes that space's chunk
+and a manifest.
+
+Retention (prune): the newest KEEP_LAST versions, the newest version of each
+hour for the last day and of each day for the last month. Objects no longer
+referenced by a kept version are deleted.
+
+Usage:
+    python3 scripts/backup_store.py snapshot [file]
+    python3 scripts/backup_store.py list
+    python3 scripts/backup_store.py restore --at 2025-09-03T16:00 [--out file]
+    python3 scripts/backup_store.py prune [--dry-run]
+    python3 scripts/backup_store.py import-legacy [--delete]   # backups/*.bak.*
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import os
+import re
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import codec
+from space_journal import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+BACKUP_DIR = os.path.join(ROOT, 'backups')
+STORE_DIR = os.path.join(BACKUP_DIR, 'store')
+
+KEEP_LAST = 10
+HOURLY_FOR = timedelta(days=1)
+DAILY_FOR = timedelta(days=30)
+
+STAMP = '%Y%m%d%H%M%S'
+# Start of every element of an indent-2 top-level list
+_ELEMENT = re.compile(rb'\n  (?=[^ \n\]}])')
+
+
+def chunk(data):
+    """Split file bytes before each top-level list element; b''.join() restores them"""
+    cuts = [m.start() for m in _ELEMENT.finditer(data)]
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+def parse_time(text):
+    """ISO 8601 ('2025-09-03T16:00', '2025-09-03') or a backup stamp (20250903160000)"""
+    text = text.strip()
+    if re.fullmatch(r'\d{8,14}', text):
+        return datetime.strptime(text.ljust(14, '0'), STAMP)
+    return datetime.fromisoformat(text.replace('Z', ''))
+
+
+class BackupStore:
+    """Chunk objects plus one manifest per backed-up version"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.manifests = os.path.join(root, 'versions')
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.manifests, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Keep prune from deleting objects a concurrent snapshot is about to reference"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, '.lock'), 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    # -- objects ---------------------------------------------------------
+
+    def _object_path(self, digest, ext):
+        return os.path.join(self.objects, digest[:2], digest + ext)
+
+    def _find_object(self, digest):
+        for ext in ('.zst', '.gz'):
+            path = self._object_path(digest, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _put(self, data):
+        """Store one chunk if it is new. Returns (digest, bytes written)."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find_object(digest):
+            return digest, 0
+        if zstandard is not None:
+            packed, ext = zstandard.ZstdCompressor(level=10).compress(data), '.zst'
+        else:
+            packed, ext = gzip.compress(data, 9, mtime=0), '.gz'
+        path = self._object_path(digest, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp.{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            f.write(packed)
+        os.replace(tmp, path)
+        return digest, len(packed)
+
+    def _get(self, digest):
+        path = self._find_object(digest)
+        if path is None:
+            raise FileNotFoundError(f'backup object {digest} is missing')
+        with open(path, 'rb') as f:
+            packed = f.read()
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError('zstandard is needed to read ' + path)
+            return zstandard.ZstdDecompressor().decompress(packed)
+        return gzip.decompress(packed)
+
+    # -- versions --------------------------------------------------------
+
+    def versions(self):
+        """All manifests, oldest first"""
+        out = []
+        for name in sorted(os.listdir(self.manifests)):
+            if name.endswith('.json.gz'):
+                with open(os.path.join(self.manifests, name), 'rb') as f:
+                    manifest = codec.loads(gzip.decompress(f.read()))
+                manifest['name'] = name
+                out.append(manifest)
+        out.sort(key=lambda m: (m['valid_from'], m['name']))
+        return out
+
+    def add(self, data, source, valid_from):
+        """Store one version of `source`. Returns (manifest, created)."""
+        sha = hashlib.sha256(data).hexdigest()
+        with self.locked():
+            previous = [m for m in self.versions() if m['source'] == source]
+            # Only skip if nothing changed since the latest backup; an older
+            # identical version must not stand in for a later revert.
+            if previous and previous[-1]['sha256'] == sha:
+                return previous[-1], False
+            chunks, written = [], 0
+            for piece in chunk(data):
+                digest, n = self._put(piece)
+                chunks.append(digest)
+                written += n
+            manifest = {
+                'source': source,
+                'valid_from': valid_from.strftime(STAMP),
+                'created_at': datetime.utcnow().strftime(STAMP),
+                'sha256': sha,
+                'size': len(data),
+                'written': written,
+                'chunks': chunks,
+            }
+            name = f"{manifest['valid_from']}-{sha[:12]}.json.gz"
+            atomic_write(os.path.join(self.manifests, name), gzip.compress(codec.dumps(manifest), 9, mtime=0))
+        manifest['name'] = name
+        return manifest, True
+
+    def snapshot(self, path=SP_NEW, valid_from=None):
+        """Back up a file. Returns its manifest, or None if that content is already stored.
+
+        valid_from is when this content became current; it defaults to the
+        file's mtime, which is what restore --at compares against.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if valid_from is None:
+            valid_from = datetime.utcfromtimestamp(os.stat(path).st_mtime)
+        manifest, created = self.add(data, os.path.basename(path), valid_from)
+        return manifest if created else None
+
+    def build(self, manifest):
+        """Reassemble and verify the bytes of one version"""
+        data = b''.join(self._get(d) for d in manifest['chunks'])
+        if hashlib.sha256(data).hexdigest() != manifest['sha256']:
+            raise ValueError(f"backup {manifest['name']} does not match its checksum")
+        return data
+
+    def at(self, when, source='spaces_new.json'):
+        """The version that was current at `when` (newest with valid_from <= when)"""
+        stamp = when.strftime(STAMP)
+        found = None
+        for m in self.versions():
+            if m['source'] == source and m['valid_from'] <= stamp:
+                found = m
+        return found
+
+    def restore(self, when, out, source='spaces_new.json'):
+        manifest = self.at(when, source)
+        if manifest is None:
+            raise LookupError(f'no backup of {source} at or before {when.isoformat()}')
+        atomic_write(out, self.build(manifest))
+        return manifest
+
+    def prune(self, now=None, dry_run=False):
+        """Apply the retention policy. Returns (removed versions, removed objects)."""
+        now = now or datetime.utcnow()
+        with self.locked():
+            versions = self.versions()
+            by_source = {}
+            for m in versions:
+                by_source.setdefault(m['source'], []).append(m)
+            keep = set()
+            for items in by_source.values():
+                newest_first = items[::-1]
+                keep.update(m['name'] for m in newest_first[:KEEP_LAST])
+                seen = set()
+                for m in newest_first:
+                    t = datetime.strptime(m['valid_from'], STAMP)
+                    if now - t <= HOURLY_FOR:
+                        bucket = t.strftime('%Y%m%d%H')
+                    elif now - t <= DAILY_FOR:
+                        bucket = t.strftime('%Y%m%d')
+                    else:
+                        continue
+                    if bucket not in seen:
+                        seen.add(bucket)
+                        keep.add(m['name'])
+            removed = [m for m in versions if m['name'] not in keep]
+            live = {d for m in versions if m['name'] in keep for d in m['chunks']}
+            dead = []
+            for path in glob.glob(os.path.join(self.objects, '*', '*')):
+                digest = os.path.basename(path).split('.')[0]
+                if digest not in live:
+                    dead.append(path)
+            if not dry_run:
+                for m in removed:
+                    os.remove(os.path.join(self.manifests, m['name']))
+                for path in dead:
+                    os.remove(path)
+        return removed, dead
+
+    def import_legacy(self, pattern=os.path.join(BACKUP_DIR, '*.bak.*'), delete=False):
+        """Move old full-copy backups (name.bak.YYYYmmddHHMMSS) into the store"""
+        imported = 0
+        for path in sorted(glob.glob(pattern)):
+            m = re.search(r'^(.+)\.bak\.(\d{14})$', os.path.basename(path))
+            if not m:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            manifest, created = self.add(data, m.group(1), datetime.strptime(m.group(2), STAMP))
+            imported += created
+            # only once the stored copy has been read back and verified
+            if delete and self.build(manifest) == data:
+                os.remove(path)
+        return imported
+
+
+def backup_spaces(path=SP_NEW):
+    """Store the current snapshot and apply the retention policy (admin on_compact hook)"""
+    store = BackupStore()
+    manifest = store.snapshot(path)
+    store.prune()
+    return manifest
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Deduplicated backups of spaces_new.json')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('snapshot')
+    p.add_argument('file', nargs='?', default=SP_NEW)
+    sub.add_parser('list')
+    p = sub.add_parser('restore')
+    p.add_argument('--at', required=True, help='ISO time or YYYYmmddHHMMSS (UTC)')
+    p.add_argument('--source', default='spaces_new.json')
+    p.add_argument('--out', help='default: <source>.restored.<stamp> in the repo root')
+    p = sub.add_parser('prune')
+    p.add_argument('--dry-run', action='store_true')
+    p = sub.add_parser('import-legacy')
+    p.add_argument('--delete', action='store_true', help='remove each .bak file once stored and verified')
+    args = ap.parse_args(argv[1:])
+
+    store = BackupStore()
+    if args.cmd == 'snapshot':
+        manifest = store.snapshot(args.file)
+        if manifest is None:
+            print('Unchanged since the last backup')
+        else:
+            print(f"Stored {manifest['name']}: {len(manifest['chunks'])} chunks, {manifest['written']} new bytes")
+    elif args.cmd == 'list':
+        for m in store.versions():
+            print(f"{m['valid_from']}  {m['source']:<18}{m['size']:>10} bytes  {len(m['chunks']):>5} chunks"
+                  f"  {m['written']:>8} new  {m['name']}")
+    elif args.cmd == 'restore':
+        when = parse_time(args.at)
+        out = args.out or os.path.join(ROOT, f"{args.source}.restored.{when.strftime(STAMP)}")
+        manifest = store.restore(when, out, args.source)
+        print(f"Restored {manifest['name']} (current from {manifest['valid_from']}) to {out}")
+    elif args.cmd == 'prune':
+        removed, dead = store.prune(dry_run=args.dry_run)
+        verb = 'Would remove' if args.dry_run else 'Removed'
+        print(f'{verb} {len(removed)} versions and {len(dead)} objects')
+    elif args.cmd == 'import-legacy':
+        print(f'Imported {store.import_legacy(delete=args.delete)} legacy backups')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark the JSON backends available to codec.py.
+
+For every installed backend (orjson, msgspec, stdlib json) this measures
+parse, pretty dump and compact dump time plus the peak memory allocated
+during each step (tracemalloc), on the real spaces_new.json and on a
+synthetic dataset with --updates updates (default 100000) spread over
+spaces cloned from the real ones.
+
+Usage:
+    python3 scripts/bench_codec.py [--updates 100000] [--per-space 50] [--repeat 5]
+"""
+import argparse
+import copy
+import os
+import time
+import tracemalloc
+
+import codec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+
+def synthetic(spaces, updates, per_space):
+    """Clone real spaces and give each per_space updates until there are `updates` in total"""
+    template = {
+        'author': 'bench', 'text': 'synthetic update — 合成', 'action': 'update',
+        'images': [{'src': 'img/bench/0.jpg', 'taken_at': '2025-09-01T12:00:00', 'role': 'primary'},
+                   {'src': 'img/bench/1.jpg', 'taken_at': '2025-09-01T12:01:00'}],
+        'created_at': '2025-09-10T00:00:00', 'status': 'published',
+    }
+    out = []
+    made = 0
+    while made < updates:
+        s = copy.deepcopy(spaces[len(out) % len(spaces)])
+        s['id'] = len(out) + 1
+        n = min(per_space, updates - made)
+        s['updates'] = []
+        for i in range(n):
+            upd = copy.deepcopy(template)
+            upd['text'] = f'{upd["text"]} {made + i}'
+            upd['images'][0]['src'] = f'img/bench/{made + i}.jpg'
+            s['updates'].append(upd)
+        made += n
+        out.append(s)
+    return out
+
+
+def measure(fn, repeat):
+    """(best wall time in ms, peak traced allocation in MB)"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / (1024 * 1024)
+
+
+def bench(label, obj, repeat):
+    rows = []
+    for name in codec.BACKENDS:
+        codec.select(name)
+        pretty = codec.dumps_pretty(obj)
+        compact = codec.dumps(obj)
+        parse = measure(lambda: codec.loads(pretty), repeat)
+        dump_pretty = measure(lambda: codec.dumps_pretty(obj), repeat)
+        dump_compact = measure(lambda: codec.dumps(obj), repeat)
+        rows.append((label, name, codec.pretty_backend, len(pretty), len(compact),
+                     parse, dump_pretty, dump_compact))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--updates', type=int, default=100000)
+    ap.add_argument('--per-space', type=int, default=50)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    default = codec.backend
+    spaces = codec.load(SP_NEW)
+    big = synthetic(spaces, args.updates, args.per_space)
+    rows = bench('spaces_new.json', spaces, args.repeat)
+    rows += bench(f'{args.updates} updates', big, args.repeat)
+    codec.select(default)
+
+    print(f"{'dataset':<16}{'backend':<9}{'pretty via':<11}{'pretty':>9}{'compact':>9}"
+          f"  {'parse':>16}  {'dump pretty':>16}  {'dump compact':>16}")
+    for label, name, pretty_via, n_pretty, n_compact, parse, dump_pretty, dump_compact in rows:
+        cells = '  '.join(f'{ms:>7.1f} ms {mb:>5.1f} MB' for ms, mb in (parse, dump_pretty, dump_compact))
+        print(f"{label:<16}{name:<9}{pretty_via:<11}{n_pretty / 1024:>7.0f}KB{n_compact / 1024:>7.0f}KB  {cells}")
+    print(f"(best of {args.repeat}; memory is the peak traced by tracemalloc during one call;"
+          f" default backend here: {default})")
+
+
+if __name__ == '__main__':
+    main()
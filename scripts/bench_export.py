@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark full vs incremental export of spaces_optimized.json and
+spaces_timeline.json.
+
+Runs on the real spaces_new.json (142 spaces) and on a synthetic catalogue
+built by cloning it up to --synthetic spaces (default 50000). For each size
+it times a full rebuild and then an incremental export after changing
+--changed spaces, writing to a temporary directory.
+
+Usage:
+    python3 scripts/bench_export.py [--synthetic 50000] [--changed 1]
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import export_optimized
+import export_timeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+
+def synthetic(spaces, n):
+    """Clone the real spaces with fresh ids until there are n of them"""
+    out = []
+    for i in range(n):
+        s = copy.deepcopy(spaces[i % len(spaces)])
+        s['id'] = i + 1
+        out.append(s)
+    return out
+
+
+def touch(space, i):
+    space.setdefault('updates', []).append({
+        'author': 'bench', 'text': f'bench {i}', 'action': 'update',
+        'images': [{'src': f'img/bench/{i}.jpg', 'taken_at': f'2025-09-{1 + i % 28:02d}T12:00:00', 'role': 'primary'}],
+        'created_at': '2025-09-10T00:00:00', 'status': 'published',
+    })
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def run(label, spaces, changed, tmp):
+    opt_out = os.path.join(tmp, 'optimized.json')
+    tl_out = os.path.join(tmp, 'timeline.json')
+    full_opt = timed(lambda: export_optimized.export_optimized(spaces, out=opt_out))
+    full_tl = timed(lambda: export_timeline.export_timeline(spaces, out=tl_out))
+    ids = []
+    for i, space in enumerate(random.sample(spaces, changed)):
+        touch(space, i)
+        ids.append(space['id'])
+    inc_opt = timed(lambda: export_optimized.export_optimized(spaces, changed_ids=ids, out=opt_out))
+    inc_tl = timed(lambda: export_timeline.export_timeline(spaces, changed_ids=ids, out=tl_out))
+    return (label, len(spaces), full_opt, inc_opt, full_tl, inc_tl)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--synthetic', type=int, default=50000)
+    ap.add_argument('--changed', type=int, default=1)
+    args = ap.parse_args()
+    random.seed(0)
+    with open(SP_NEW, 'r', encoding='utf-8') as f:
+        spaces = json.load(f)
+
+    # Keep the exporters' progress lines out of the table
+    real_stdout = sys.stdout
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            rows.append(run('spaces_new.json', spaces, args.changed, tmp))
+            rows.append(run('synthetic', synthetic(spaces, args.synthetic), args.changed, tmp))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+    print(f"{'dataset':<16}{'spaces':>8}  {'optimized full':>15}{'incremental':>13}  {'timeline full':>14}{'incremental':>13}")
+    for label, n, full_opt, inc_opt, full_tl, inc_tl in rows:
+        print(f"{label:<16}{n:>8}  {full_opt:>12.1f} ms{inc_opt:>10.1f} ms  {full_tl:>11.1f} ms{inc_tl:>10.1f} ms")
+    print(f"({args.changed} space(s) changed per incremental run; times include writing the file)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark the memory held by parsed spaces: plain dicts vs space_model records.
+
+Builds a synthetic dataset with --updates updates (default 100000) from the
+real spaces (see bench_codec.py), then measures what stays allocated
+(tracemalloc) after parsing it into dicts and after parsing it into
+Space/Update/ImageRef records, plus the from_dict()/to_dict() times and a
+check that the records dump back to the same bytes.
+
+Usage:
+    python3 scripts/bench_model.py [--updates 100000] [--per-space 50]
+"""
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+
+import codec
+from bench_codec import synthetic
+from space_model import Space
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+
+def retained(fn):
+    """(ms, MB still allocated by the result, result); timed without tracing"""
+    gc.collect()
+    started = time.perf_counter()
+    fn()
+    elapsed = (time.perf_counter() - started) * 1000
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, current / (1024 * 1024), result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--updates', type=int, default=100000)
+    ap.add_argument('--per-space', type=int, default=50)
+    args = ap.parse_args()
+    raw = codec.dumps_pretty(synthetic(codec.load(SP_NEW), args.updates, args.per_space))
+
+    dict_ms, dict_mb, spaces = retained(lambda: codec.loads(raw))
+    del spaces
+    model_ms, model_mb, records = retained(lambda: Space.from_dicts(codec.loads(raw)))
+    started = time.perf_counter()
+    plain = [s.to_dict() for s in records]
+    to_dict_ms = (time.perf_counter() - started) * 1000
+    del plain
+    same = codec.dumps_pretty(records) == raw
+
+    print(f'{len(records)} spaces, {args.updates} updates, {len(raw) / (1024 * 1024):.1f} MB file')
+    print(f"{'dicts':<8}{dict_ms:>8.0f} ms {dict_mb:>7.1f} MB   (codec.loads)")
+    print(f"{'records':<8}{model_ms:>8.0f} ms {model_mb:>7.1f} MB   (codec.loads + Space.from_dicts)"
+          f"  {model_mb / dict_mb:.0%} of dicts")
+    print(f'to_dict(): {to_dict_ms:.0f} ms; dumps back to identical bytes: {same}')
+
+
+if __name__ == '__main__':
+    main()
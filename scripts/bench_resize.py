@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark photo downscaling: full decode + LANCZOS (the old path) against
+draft/reduce decoding (image_resize.py).
+
+Each image and path runs in a fresh process, so the reported peak RSS is
+what that one resize needed on top of the interpreter and Pillow. Two
+targets are measured: an upload resized to 1080 px (image_pipeline.py) and a
+25% thumbnail (regenerate_thumbnails.py). The last column is the mean
+per-channel difference between the two results (0-255).
+
+The photos in img/ were already resized on upload; --synthetic adds a
+generated camera-sized JPEG to see what a bulk upload straight from a camera
+costs.
+
+Usage:
+    python3 scripts/bench_resize.py [images...]     # default: img/update-*/DSC*.jpg
+    python3 scripts/bench_resize.py --synthetic 6000x4000 [--synthetic 4032x3024]
+"""
+import argparse
+import glob
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from PIL import Image, ImageChops, ImageStat
+except Exception:
+    Image = None
+
+from image_resize import downscale, fit_within, open_scaled, scaled
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = {'1080px': {'max_size': 1080}, 'thumb25': {'scale': 0.25}}
+
+
+def old_path(path, target):
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        size = scaled(img.size, target['scale']) if 'scale' in target else fit_within(img.size, target['max_size'])
+        return img.resize(size, Image.LANCZOS)
+
+
+def new_path(path, target):
+    img, size = open_scaled(path, **target)
+    with img:
+        return downscale(img.convert('RGB'), size)
+
+
+def peak_rss_mb():
+    # VmHWM starts over at exec; ru_maxrss on Linux keeps the parent's peak
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_one(method, target, path):
+    """In the child: one resize, printed as '<ms> <peak RSS MB above baseline>'"""
+    fn = old_path if method == 'old' else new_path
+    base = peak_rss_mb()
+    started = time.perf_counter()
+    fn(path, TARGETS[target])
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f'{elapsed:.1f} {peak_rss_mb() - base:.1f}')
+
+
+def measure(method, target, path):
+    out = subprocess.run([sys.executable, __file__, '--one', method, target, path],
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), float(out[1])
+
+
+def difference(path, target):
+    a, b = old_path(path, TARGETS[target]), new_path(path, TARGETS[target])
+    return sum(ImageStat.Stat(ImageChops.difference(a, b)).mean) / 3
+
+
+def synthetic_photo(size, directory):
+    """A camera-sized JPEG (noise over gradients, so it compresses like a photo)"""
+    w, h = size
+    gradient = Image.linear_gradient('L')
+    bands = [Image.blend(Image.effect_noise(size, 40).convert('L'), gradient.resize(size), 0.7),
+             gradient.rotate(90).resize(size), gradient.rotate(45).resize(size)]
+    path = os.path.join(directory, f'synthetic-{w}x{h}.jpg')
+    Image.merge('RGB', bands).save(path, 'JPEG', quality=92)
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('images', nargs='*')
+    ap.add_argument('--synthetic', action='append', default=[], metavar='WxH')
+    ap.add_argument('--one', nargs=3, metavar=('METHOD', 'TARGET', 'PATH'), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if Image is None:
+        raise SystemExit('bench_resize.py needs Pillow (pip install pillow)')
+    if args.one:
+        run_one(*args.one)
+        return
+
+    images = list(args.images)
+    if not images and not args.synthetic:
+        images = sorted(glob.glob(os.path.join(ROOT, 'img', 'update-*', 'DSC*.jpg')))
+    tmp = tempfile.TemporaryDirectory()
+    for spec in args.synthetic:
+        images.append(synthetic_photo(tuple(int(v) for v in spec.lower().split('x')), tmp.name))
+    print(f"{'image':<34}{'target':<9}{'old ms':>8}{'new ms':>8}{'old MB':>8}{'new MB':>8}{'diff':>6}")
+    totals = {}
+    for path in images:
+        with Image.open(path) as img:
+            label = f'{os.path.basename(path)} {img.size[0]}x{img.size[1]}'
+        for target in TARGETS:
+            old_ms, old_mb = measure('old', target, path)
+            new_ms, new_mb = measure('new', target, path)
+            diff = difference(path, target)
+            t = totals.setdefault(target, [0, 0, 0, 0])
+            for i, v in enumerate((old_ms, new_ms, old_mb, new_mb)):
+                t[i] += v
+            print(f'{label:<34}{target:<9}{old_ms:>8.0f}{new_ms:>8.0f}{old_mb:>8.1f}{new_mb:>8.1f}{diff:>6.2f}')
+    n = len(images)
+    for target, (old_ms, new_ms, old_mb, new_mb) in totals.items():
+        print(f'mean {target}: {old_ms / n:.0f} -> {new_ms / n:.0f} ms, '
+              f'peak {old_mb / n:.1f} -> {new_mb / n:.1f} MB per image')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark the similar-spaces index (similar_spaces.py) on synthetic embeddings.
+
+Vectors are drawn around random centres (photos of a catalogue cluster by
+place and subject), normalized like CLIP embeddings. For each size the
+brute-force index and the clustered (IVF) one answer the same queries;
+reported are build time, median and p99 query latency, recall@k of the IVF
+answers against the exact ones, and the time of all_similar() as run by
+export_optimized.py.
+
+Usage:
+    python3 scripts/bench_similar.py [--sizes 1000,10000,50000] [--dim 512] [-k 6]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from similar_spaces import SimilarityIndex
+
+
+def synthetic(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(max(1, n // 100), dim)).astype(np.float32)
+    vectors = centres[rng.integers(len(centres), size=n)] + 0.8 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - started) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='1000,10000,50000')
+    ap.add_argument('--dim', type=int, default=512)
+    ap.add_argument('-k', type=int, default=6)
+    ap.add_argument('--queries', type=int, default=200)
+    args = ap.parse_args()
+
+    print(f"{'n':>7}{'index':>7}{'build ms':>10}{'p50 ms':>9}{'p99 ms':>9}{'recall':>8}{'all ms':>10}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        vectors = synthetic(n, args.dim)
+        ids = list(range(n))
+        queries = np.random.default_rng(1).choice(n, min(n, args.queries), replace=False)
+        exact = None
+        for name, ivf in (('brute', False), ('ivf', True)):
+            index, build_ms = timed(lambda: SimilarityIndex(ids, vectors, ivf=ivf))
+            latencies, answers = [], []
+            for q in queries:
+                found, ms = timed(lambda: index.similar(int(q), args.k))
+                latencies.append(ms)
+                answers.append({i for i, _ in found})
+            if exact is None:
+                exact = answers
+            recall = np.mean([len(a & e) / len(e) for a, e in zip(answers, exact)])
+            _, all_ms = timed(lambda: index.all_similar(args.k))
+            print(f'{n:>7}{name:>7}{build_ms:>10.0f}{np.percentile(latencies, 50):>9.2f}'
+                  f'{np.percentile(latencies, 99):>9.2f}{recall:>8.3f}{all_ms:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
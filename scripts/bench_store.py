@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark what the admin index costs as update histories grow.
+
+Builds snapshots with the real spaces and --per-space synthetic updates
+each (several sizes), then measures, in a temporary directory:
+- full parse: codec.load() of the whole file (what every read used to do)
+- index load: a fresh SpaceStore reading the header index + headers()
+- get(): paging one space in
+Memory is what stays allocated afterwards (tracemalloc).
+
+Usage:
+    python3 scripts/bench_store.py [--per-space 0 50 200 800]
+"""
+import argparse
+import copy
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import codec
+from space_store import SpaceStore, dump_snapshot
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+
+def with_history(spaces, per_space):
+    out = copy.deepcopy(spaces)
+    for s in out:
+        s['updates'] = list(s.get('updates') or []) + [{
+            'author': 'bench', 'text': f'update {i}', 'action': 'update',
+            'images': [{'src': f"img/bench/{s.get('id')}-{i}.jpg", 'taken_at': '2025-09-01T12:00:00', 'role': 'primary'}],
+            'created_at': '2025-09-10T00:00:00', 'status': 'published',
+        } for i in range(per_space)]
+    return out
+
+
+def measure(fn):
+    """(ms, MB still allocated by the result)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = (time.perf_counter() - started) * 1000
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, current / (1024 * 1024)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--per-space', type=int, nargs='+', default=[0, 50, 200, 800])
+    args = ap.parse_args()
+    spaces = codec.load(SP_NEW)
+    print(f"{'updates':>9}{'file':>9}  {'full parse':>18}  {'index + headers()':>20}  {'get()':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for per_space in args.per_space:
+            path = os.path.join(tmp, f'spaces_{per_space}.json')
+            data = with_history(spaces, per_space)
+            with open(path, 'wb') as f:
+                f.write(dump_snapshot(data))
+            SpaceStore(path).headers()  # writes the index sidecar
+            updates = sum(len(s['updates']) for s in data)
+            del data
+
+            def index_load():
+                store = SpaceStore(path)
+                store.headers()
+                return store
+            # before the full parse, so its garbage does not land in this timing
+            index = measure(index_load)
+            full = measure(lambda: codec.load(path))
+            store = index_load()
+            sid = store.headers()[len(spaces) // 2]['id']
+            get_ms, _ = measure(lambda: store.get(sid))
+            size = os.path.getsize(path) / (1024 * 1024)
+            print(f"{updates:>9}{size:>7.1f}MB  {full[0]:>7.1f} ms {full[1]:>6.1f} MB  "
+                  f"{index[0]:>9.1f} ms {index[1]:>6.1f} MB  {get_ms:>5.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Content-addressed storage for uploaded images.
+
+An upload is hashed (sha256) while it streams to a staging file and is then
+stored once under img/blobs/<first 2 hex>/<sha256>, whatever space, update or
+instruction it belongs to. Uploading the same bytes again only adds a
+reference to the stored file: nothing new is written or recompressed.
+
+Two variants can exist per upload, both named after the sha256 of the
+uploaded bytes (which is what a client can compute before uploading):
+    <sha256>.<ext>      the file as uploaded (/save, admin_simple)
+    <sha256>.opt.jpg    resized/re-encoded by image_pipeline.py (/mark_multiple,
+                        /publish_update)
+The optimized variant can be made from the stored original without a new
+upload. `HEAD /blob/<sha256>[?optimize=1]` on the admin servers answers 200
+when an upload of those bytes can be skipped (see ingest.save_uploads and
+its manifest).
+
+Blobs are shared, so they are never deleted when an update is reverted;
+`gc` removes the ones no space refers to any more.
+
+Usage:
+    python3 scripts/blob_store.py stats
+    python3 scripts/blob_store.py gc [--dry-run]
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+
+from space_model import is_mapping
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+BLOB_DIR = os.path.join(ROOT, 'img', 'blobs')
+
+OPTIMIZED = '.opt.jpg'
+CHUNK = 1 << 20
+# files younger than this may belong to an upload that is still in progress
+STAGING_GRACE = 3600
+
+_SHA = re.compile(r'[0-9a-f]{64}')
+
+
+def is_sha256(text):
+    return bool(_SHA.fullmatch(text or ''))
+
+
+def clean_ext(filename):
+    """'.jpg'-style extension of an upload name (lowercase, '.jpg' if none)"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,5}', ext) else '.jpg'
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.staging = os.path.join(root, 'staging')
+
+    def path(self, sha, ext):
+        return os.path.join(self.root, sha[:2], sha + ext)
+
+    def find(self, sha, optimize=False):
+        """Stored path of a variant (optimized, or the original with any extension), or None"""
+        if not is_sha256(sha):
+            return None
+        if optimize:
+            path = self.path(sha, OPTIMIZED)
+            return path if os.path.exists(path) else None
+        try:
+            names = os.listdir(os.path.join(self.root, sha[:2]))
+        except FileNotFoundError:
+            return None
+        for name in sorted(names):
+            if name.startswith(sha + '.') and not name.endswith(OPTIMIZED):
+                return os.path.join(self.root, sha[:2], name)
+        return None
+
+    def has(self, sha, optimize=False):
+        """Can an upload of these bytes be skipped? (an optimized copy can be made from the original)"""
+        return self.find(sha, optimize) is not None or (optimize and self.find(sha) is not None)
+
+    def stage(self, stream):
+        """Copy a stream to a staging file, hashing it on the way. Returns (sha256, staging path)."""
+        os.makedirs(self.staging, exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.staging, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in iter(lambda: stream.read(CHUNK), b''):
+                    h.update(block)
+                    f.write(block)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return h.hexdigest(), tmp
+
+    def stage_copy(self, path):
+        """A staging copy of a stored blob (to derive another variant from it)"""
+        with open(path, 'rb') as f:
+            return self.stage(f)[1]
+
+    def discard(self, tmp):
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+
+    def blobs(self):
+        for dirpath, dirnames, names in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d != 'staging']
+            for name in names:
+                if _SHA.fullmatch(name[:64]):
+                    yield os.path.join(dirpath, name)
+
+    def gc(self, referenced, dry_run=False):
+        """Delete blobs not in `referenced` (repo-relative srcs) and stale staging files.
+
+        Recent files are kept: their upload may not be journaled yet.
+        """
+        cutoff = time.time() - STAGING_GRACE
+        dead = [p for p in self.blobs()
+                if os.path.relpath(p, ROOT).replace('\\', '/') not in referenced
+                and os.path.getmtime(p) < cutoff]
+        if os.path.isdir(self.staging):
+            dead += [os.path.join(self.staging, n) for n in os.listdir(self.staging)
+                     if os.path.getmtime(os.path.join(self.staging, n)) < cutoff]
+        if not dry_run:
+            for path in dead:
+                os.remove(path)
+        return dead
+
+
+def is_blob(src):
+    """Is a repo-relative src a shared blob (which must not be deleted with one reference)?"""
+    return (src or '').replace('\\', '/').startswith('img/blobs/')
+
+
+def referenced_srcs(spaces):
+    """Every image src used by the spaces (images, updates, instructions, artists)"""
+    out = set()
+
+    def add(images):
+        for img in images or []:
+            src = img.get('src') if is_mapping(img) else img
+            if isinstance(src, str):
+                out.add(src)
+
+    for s in spaces:
+        add(s.get('images'))
+        add(s.get('instruction_images'))
+        for upd in s.get('updates') or []:
+            add(upd.get('images'))
+        for artist in s.get('taken_artists') or []:
+            add(artist.get('instruction_images'))
+    return out
+
+
+_store = None
+
+
+def get_blob_store():
+    global _store
+    if _store is None:
+        _store = BlobStore()
+    return _store
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Content-addressed image storage')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('stats')
+    p = sub.add_parser('gc')
+    p.add_argument('--dry-run', action='store_true')
+    args = ap.parse_args(argv[1:])
+
+    store = get_blob_store()
+    if args.cmd == 'stats':
+        paths = list(store.blobs())
+        size = sum(os.path.getsize(p) for p in paths)
+        print(f'{len(paths)} blobs, {size / (1024 * 1024):.1f} MB in {store.root}')
+    elif args.cmd == 'gc':
+        from space_store import get_store
+        dead = store.gc(referenced_srcs(get_store(SP_NEW).spaces()), dry_run=args.dry_run)
+        verb = 'Would remove' if args.dry_run else 'Removed'
+        print(f'{verb} {len(dead)} unreferenced files')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
-import json
+"""
+Label every space with the CLIP space type and activity its first image
+fits best (clip_type, clip_activity) and write spaces_clip.json.
+
+Embeddings come from the cache in clip_embeddings.py: only images (and
+label texts) not encoded before go through CLIP, in batches with the next
+batch decoded on a loader thread. With everything cached, as on a rerun or
+with new label lists over the same photos, labelling needs no model and is
+one matrix multiply of the image embeddings with the label embeddings.
+Spaces without an image file are matched on their description instead.
+
+Spaces are read through the space store (space_store.py), so creations and
+image changes still in the journal, or in the SQLite backend, are labelled too.
+
+Usage:
+    python3 scripts/catagorize_space.py [--batch-size 32] [--out spaces_clip.json]
+"""
+import argparse
 import os
+import time
+
+import numpy as np
 from tqdm import tqdm
 
-import torch
-from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+import codec
+from clip_embeddings import BATCH_SIZE, ensure_image_embeddings, get_embedding_cache, space_image, text_embeddings
+from space_model import is_mapping, plain
+from space_store import get_store
 
-# Load CLIP model and processor
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch16").to(device)
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch16")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
 
 # Space types and activity suitability lists
 space_types = [
@@ -22,48 +41,72 @@ activity_types = [
     "sitting", "hanging", "flying", "lying", "standing", "walking", "resting", "gathering", "working",
     "eating", "sleeping", "reading", "meditating", "playing"
 ]
+LABELS = {"clip_type": space_types, "clip_activity": activity_types}
+
+
+def best_labels(embeddings, labels=LABELS):
+    """{field: [label per row]} of normalized embeddings, from one matrix multiply"""
+    names = list(labels)
+    matrix = np.concatenate([text_embeddings(labels[n]) for n in names])
+    scores = embeddings @ matrix.T
+    out, start = {}, 0
+    for name in names:
+        end = start + len(labels[name])
+        out[name] = [labels[name][i] for i in scores[:, start:end].argmax(axis=1)]
+        start = end
+    return out
+
+
+def description_text(space):
+    desc = space.get("description") or ""
+    if is_mapping(desc):
+        desc = desc.get("en") or next(iter(desc.values()), "")
+    return desc or ""
+
+
+def categorize(spaces, batch_size=BATCH_SIZE):
+    """Set clip_type and clip_activity of every space; returns (images encoded, spaces by description)"""
+    paths = {}
+    for space in spaces:
+        path = space_image(space)
+        if path:
+            paths[id(space)] = path
+
+    with tqdm(total=len(set(paths.values())), unit="img", desc="encoding new images") as bar:
+        before = len(get_embedding_cache("image"))
+        shas = ensure_image_embeddings(list(dict.fromkeys(paths.values())), batch_size, bar.update)
+        encoded = len(get_embedding_cache("image")) - before
+
+    with_image = [s for s in spaces if paths.get(id(s)) in shas]
+    # no (readable) image: match the description instead
+    rest = [s for s in spaces if paths.get(id(s)) not in shas]
+    for group, embeddings in (
+            (with_image, get_embedding_cache("image").vectors([shas[paths[id(s)]] for s in with_image])),
+            (rest, text_embeddings([description_text(s) for s in rest]))):
+        if not group:
+            continue
+        for field, values in best_labels(embeddings).items():
+            for space, value in zip(group, values):
+                space[field] = value
+    return encoded, len(rest)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Label spaces with CLIP space and activity types")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--out", default=os.path.join(ROOT, "spaces_clip.json"))
+    args = ap.parse_args()
+
+    # copies: the labels are added to these, not to the store's records
+    spaces = [plain(s) for s in get_store(SP_NEW).spaces()]
+
+    started = time.perf_counter()
+    encoded, texts = categorize(spaces, args.batch_size)
+    elapsed = time.perf_counter() - started
+    codec.dump(spaces, args.out)
+    print(f"Done! Labelled {len(spaces)} spaces ({encoded} images newly encoded, {texts} by description) "
+          f"in {elapsed:.1f}s. Output written to {args.out}")
+
 
-def get_best_label(image_path, description, candidates):
-    # Try image first, fallback to description if image not found
-    inputs = None
-    if image_path and os.path.exists(image_path):
-        image = Image.open(image_path).convert("RGB")
-        inputs = processor(text=candidates, images=image, return_tensors="pt", padding=True)
-    else:
-        # Text-to-text fallback
-        inputs = processor(text=[description] + candidates, return_tensors="pt", padding=True)
-        # Use first text as "image" embedding
-        inputs["pixel_values"] = torch.zeros((1, 3, 224, 224))  # dummy image
-
-    for k in inputs:
-        if isinstance(inputs[k], torch.Tensor):
-            inputs[k] = inputs[k].to(device)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits_per_image = outputs.logits_per_image if hasattr(outputs, "logits_per_image") else outputs.logits_per_text
-        probs = logits_per_image.softmax(dim=1).cpu().numpy()
-    best_idx = probs.argmax()
-    return candidates[best_idx]
-
-src = "spaces_new.json" if os.path.exists("spaces_new.json") else "spaces.json"
-with open(src, "r", encoding="utf-8") as f:
-    spaces = json.load(f)
-
-for space in tqdm(spaces):
-    img_path = space["images"][0] if space["images"] else None
-    # Try to find the image file
-    if img_path and not os.path.exists(img_path) and os.path.exists(os.path.join("img", os.path.basename(img_path))):
-        img_path = os.path.join("img", os.path.basename(img_path))
-    desc = space.get("description", "")
-    # Assign best space type
-    best_type = get_best_label(img_path, desc, space_types)
-    # Assign best activity
-    best_activity = get_best_label(img_path, desc, activity_types)
-    # Add to space
-    space["clip_type"] = best_type
-    space["clip_activity"] = best_activity
-
-with open("spaces_clip.json", "w") as f:
-    json.dump(spaces, f, indent=2, ensure_ascii=False)
-
-print("Done! Output written to spaces_clip.json")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+CLIP embeddings of images and texts, cached on disk by content hash.
+
+Each kind has two git-ignored files under img/.embeddings/:
+    <model>.<kind>.npy     float16 matrix, one normalized embedding per row
+    <model>.<kind>.index   the sha256 of each row, one 64-character line per row
+Images are keyed by the sha256 of their file (from image_meta_cache.py), texts
+(labels, descriptions, queries) by the sha256 of their UTF-8 bytes, so only
+new or changed content is ever encoded. The matrix is an ordinary .npy that
+readers open with mmap, paging in only the rows they touch. New rows are
+written past its end and the shape in its header (which has room to grow)
+is updated in place, then their lines are appended to the index; neither
+file is rewritten. Rows written without their index lines (a crash in
+between) are overwritten by the next append. Appends by several processes
+(an update run next to catagorize_space.py) take turns on a flock of the
+index file.
+
+torch and transformers are only needed to encode something new: labelling,
+similarity and search over cached vectors are plain NumPy.
+
+Usage:
+    from clip_embeddings import ensure_image_embeddings, get_embedding_cache, text_embeddings
+    shas = ensure_image_embeddings(paths)      # {path: sha256}, encoding new images only
+    vectors = get_embedding_cache('image').vectors([shas[p] for p in paths])
+    labels = text_embeddings(['wall', 'floor'])
+
+    python3 scripts/clip_embeddings.py [update]    # embed the first image of every space
+    python3 scripts/clip_embeddings.py stats
+"""
+import hashlib
+import os
+import queue
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from image_meta_cache import get_cache
+from image_resize import draft, scaled
+from space_model import is_mapping
+
+try:
+    import torch
+    from transformers import CLIPModel, CLIPProcessor
+except Exception:
+    torch = None
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+EMBED_DIR = os.path.join(ROOT, 'img', '.embeddings')
+
+MODEL = "openai/clip-vit-base-patch16"
+BATCH_SIZE = 32
+# batches decoded ahead of the model
+PREFETCH = 2
+# CLIP looks at a 224 px center crop
+INPUT_SIZE = 224
+
+# .npy header padded to a fixed size, so a longer shape fits when rows are added
+HEADER_BYTES = 128
+INDEX_LINE = 65
+
+_model = None
+_model_lock = threading.Lock()
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _npy_header(rows, dim):
+    header = "{'descr': '<f2', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    prefix = b'\x93NUMPY\x01\x00' + (HEADER_BYTES - 10).to_bytes(2, 'little')
+    return prefix + header.encode('latin1').ljust(HEADER_BYTES - len(prefix) - 1) + b'\n'
+
+
+def _npy_shape(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_BYTES).decode('latin1')
+    rows, dim = re.search(r"'shape': \((\d+), (\d+)\)", header).groups()
+    return int(rows), int(dim)
+
+
+class EmbeddingCache:
+    """Append-only float16 matrix of normalized embeddings with a sha256 -> row index"""
+
+    def __init__(self, kind, model=MODEL, root=EMBED_DIR):
+        name = f"{model.rsplit('/', 1)[-1]}.{kind}"
+        self.matrix_path = os.path.join(root, name + '.npy')
+        self.index_path = os.path.join(root, name + '.index')
+        self.lock = threading.Lock()
+        self.shas = []
+        self.rows = {}
+        self.dim = None
+        self._matrix = None
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        """Read index lines appended since the last call (by this or another process)"""
+        try:
+            complete = os.path.getsize(self.index_path) // INDEX_LINE
+        except FileNotFoundError:
+            complete = 0
+        if complete < len(self.shas):
+            # truncated by a writer recovering from a crash
+            self.shas, self.rows = [], {}
+        if complete > len(self.shas):
+            with open(self.index_path, 'rb') as f:
+                f.seek(len(self.shas) * INDEX_LINE)
+                data = f.read((complete - len(self.shas)) * INDEX_LINE).decode('ascii')
+            for line in data.splitlines():
+                self.rows[line] = len(self.shas)
+                self.shas.append(line)
+        if self._matrix is None or len(self._matrix) != len(self.shas):
+            self._matrix = None
+            if self.shas:
+                rows, self.dim = _npy_shape(self.matrix_path)
+                if rows < len(self.shas):
+                    # index lines whose rows were lost in a crash are not used
+                    del self.shas[rows:]
+                    self.rows = {sha: i for i, sha in enumerate(self.shas)}
+                self._matrix = np.memmap(self.matrix_path, dtype='<f2', mode='r', offset=HEADER_BYTES,
+                                         shape=(len(self.shas), self.dim))
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock across processes, on the index file (never replaced, so every process locks the same file)"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with open(self.index_path, 'ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Pick up rows another process appended"""
+        with self.lock:
+            self._load()
+
+    def __len__(self):
+        return len(self.shas)
+
+    def __contains__(self, sha):
+        return sha in self.rows
+
+    @property
+    def matrix(self):
+        """(rows, dim) float16 memmap of every cached embedding, in index order"""
+        with self.lock:
+            if self._matrix is None:
+                return np.zeros((0, self.dim or 0), dtype='<f2')
+            return self._matrix
+
+    def vectors(self, shas):
+        """float32 (len(shas), dim) array of cached embeddings; KeyError for one not cached"""
+        with self.lock:
+            rows = [self.rows[sha] for sha in shas]
+            if not rows:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def add(self, shas, embeddings):
+        """Append rows for shas (embeddings: (len(shas), dim), normalized)"""
+        embeddings = np.asarray(embeddings, dtype='<f2')
+        if not len(shas):
+            return
+        # another process appending at the same time would write the same rows
+        with self.lock, self._locked():
+            self._load()
+            os.makedirs(os.path.dirname(self.matrix_path), exist_ok=True)
+            if self.dim is None and os.path.exists(self.matrix_path):
+                self.dim = _npy_shape(self.matrix_path)[1]
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                with open(self.matrix_path, 'wb') as f:
+                    f.write(_npy_header(0, self.dim))
+            if embeddings.shape[1] != self.dim:
+                raise ValueError(f'embeddings have {embeddings.shape[1]} dimensions, the cache {self.dim}')
+            # _load() left out index lines without rows; rows without index lines are overwritten
+            rows = len(self.shas)
+            total = rows + len(shas)
+            with open(self.matrix_path, 'r+b') as f:
+                f.seek(HEADER_BYTES + rows * self.dim * 2)
+                f.write(embeddings.tobytes())
+                f.truncate()
+                f.seek(0)
+                f.write(_npy_header(total, self.dim))
+            with open(self.index_path, 'ab') as f:
+                # drop a partly written line or lines whose rows were lost
+                f.truncate(rows * INDEX_LINE)
+                f.write(''.join(f'{sha}\n' for sha in shas).encode('ascii'))
+            self._load()
+
+    def stats(self):
+        with self.lock:
+            size = os.path.getsize(self.matrix_path) if self.shas else 0
+            return {'rows': len(self.shas), 'dim': self.dim, 'bytes': size, 'path': self.matrix_path}
+
+
+def get_embedding_cache(kind='image'):
+    """The 'image' or 'text' cache of this process"""
+    key = (kind, os.getpid())
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = EmbeddingCache(kind)
+        else:
+            cache.refresh()
+        return cache
+
+
+def get_model():
+    """(model, processor, device), loaded on first use"""
+    global _model
+    if torch is None:
+        raise RuntimeError('encoding with CLIP needs torch and transformers (pip install torch transformers)')
+    with _model_lock:
+        if _model is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model = CLIPModel.from_pretrained(MODEL).to(device).eval()
+            _model = (model, CLIPProcessor.from_pretrained(MODEL), device)
+        return _model
+
+
+def _normalized(features):
+    features = features / features.norm(dim=-1, keepdim=True)
+    return features.float().cpu().numpy()
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def encode_texts(texts):
+    """Normalized text-tower embeddings of texts (rows), not cached"""
+    model, processor, device = get_model()
+    out = []
+    for i in range(0, len(texts), BATCH_SIZE):
+        inputs = processor(text=list(texts[i:i + BATCH_SIZE]), return_tensors="pt",
+                           padding=True, truncation=True).to(device)
+        with torch.inference_mode():
+            out.append(_normalized(model.get_text_features(**inputs)))
+    return np.concatenate(out)
+
+
+def text_embeddings(texts):
+    """Normalized embeddings of texts (rows), encoding only texts not cached yet"""
+    cache = get_embedding_cache('text')
+    keys = [text_key(t) for t in texts]
+    missing = {k: t for k, t in zip(keys, texts) if k not in cache}
+    if missing:
+        cache.add(list(missing), encode_texts(list(missing.values())))
+    return cache.vectors(keys)
+
+
+def load_image(path):
+    """Upright RGB pixels of path, decoded no larger than CLIP needs; None if unreadable"""
+    try:
+        with Image.open(path) as im:
+            draft(im, scaled(im.size, min(1.0, INPUT_SIZE / min(im.size))))
+            return ImageOps.exif_transpose(im).convert("RGB")
+    except Exception as e:
+        print(f"⚠️  Warning: could not read {path}: {e}")
+        return None
+
+
+def image_batches(paths, batch_size, processor=None):
+    """(paths, pixel_values) per batch, loaded and preprocessed on a background thread.
+
+    processor is CLIP's unless another model's (BLIP-2 in describe_spaces.py,
+    which also looks at 224 px) is given; unreadable images are left out.
+    """
+    if processor is None:
+        _, processor, _ = get_model()
+    out = queue.Queue(maxsize=PREFETCH)
+    done = object()
+
+    def load():
+        try:
+            for i in range(0, len(paths), batch_size):
+                loaded = [(p, load_image(p)) for p in paths[i:i + batch_size]]
+                loaded = [(p, im) for p, im in loaded if im is not None]
+                if loaded:
+                    pixels = processor(images=[im for _, im in loaded], return_tensors="pt")["pixel_values"]
+                    out.put(([p for p, _ in loaded], pixels))
+            out.put(done)
+        except BaseException as e:
+            out.put(e)
+
+    threading.Thread(target=load, daemon=True).start()
+    for item in iter(out.get, done):
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def encode_images(paths, batch_size=BATCH_SIZE):
+    """Yields (paths, normalized image embeddings) per batch, not cached; unreadable images are left out"""
+    model, _, device = get_model()
+    for batch, pixels in image_batches(list(paths), batch_size):
+        with torch.inference_mode():
+            yield batch, _normalized(model.get_image_features(pixel_values=pixels.to(device)))
+
+
+def ensure_image_embeddings(paths, batch_size=BATCH_SIZE, progress=None):
+    """{path: sha256} of the image files among paths that have an embedding.
+
+    Images whose bytes are not in the cache yet are encoded, each batch
+    appended as soon as it is done (so an interrupted run keeps its work);
+    progress(n) is called with the number of images encoded per batch.
+    """
+    meta = get_cache()
+    shas = {}
+    for path in paths:
+        m = meta.get(path)
+        if m is not None:
+            shas[path] = m['sha256']
+    cache = get_embedding_cache('image')
+    missing = {}
+    for path, sha in shas.items():
+        if sha not in cache:
+            missing.setdefault(sha, path)
+    if missing:
+        for batch, embeddings in encode_images(list(missing.values()), batch_size):
+            cache.add([shas[p] for p in batch], embeddings)
+            if progress:
+                progress(len(batch))
+    return {p: sha for p, sha in shas.items() if sha in cache}
+
+
+def space_image(space):
+    """File of the space's first image, or None"""
+    images = space.get("images") or []
+    if not images:
+        return None
+    src = images[0].get("src") if is_mapping(images[0]) else images[0]
+    if not src:
+        return None
+    path = os.path.join(ROOT, src)
+    if not os.path.exists(path):
+        # older entries may point outside img/
+        path = os.path.join(ROOT, "img", os.path.basename(src))
+    return path if os.path.exists(path) else None
+
+
+def main(argv):
+    cmd = argv[1] if len(argv) > 1 else 'update'
+    if cmd == 'update':
+        from space_store import get_store
+        paths = [p for p in (space_image(s) for s in get_store(SP_NEW).spaces()) if p]
+        before = len(get_embedding_cache('image'))
+        ensure_image_embeddings(paths)
+        print(f'{len(get_embedding_cache("image")) - before} images encoded, {len(paths)} space images')
+    elif cmd == 'stats':
+        for kind in ('image', 'text'):
+            s = get_embedding_cache(kind).stats()
+            print(f"{kind}: {s['rows']} embeddings of {s['dim']} dimensions, "
+                  f"{s['bytes'] / (1024 * 1024):.1f} MB ({s['path']})")
+    else:
+        raise SystemExit('Usage: clip_embeddings.py update | stats')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+JSON codec shared by the scripts that read and write the spaces files.
+
+Uses orjson or msgspec when one of them is installed and falls back to the
+stdlib json module otherwise. Set SPACES_JSON_BACKEND=orjson|msgspec|json
+to force a backend.
+
+Two output modes, both returning UTF-8 bytes:
+- dumps_pretty(): indent=2 with non-ASCII characters kept, for the
+  git-tracked canonical files (spaces_new.json, spaces.json). A fast backend
+  is only used for this mode if it produces exactly the same bytes as
+  json.dump(indent=2, ensure_ascii=False), so switching backends never
+  shows up as a diff.
+- dumps(): compact, for the generated frontend exports and the journal.
+
+Objects with a to_dict() method (the space_model records) are encoded as
+the dict it returns.
+
+Usage:
+    import codec
+    spaces = codec.load(path)
+    codec.dump(spaces, path)               # pretty
+    body = codec.dumps(entry)              # compact bytes
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj):
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return to_dict()
+
+
+def _stdlib_loads(data):
+    return json.loads(data)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def _stdlib_dumps_pretty(obj):
+    return json.dumps(obj, ensure_ascii=False, indent=2, default=_default).encode('utf-8')
+
+
+# name -> (loads, compact dumps, pretty dumps); only installed backends
+BACKENDS = {}
+if orjson is not None:
+    BACKENDS['orjson'] = (
+        orjson.loads,
+        lambda obj: orjson.dumps(obj, default=_default),
+        lambda obj: orjson.dumps(obj, default=_default, option=orjson.OPT_INDENT_2),
+    )
+if msgspec is not None:
+    _msgspec_decoder = msgspec.json.Decoder()
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=_default)
+    BACKENDS['msgspec'] = (
+        _msgspec_decoder.decode,
+        _msgspec_encoder.encode,
+        lambda obj: msgspec.json.format(_msgspec_encoder.encode(obj), indent=2),
+    )
+BACKENDS['json'] = (_stdlib_loads, _stdlib_dumps, _stdlib_dumps_pretty)
+
+# Exceptions raised for malformed input by any backend
+DecodeError = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+
+# Covers the shapes the spaces files contain: nesting, empty containers,
+# non-ASCII text, escapes, ints, floats, bools and null. Float spelling
+# differs between encoders (orjson writes 1e-05 as 0.00001, 1e+20 as 1e20)
+_PROBE = [{'id': 1, 'description': {'en': 'a "b"\n\tc\\', 'ja': '空間 — é'},
+           'images': [], 'meta': {}, 'tags': ['x', 2, True, False, None],
+           'nested': [[{'k': [1, 2]}], {}], 'ctrl': '\x01\x1f\x7f',
+           'floats': [0.1, 1.5, 1e-05, 1e+20, -0.0, 123456789.125]}, -5, 'z']
+
+
+def _pretty_matches(name):
+    try:
+        return BACKENDS[name][2](_PROBE) == _stdlib_dumps_pretty(_PROBE)
+    except Exception:
+        return False
+
+
+def select(name=None):
+    """Switch the module-level functions to a backend (default: fastest installed)"""
+    global backend, pretty_backend, loads, dumps, dumps_pretty
+    if name is None:
+        name = os.environ.get('SPACES_JSON_BACKEND') or next(iter(BACKENDS))
+    if name not in BACKENDS:
+        raise ValueError(f"JSON backend {name!r} is not installed (have: {', '.join(BACKENDS)})")
+    backend = name
+    pretty_backend = name if _pretty_matches(name) else 'json'
+    loads, dumps = BACKENDS[name][0], BACKENDS[name][1]
+    dumps_pretty = BACKENDS[pretty_backend][2]
+    return backend
+
+
+backend = pretty_backend = None
+loads = dumps = dumps_pretty = None
+select()
+
+
+def load(path):
+    """Parse a JSON file"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dump(obj, path, pretty=True):
+    """Write obj to path (pretty by default, like the canonical files)"""
+    data = dumps_pretty(obj) if pretty else dumps(obj)
+    with open(path, 'wb') as f:
+        f.write(data)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Responsive image derivatives: a width ladder per image in JPEG and WebP
+(plus AVIF when Pillow can write it).
+
+Every image the spaces refer to gets one variant per ladder width, capped at
+its own width (a 1080 px upload gets 320, 640 and 1080). Variants are named
+after the sha256 of the source, so identical sources share them:
+    img/derived/<ab>/<sha256>-<width>.<jpg|webp|avif>
+
+img/derivatives.json maps each src to its displayed size, content hash,
+placeholder and variants:
+    {"img/0001.jpg": {"width": 1080, "height": 810, "sha256": "ab12...",
+                      "placeholder": "data:image/webp;base64,...",
+                      "variants": {"webp": [[320, "img/derived/..."], ...], ...}}}
+export_optimized.py and export_timeline.py copy width, height and placeholder
+into the image objects and add the variants as ready-made srcset strings
+({"avif": "... 320w, ... 640w", "webp": ..., "jpeg": ...}). spaces.js and
+timeline-gallery.js give the <img> its size and paint the placeholder under
+it, so the page lays out before any image arrives, and put the srcsets in
+<picture>/srcset. Images without an entry keep only their src.
+
+The placeholder is a PLACEHOLDER_SIZE px WebP (JPEG without WebP support) as
+a ~200 byte data: URI, made from the pixels decoded for the ladder; browsers
+smooth it when scaling it up, and unlike a blurhash it needs no decoder in
+the page. Without Pillow, entries only get the size from the file header
+(see exif_reader.py). An image whose bytes already have a complete entry
+under another path reuses it without being decoded.
+
+New uploads get their ladder from the same decode that stores them (see
+image_pipeline.py). Sources whose ladder was made from their current version
+(according to image_meta_cache.py) are skipped. A full run also drops manifest entries and
+files of images no space uses any more, and re-exports when anything changed.
+
+Usage:
+    python3 scripts/derivatives.py                 # every image of spaces_new.json
+    python3 scripts/derivatives.py img/0001.jpg    # just these
+    python3 scripts/derivatives.py --widths 480,960 --formats jpeg,webp
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import threading
+
+import codec
+from image_meta_cache import get_cache
+from image_resize import downscale, draft, fit_within, in_progress, save_image, scaled
+from space_journal import atomic_write
+from space_model import is_mapping
+
+try:
+    from PIL import Image, ImageOps, features
+except Exception:
+    Image = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+DERIVED_DIR = os.path.join(ROOT, 'img', 'derived')
+MANIFEST = os.path.join(ROOT, 'img', 'derivatives.json')
+
+WIDTHS = (320, 640, 1080, 2048)
+# preferred first: the order of the <source> elements
+FORMATS = ('avif', 'webp', 'jpeg')
+EXTS = {'avif': '.avif', 'webp': '.webp', 'jpeg': '.jpg'}
+QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80}
+ORIENTATION = 0x0112
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 30
+
+_manifest = None
+_manifest_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def supported_formats():
+    """The FORMATS this Pillow can write"""
+    if Image is None:
+        return ()
+    out = set()
+    if features.check('jpg'):
+        out.add('jpeg')
+    if features.check('webp'):
+        out.add('webp')
+    try:
+        import pillow_avif  # noqa: F401  (registers AVIF on Pillow < 11.2)
+    except ImportError:
+        pass
+    if '.avif' in Image.registered_extensions():
+        out.add('avif')
+    return tuple(f for f in FORMATS if f in out)
+
+
+def ladder_spec(widths=WIDTHS, formats=FORMATS):
+    """What the metadata cache records as the 'ladder' of an image"""
+    return {'widths': list(widths), 'formats': list(formats)}
+
+
+def ladder(width, widths=WIDTHS):
+    """Variant widths for an image `width` px wide (never upscaled)"""
+    return sorted({min(w, width) for w in widths})
+
+
+def variant_path(sha, width, fmt):
+    return os.path.join(DERIVED_DIR, sha[:2], f'{sha}-{width}{EXTS[fmt]}')
+
+
+def _rel(path):
+    return os.path.relpath(path, ROOT).replace('\\', '/')
+
+
+def load_manifest():
+    """(manifest, version): the parsed manifest, re-read only when the file changed"""
+    global _manifest
+    try:
+        st = os.stat(MANIFEST)
+        version = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return {}, None
+    with _manifest_lock:
+        if _manifest is None or _manifest[1] != version:
+            _manifest = (codec.load(MANIFEST), version)
+        return _manifest
+
+
+def record(entries, drop=()):
+    """Merge {src: entry} into the manifest and remove drop; returns the new manifest.
+
+    The file is re-read under the lock, so entries written meanwhile (e.g. by
+    uploads in the admin server) are kept. It is not rewritten when nothing
+    changes (a new version makes the exporters rebuild everything).
+    """
+    with _write_lock:
+        manifest = dict(load_manifest()[0])
+        if all(manifest.get(src) == entry for src, entry in entries.items()) \
+                and not any(src in manifest for src in drop):
+            return manifest
+        for src in drop:
+            manifest.pop(src, None)
+        manifest.update(entries)
+        atomic_write(MANIFEST, codec.dumps_pretty(dict(sorted(manifest.items()))))
+    return manifest
+
+
+def srcsets(entry):
+    """{format: srcset string} of a manifest entry"""
+    return {fmt: ', '.join(f'{path} {w}w' for w, path in entry['variants'][fmt])
+            for fmt in FORMATS if entry['variants'].get(fmt)}
+
+
+def header_entry(meta):
+    """Manifest entry of an image without variants: its displayed size as the file header gives it"""
+    width, height = meta['width'], meta['height']
+    if not width or not height:
+        return None
+    if (meta['orientation'] or 1) in (5, 6, 7, 8):
+        width, height = height, width
+    return {'width': width, 'height': height, 'sha256': meta['sha256'], 'placeholder': None, 'variants': {}}
+
+
+def responsive(img, manifest):
+    """An image object with its size, placeholder and srcsets added (img itself when it has no entry)"""
+    entry = manifest.get(img.get('src')) if is_mapping(img) else None
+    if not entry:
+        return img
+    out = {k: v for k, v in img.items()}
+    out['width'], out['height'] = entry['width'], entry['height']
+    if entry.get('placeholder'):
+        out['placeholder'] = entry['placeholder']
+    if any(entry['variants'].values()):
+        out['srcset'] = srcsets(entry)
+    return out
+
+
+def placeholder(img):
+    """A tiny data: URI of decoded RGB pixels, to show while the image loads"""
+    fmt = 'webp' if features.check('webp') else 'jpeg'
+    out = io.BytesIO()
+    downscale(img, fit_within(img.size, PLACEHOLDER_SIZE)).save(out, fmt.upper(), quality=PLACEHOLDER_QUALITY)
+    return f'data:image/{fmt};base64,' + base64.b64encode(out.getvalue()).decode('ascii')
+
+
+def _make_ladder(path, sha, widths, formats):
+    """Runs in an ingest worker: write every variant of one image.
+
+    Returns (width, height, variants, placeholder), or None if the image cannot be read.
+    """
+    try:
+        with Image.open(path) as im:
+            # decode no larger than the widest variant needs (width after EXIF rotation)
+            rotated = im.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8)
+            width, height = im.size[::-1] if rotated else im.size
+            draft(im, scaled(im.size, min(1.0, max(widths) / width)))
+            im = ImageOps.exif_transpose(im)
+            src = im.convert('RGB')
+    except Exception as e:
+        print(f'⚠️  Warning: could not read {path}: {e}')
+        return None
+    return width, height, write_ladder(src, (width, height), sha, widths, formats), placeholder(src)
+
+
+def write_ladder(img, size, sha, widths=WIDTHS, formats=FORMATS):
+    """Write the variants of decoded, upright RGB pixels; returns {format: [[width, path], ...]}.
+
+    size is the full (width, height) of the image, which caps the ladder; img
+    may be a reduced decode of it as long as it is as wide as the widest variant.
+    """
+    width, height = size
+    variants = {fmt: [] for fmt in formats}
+    for w in ladder(width, widths):
+        resized = downscale(img, (w, max(1, round(height * w / width))))
+        for fmt in formats:
+            dest = variant_path(sha, w, fmt)
+            if not os.path.exists(dest):
+                save_image(resized, dest, fmt.upper(), quality=QUALITY[fmt])
+            variants[fmt].append([w, _rel(dest)])
+    return variants
+
+
+def _complete(entry, spec, sha):
+    """Is entry everything spec makes of the bytes with this sha256, with its files on disk?"""
+    if not entry or entry.get('sha256') != sha or not entry.get('placeholder') \
+            or sorted(entry['variants']) != sorted(spec['formats']):
+        return False
+    widths = ladder(entry['width'], spec['widths'])
+    return all([w for w, _ in pairs] == widths and all(os.path.exists(os.path.join(ROOT, p)) for _, p in pairs)
+               for pairs in entry['variants'].values())
+
+
+def _ladder_done(meta, spec, entry):
+    return meta['derived'].get('ladder') == spec and _complete(entry, spec, meta['sha256'])
+
+
+def prune(manifest):
+    """Delete derived files no manifest entry refers to. Returns how many.
+
+    Files still being written (an ingest running meanwhile) are left alone.
+    """
+    keep = {p for entry in manifest.values() for pairs in entry['variants'].values() for _, p in pairs}
+    removed = 0
+    for dirpath, _, names in os.walk(DERIVED_DIR):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            if _rel(path) in keep or in_progress(path):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
+
+
+def generate(srcs, widths=WIDTHS, formats=None, full=False):
+    """Make the ladders of srcs (repo-relative) and update the manifest. Returns True if it changed.
+
+    With full, srcs is every image in use: other manifest entries and their
+    files are removed.
+    """
+    from ingest import _map
+    if Image is None:
+        print('⚠️  Warning: Pillow is not installed; no derivatives generated, only image sizes recorded')
+    formats = tuple(f for f in (formats or FORMATS) if f in supported_formats())
+    spec = ladder_spec(widths, formats)
+    cache = get_cache()
+    manifest = load_manifest()[0]
+    gone = set(manifest) - set(srcs) if full else set()
+    by_sha = {e['sha256']: e for e in manifest.values() if e.get('sha256')}
+
+    jobs, entries, metas = [], {}, {}
+    for src in dict.fromkeys(srcs):
+        meta = metas[src] = cache.get(src)
+        if meta is None:
+            print(f'Image not found: {src}')
+            continue
+        entry = manifest.get(src)
+        if Image is None:
+            # keep variants made elsewhere, unless they are of other bytes
+            if entry is None or entry.get('sha256') not in (None, meta['sha256']):
+                entries[src] = header_entry(meta)
+        elif _ladder_done(meta, spec, entry):
+            continue
+        elif _complete(by_sha.get(meta['sha256']), spec, meta['sha256']):
+            # the same bytes under another path (e.g. copied into an update folder)
+            entries[src] = by_sha[meta['sha256']]
+            cache.set_derived(src, 'ladder', spec)
+        else:
+            jobs.append((src, meta['sha256']))
+    if Image is not None:
+        print(f'🔄 Making {"/".join(formats)} ladders for {len(jobs)} images '
+              f'({len(srcs) - len(jobs)} up to date)')
+    results = _map(_make_ladder, [os.path.join(ROOT, src) for src, _ in jobs], [sha for _, sha in jobs],
+                   [widths] * len(jobs), [formats] * len(jobs))
+    for (src, sha), result in zip(jobs, results):
+        if result is None:
+            entries[src] = header_entry(metas[src])
+            continue
+        width, height, variants, lqip = result
+        entries[src] = {'width': width, 'height': height, 'sha256': sha, 'placeholder': lqip, 'variants': variants}
+        cache.set_derived(src, 'ladder', spec)
+    entries = {src: entry for src, entry in entries.items() if entry}
+
+    changed = any(manifest.get(src) != entry for src, entry in entries.items()) or bool(gone)
+    if changed:
+        manifest = record(entries, gone)
+    if full:
+        removed = prune(manifest)
+        if removed:
+            print(f'Removed {removed} unused derivative files')
+    return changed
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Generate responsive image derivatives')
+    ap.add_argument('srcs', nargs='*', help='repo-relative image paths (default: every image in use)')
+    ap.add_argument('--widths', default=','.join(map(str, WIDTHS)))
+    ap.add_argument('--formats', default=','.join(FORMATS))
+    args = ap.parse_args(argv[1:])
+    widths = tuple(sorted({int(w) for w in args.widths.split(',')}))
+    formats = tuple(f for f in FORMATS if f in args.formats.split(','))
+
+    if args.srcs:
+        srcs = [_rel(os.path.abspath(s)) for s in args.srcs]
+    else:
+        from blob_store import referenced_srcs
+        from space_store import get_store
+        srcs = sorted(referenced_srcs(get_store(SP_NEW).spaces()))
+    if generate(srcs, widths, formats, full=not args.srcs):
+        from export_optimized import export_optimized
+        from export_timeline import export_timeline
+        export_optimized()
+        export_timeline()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
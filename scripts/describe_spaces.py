@@ -1,18 +1,72 @@
 #!/usr/bin/env python3
-from PIL import Image
-from transformers import Blip2Processor, Blip2ForConditionalGeneration
-import torch
-import json
+"""
+Caption the first image of every space with BLIP-2 and derive location,
+element, style and has_hook from the caption.
+
+Captions are kept by the sha256 of the image file (image_meta_cache.py) in
+img/.captions.json (git-ignored). Only images without a caption go through
+the model, in batches, with the next batches decoded on a loader thread
+(clip_embeddings.image_batches). The caption file is rewritten every
+--checkpoint-every images and when the run stops, also on Ctrl-C or an
+error, so a rerun resumes where the last one left off. With every image
+captioned no model is loaded.
+
+The captions are applied through the space store (space_store.py) in one
+journal batch of 'describe' records, only for spaces whose fields change,
+so edits still in the journal are kept and a running admin server sees
+them; spaces.json is then written from the store.
+
+Usage:
+    python3 scripts/describe_spaces.py [--batch-size 8] [--checkpoint-every 64]
+"""
+import argparse
 import os
+import threading
+import time
+
+import codec
+from clip_embeddings import image_batches, space_image
+from image_meta_cache import get_cache
+from space_journal import atomic_write
+from space_store import get_store
+
+try:
+    import torch
+    from transformers import Blip2ForConditionalGeneration, Blip2Processor
+except Exception:
+    torch = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+SP_OLD = os.path.join(ROOT, 'spaces.json')
+CAPTIONS = os.path.join(ROOT, 'img', '.captions.json')
+
+MODEL = "Salesforce/blip2-flan-t5-xl"
+BATCH_SIZE = 8
+CHECKPOINT_EVERY = 64
+MAX_NEW_TOKENS = 30
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """(model, processor, device), loaded on first use"""
+    global _model
+    if torch is None:
+        raise RuntimeError("torch and transformers are needed to caption new images")
+    with _model_lock:
+        if _model is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            processor = Blip2Processor.from_pretrained(MODEL)
+            model = Blip2ForConditionalGeneration.from_pretrained(
+                MODEL,
+                torch_dtype=torch.float16 if device == "cuda" else torch.float32
+            )
+            model.to(device).eval()
+            _model = (model, processor, device)
+        return _model
 
-# Load BLIP-2 model
-processor = Blip2Processor.from_pretrained("Salesforce/blip2-flan-t5-xl")
-model = Blip2ForConditionalGeneration.from_pretrained(
-    "Salesforce/blip2-flan-t5-xl",
-    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-)
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model.to(device)
 
 # Keyword sets for categorization
 def get_location(caption):
@@ -57,31 +111,129 @@ def has_hook(caption):
     c = caption.lower()
     return any(word in c for word in ["hook", "hanger", "coat rack", "peg"])  # returns True/False
 
-src = "spaces_new.json" if os.path.exists("spaces_new.json") else "spaces.json"
-with open(src, "r") as f:
-    spaces = json.load(f)
-
-for space in spaces:
-    img_path = space["images"][0]
-    if not os.path.exists(img_path):
-        print(f"Image not found: {img_path}")
-        continue
-    image = Image.open(img_path).convert("RGB")
-    inputs = processor(images=image, return_tensors="pt").to(device)
-    generated_ids = model.generate(**inputs, max_new_tokens=30)
-    caption = processor.batch_decode(generated_ids, skip_special_tokens=True)[0].strip()
-    space["description"] = caption
-    space["location"] = get_location(caption)
-    space["element"] = get_elements(caption)
-    space["style"] = get_styles(caption)
-    if has_hook(caption):
-        space["has_hook"] = True
-    else:
-        space["has_hook"] = False
-
-with open("spaces_new.json", "w", encoding="utf-8") as f:
-    json.dump(spaces, f, ensure_ascii=False, indent=2)
-with open("spaces.json", "w", encoding="utf-8") as f:
-    json.dump(spaces, f, ensure_ascii=False, indent=2)
-
-print("Descriptions and categories updated in spaces_new.json and spaces.json")
+
+def load_captions(path=CAPTIONS):
+    """{image sha256: caption} of earlier runs with MODEL"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        data = codec.load(path)
+    except Exception as e:
+        print(f"⚠️  Warning: could not read {path}: {e}")
+        return {}
+    if data.get("model") != MODEL:
+        print(f"⚠️  Warning: {path} was written by {data.get('model')}, captioning again with {MODEL}")
+        return {}
+    return data.get("captions") or {}
+
+
+def save_captions(captions, path=CAPTIONS):
+    atomic_write(path, codec.dumps_pretty({"model": MODEL, "captions": dict(sorted(captions.items()))}))
+
+
+def caption_images(paths, batch_size=BATCH_SIZE):
+    """Yields (paths, captions) per batch; unreadable images are left out"""
+    model, processor, device = get_model()
+    for batch, pixels in image_batches(list(paths), batch_size, processor.image_processor):
+        with torch.inference_mode():
+            generated = model.generate(pixel_values=pixels.to(device, model.dtype), max_new_tokens=MAX_NEW_TOKENS)
+        yield batch, [c.strip() for c in processor.batch_decode(generated, skip_special_tokens=True)]
+
+
+def _first_image_sha(space, meta):
+    path = space_image(space)
+    if path is None:
+        return None
+    m = meta.get(path)
+    return m["sha256"] if m is not None else None
+
+
+def caption_fields(caption):
+    return {
+        "description": caption,
+        "location": get_location(caption),
+        "element": get_elements(caption),
+        "style": get_styles(caption),
+        "has_hook": has_hook(caption),
+    }
+
+
+def caption_missing(spaces, captions, batch_size=BATCH_SIZE, checkpoint_every=CHECKPOINT_EVERY):
+    """Caption the first images of spaces not in captions, saving the caption file as it goes.
+
+    Returns the number of images captioned.
+    """
+    meta = get_cache()
+    missing = {}
+    for space in spaces:
+        path = space_image(space)
+        if path is None:
+            print(f"Image not found for space {space.get('id')}")
+            continue
+        m = meta.get(path)
+        if m is not None and m["sha256"] not in captions:
+            missing.setdefault(m["sha256"], path)
+    if not missing:
+        return 0
+
+    by_path = {path: sha for sha, path in missing.items()}
+    done = unsaved = 0
+    started = time.perf_counter()
+    try:
+        for batch, texts in caption_images(list(missing.values()), batch_size):
+            for path, text in zip(batch, texts):
+                captions[by_path[path]] = text
+            done += len(batch)
+            unsaved += len(batch)
+            if unsaved >= checkpoint_every:
+                save_captions(captions)
+                unsaved = 0
+            rate = done / (time.perf_counter() - started)
+            print(f"captioned {done}/{len(missing)} ({rate:.2f} img/s)")
+    finally:
+        if unsaved:
+            save_captions(captions)
+    return done
+
+
+def apply_captions(store, captions):
+    """Journal the caption fields of every space whose first image has a caption; returns spaces changed.
+
+    Spaces are read again inside the batch, so an image changed while
+    captioning ran is matched against its own caption (or left for the next run).
+    """
+    meta = get_cache()
+    changed = 0
+    with store.batch() as tx:
+        for header in store.headers():
+            space = tx.get(header.get("id"))
+            caption = captions.get(_first_image_sha(space, meta)) if space is not None else None
+            if caption is None:
+                continue
+            fields = {k: v for k, v in caption_fields(caption).items() if space.get(k) != v}
+            if fields:
+                tx.apply("describe", space.get("id"), {"set": fields})
+                changed += 1
+    return changed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Caption spaces with BLIP-2 and categorize the captions")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                    help="images captioned between saves of the caption file")
+    args = ap.parse_args()
+
+    store = get_store(SP_NEW)
+    captions = load_captions()
+    if captions:
+        print(f"Resuming with {len(captions)} captions from {CAPTIONS}")
+
+    captioned = caption_missing(store.spaces(), captions, args.batch_size, max(1, args.checkpoint_every))
+    changed = apply_captions(store, captions)
+    atomic_write(SP_OLD, codec.dumps_pretty(store.spaces()))
+    print(f"Captioned {captioned} new images; descriptions and categories of {changed} spaces "
+          f"updated in spaces_new.json and spaces.json")
+
+if __name__ == "__main__":
+    main()
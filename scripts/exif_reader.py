@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Read EXIF capture timestamps (and image size) without decoding pixels or
+spawning exiftool.
+
+JPEG files are scanned marker by marker up to their APP1 "Exif" segment
+(stopping at the image data), TIFF-based files (TIFF, DNG, most RAW) are read
+IFD by IFD with seeks, and PNG files through their eXIf chunk. Only these
+tags are decoded:
+    DateTimeOriginal, CreateDate (DateTimeDigitized), ModifyDate (DateTime),
+    Orientation, ImageWidth, ImageHeight
+(for JPEG and PNG the size comes from the SOF marker / IHDR chunk).
+Anything else (HEIC, video, broken headers) goes to one long-lived
+`exiftool -stay_open True -@ -` process per Python process, if exiftool is
+installed, so even a mixed batch starts exiftool at most once.
+
+taken_at() turns the tags into the ISO 8601 string stored in the spaces
+data: DateTimeOriginal (else CreateDate), camera local time to the second,
+without an offset, as every stored value is (timeline-gallery.js reads them
+as local time):
+    '2025-08-21T09:21:34'
+
+Usage:
+    from exif_reader import taken_at
+    taken_at('img/12-foo/DSC1084.jpg')
+    image_info('img/12-foo/DSC1084.jpg')    # taken_at, width, height, orientation
+    python3 scripts/exif_reader.py img/            # every image under img/, timed
+"""
+import atexit
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# tag id -> exiftool tag name
+IFD0_TAGS = {0x0132: 'ModifyDate', 0x0112: 'Orientation', 0x0100: 'ImageWidth', 0x0101: 'ImageHeight'}
+EXIF_TAGS = {
+    0x9003: 'DateTimeOriginal', 0x9004: 'CreateDate',
+}
+EXIF_IFD_POINTER = 0x8769
+TAG_NAMES = tuple(IFD0_TAGS.values()) + tuple(EXIF_TAGS.values())
+_NUMERIC = frozenset({'Orientation', 'ImageWidth', 'ImageHeight'})
+
+# in order of preference
+_DATE_TAGS = ('DateTimeOriginal', 'CreateDate')
+# sub-seconds or an offset after the time are ignored
+_DATE = re.compile(r'(\d{4}):(\d\d):(\d\d)[ T](\d\d):(\d\d):(\d\d)')
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+
+class UnsupportedFormat(Exception):
+    """The file is not a container this module can parse (use exiftool)"""
+
+
+# -- native parsing ----------------------------------------------------------
+
+def _ifd(read, offset, endian, wanted):
+    """Entries of one IFD: ({name: text or int}, exif IFD offset or None)"""
+    count, = struct.unpack(endian + 'H', read(offset, 2))
+    table = read(offset + 2, count * 12)
+    if len(table) < count * 12:
+        raise UnsupportedFormat('truncated IFD')
+    out, exif_ifd = {}, None
+    for i in range(count):
+        tag, typ, n, value = struct.unpack(endian + 'HHI4s', table[i * 12:i * 12 + 12])
+        if tag == EXIF_IFD_POINTER:
+            exif_ifd, = struct.unpack(endian + 'I', value)
+        elif tag in wanted and typ in (2, 7):  # ASCII (UNDEFINED in some writers)
+            size = n * _TYPE_SIZES[typ]
+            raw = value[:size] if size <= 4 else read(struct.unpack(endian + 'I', value)[0], size)
+            text = raw.split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+            if text:
+                out[wanted[tag]] = text
+        elif tag in wanted and typ in (3, 4) and n == 1:  # one SHORT / LONG
+            out[wanted[tag]], = struct.unpack(endian + ('H' if typ == 3 else 'I'), value[:2 if typ == 3 else 4])
+    return out, exif_ifd
+
+
+def _tiff(read):
+    """Tags from a TIFF structure; read(offset, n) is relative to its header"""
+    head = read(0, 8)
+    if head[:4] not in (b'II*\0', b'MM\0*'):
+        raise UnsupportedFormat('no TIFF header')
+    endian = '<' if head[:2] == b'II' else '>'
+    ifd0, = struct.unpack(endian + 'I', head[4:8])
+    tags, exif_ifd = _ifd(read, ifd0, endian, IFD0_TAGS)
+    if exif_ifd:
+        tags.update(_ifd(read, exif_ifd, endian, EXIF_TAGS)[0])
+    return tags
+
+
+def _bytes_reader(data):
+    return lambda offset, n: data[offset:offset + n]
+
+
+def _file_reader(f, base=0):
+    def read(offset, n):
+        f.seek(base + offset)
+        return f.read(n)
+    return read
+
+
+# start-of-frame markers (they carry the pixel size)
+_SOF = frozenset(bytes([m]) for m in range(0xc0, 0xd0)) - {b'\xc4', b'\xc8', b'\xcc'}
+
+
+def _jpeg(f):
+    """EXIF tags from APP1, then the size from the frame header (both precede the image data)"""
+    tags = {}
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return tags
+        if byte != b'\xff':
+            raise UnsupportedFormat('bad JPEG marker')
+        marker = f.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = f.read(1)
+        if marker in (b'', b'\xd9', b'\xda'):  # end, or start of the image data
+            return tags
+        if marker == b'\x01' or b'\xd0' <= marker <= b'\xd7':
+            continue
+        length, = struct.unpack('>H', f.read(2))
+        if marker == b'\xe1' and not tags:
+            segment = f.read(length - 2)
+            if segment.startswith(b'Exif\0\0'):
+                tags = _tiff(_bytes_reader(segment[6:]))
+        elif marker in _SOF:
+            height, width = struct.unpack('>xHH', f.read(5))
+            tags['ImageWidth'], tags['ImageHeight'] = width, height
+            return tags
+        else:
+            f.seek(length - 2, 1)
+
+
+def _png(f):
+    tags, size = {}, {}
+    f.seek(8)
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            break
+        length, kind = struct.unpack('>I4s', head)
+        if kind == b'IHDR':
+            size['ImageWidth'], size['ImageHeight'] = struct.unpack('>II', f.read(8))
+            f.seek(length - 8 + 4, 1)
+        elif kind == b'eXIf':
+            tags = _tiff(_bytes_reader(f.read(length)))
+            break
+        elif kind == b'IEND':
+            break
+        else:
+            f.seek(length + 4, 1)  # data + CRC
+    tags.update(size)
+    return tags
+
+
+def read_native(path):
+    """Tags of a JPEG, TIFF-based or PNG file; UnsupportedFormat otherwise"""
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+        try:
+            if magic[:2] == b'\xff\xd8':
+                return _jpeg(f)
+            if magic[:4] in (b'II*\0', b'MM\0*'):
+                return _tiff(_file_reader(f))
+            if magic == b'\x89PNG\r\n\x1a\n':
+                return _png(f)
+        except (struct.error, KeyError, ValueError) as e:
+            raise UnsupportedFormat(f'unreadable header: {e}')
+    raise UnsupportedFormat('unknown container')
+
+
+# -- exiftool fallback -------------------------------------------------------
+
+class ExifTool:
+    """One `exiftool -stay_open True -@ -` process answering requests one at a time"""
+
+    def __init__(self, executable='exiftool'):
+        self.executable = executable
+        self._proc = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            [self.executable, '-stay_open', 'True', '-@', '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def execute(self, *args):
+        """Run one exiftool command line; returns its stdout"""
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+            lines = [os.fsencode(a) for a in args] + [b'-execute']
+            self._proc.stdin.write(b'\n'.join(lines) + b'\n')
+            self._proc.stdin.flush()
+            out = []
+            while True:
+                line = self._proc.stdout.readline()
+                if not line:
+                    self._proc = None
+                    raise RuntimeError('exiftool exited unexpectedly')
+                if line.rstrip() == b'{ready}':
+                    return b''.join(out).decode('utf-8', 'replace')
+                out.append(line)
+
+    def tags(self, path):
+        """The same tags for any file exiftool understands"""
+        out = self.execute('-S', '-n', *('-' + name for name in TAG_NAMES), path)
+        tags = {}
+        for line in out.splitlines():
+            name, sep, value = line.partition(': ')
+            value = value.strip()
+            if sep and name in TAG_NAMES and value:
+                tags[name] = int(value) if name in _NUMERIC and value.isdigit() else value
+        return tags
+
+    def close(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                try:
+                    self._proc.stdin.write(b'-stay_open\nFalse\n')
+                    self._proc.stdin.flush()
+                    self._proc.wait(timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._proc.kill()
+            self._proc = None
+
+
+_exiftool = None
+_exiftool_lock = threading.Lock()
+
+
+def get_exiftool():
+    """The process-wide exiftool batch process, or None if exiftool is not installed"""
+    global _exiftool
+    with _exiftool_lock:
+        if _exiftool is None and shutil.which('exiftool'):
+            _exiftool = ExifTool()
+            atexit.register(_exiftool.close)
+        return _exiftool
+
+
+# -- public API --------------------------------------------------------------
+
+def read_tags(path):
+    """Tags of a file (native parser, exiftool for anything else)"""
+    try:
+        return read_native(path)
+    except UnsupportedFormat:
+        tool = get_exiftool()
+        if tool is None:
+            return {}
+        try:
+            return tool.tags(path)
+        except (OSError, RuntimeError) as e:
+            print(f"⚠️  Warning: exiftool failed on {path}: {e}")
+            return {}
+
+
+def taken_at_from(tags):
+    """Naive ISO 8601 capture time ('YYYY-MM-DDTHH:MM:SS') from date tags, or None"""
+    for key in _DATE_TAGS:
+        m = _DATE.match(tags.get(key) or '')
+        if not m or m.group(1) == '0000':
+            continue
+        year, month, day, hour, minute, second = m.groups()
+        return f'{year}-{month}-{day}T{hour}:{minute}:{second}'
+    return None
+
+
+def taken_at(path):
+    """When the photo was taken (ISO 8601), or None if the file has no date"""
+    try:
+        return taken_at_from(read_tags(path))
+    except OSError as e:
+        print(f"Error reading EXIF from {path}: {e}")
+        return None
+
+
+def image_info(path):
+    """{'taken_at', 'width', 'height', 'orientation'} from one header read (None where unknown)"""
+    tags = read_tags(path)
+    return {
+        'taken_at': taken_at_from(tags),
+        'width': tags.get('ImageWidth'),
+        'height': tags.get('ImageHeight'),
+        'orientation': tags.get('Orientation'),
+    }
+
+
+def main(argv):
+    paths = []
+    for arg in argv[1:] or [os.path.join(ROOT, 'img')]:
+        if os.path.isdir(arg):
+            for dirpath, _, names in os.walk(arg):
+                paths.extend(os.path.join(dirpath, n) for n in sorted(names) if not n.startswith('.'))
+        else:
+            paths.append(arg)
+    started = time.perf_counter()
+    found = 0
+    for path in paths:
+        value = taken_at(path)
+        found += value is not None
+        print(f'{value or "-":<32} {path}')
+    elapsed = time.perf_counter() - started
+    print(f'{found}/{len(paths)} files with a date in {elapsed * 1000:.0f} ms', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
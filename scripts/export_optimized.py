@@ -8,50 +8,154 @@ Export spaces_optimized.json with only the minimal info needed for the frontend.
 - artist: name, taken_at, instructions, instruction_images
 - final_image (last published update image)
 - All images must have taken_at
+- width, height, placeholder and srcset of every image in the derivatives
+  manifest (see derivatives.py)
+- similar: ids of the spaces whose first image looks most alike, when
+  image embeddings are cached (see similar_spaces.py)
+
+The exporter keeps its previous output in memory. Called with the ids of the
+spaces that changed, it rebuilds only those entries and reuses the cached
+JSON text of every other entry when writing the file. The file is written
+compactly (no indentation); only the frontend reads it. A new derivatives
+manifest, or new image embeddings, mean a full rebuild.
 """
-import json, os
-from PIL import Image
+import os, threading
+from contextlib import nullcontext
+import codec
+from derivatives import load_manifest, responsive
+from space_store import get_store
+from space_journal import atomic_write
+
+try:
+    import similar_spaces
+except Exception:
+    # needs numpy
+    similar_spaces = None
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 SP_NEW = os.path.join(ROOT, 'spaces_new.json')
 OUT = os.path.join(ROOT, 'spaces_optimized.json')
 
+# Previous output: {'source', 'generation', 'manifest' (version), 'similar' (index version),
+# 'similar_ids' by id, 'ids' (in output order), 'fragments' by id}
+_state = None
+_lock = threading.Lock()
 
-def export_optimized(spaces=None):
-    if spaces is None:
-        with open(SP_NEW, 'r', encoding='utf-8') as f:
-            spaces = json.load(f)
-    result = []
-    for s in spaces:
-        entry = {
-            'id': s.get('id'),
-            'description': s.get('description', {}),
-            'status': s.get('status'),
-            'artist': [],
-            'original_image': None
+
+def element_fragment(obj):
+    """Compact JSON bytes of one list element"""
+    return codec.dumps(obj)
+
+
+def write_fragments(path, fragments):
+    """Write a JSON list from pre-encoded element fragments"""
+    atomic_write(path, b'[' + b','.join(fragments) + b']')
+
+
+def build_entry(s, manifest=None, similar=None):
+    manifest = manifest or {}
+    entry = {
+        'id': s.get('id'),
+        'description': s.get('description', {}),
+        'status': s.get('status'),
+        'artist': [],
+        'original_image': None
+    }
+    imgs = s.get('images', [])
+    if imgs:
+        entry['original_image'] = responsive(imgs[0], manifest)
+    # Build artist list with instructions, instruction_images, and final_image
+    for artist in s.get('taken_artists', []):
+        artist_entry = {
+            'name': artist.get('name'),
+            'taken_at': artist.get('taken_at'),
+            'instructions': artist.get('instructions', []),
+            'instruction_images': [responsive(im, manifest) for im in artist.get('instruction_images', [])],
+            'final_image': None
         }
-        imgs = s.get('images', [])
-        if imgs:
-            entry['original_image'] = imgs[0]
-        # Build artist list with instructions, instruction_images, and final_image
-        for artist in s.get('taken_artists', []):
-            artist_entry = {
-                'name': artist.get('name'),
-                'taken_at': artist.get('taken_at'),
-                'instructions': artist.get('instructions', []),
-                'instruction_images': artist.get('instruction_images', []),
-                'final_image': None
-            }
-            # Find the final image for this artist (last published update by this artist)
-            for upd in reversed(s.get('updates', [])):
-                if upd.get('status') == 'published' and upd.get('author') == artist.get('name') and upd.get('images'):
-                    artist_entry['final_image'] = upd['images'][-1]
-                    break
-            entry['artist'].append(artist_entry)
-        result.append(entry)
-    with open(OUT, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    print(f"Exported {len(result)} spaces to {OUT}")
+        # Find the final image for this artist (last published update by this artist)
+        for upd in reversed(s.get('updates', [])):
+            if upd.get('status') == 'published' and upd.get('author') == artist.get('name') and upd.get('images'):
+                artist_entry['final_image'] = responsive(upd['images'][-1], manifest)
+                break
+        entry['artist'].append(artist_entry)
+    if similar and s.get('id') in similar:
+        entry['similar'] = similar[s.get('id')]
+    return entry
+
+
+def _similar(store, spaces):
+    """(index version, {id: similar ids}); (None, {}) without embeddings.
+
+    Called without the store lock: building the index and all_similar() can
+    take seconds at scale, and both are reused while the embedded first
+    images stay the same.
+    """
+    if similar_spaces is None:
+        return None, {}
+    if store is not None:
+        index = similar_spaces.get_similar_index(store)
+    else:
+        index = similar_spaces.index_of(spaces)
+    if not len(index):
+        return None, {}
+    return index.version, index.all_similar(similar_spaces.SIMILAR_K)
+
+
+def _rebuild(spaces, source, generation, manifest, version, similar_version, similar):
+    global _state
+    ids, fragments = [], {}
+    for s in spaces:
+        key = str(s.get('id'))
+        ids.append(key)
+        fragments[key] = element_fragment(build_entry(s, manifest, similar))
+    _state = {'source': source, 'generation': generation, 'manifest': version,
+              'similar': similar_version, 'similar_ids': similar, 'ids': ids, 'fragments': fragments}
+
+
+def export_optimized(spaces=None, changed_ids=None, out=OUT):
+    """Write spaces_optimized.json.
+
+    spaces defaults to the resident SpaceStore (snapshot plus journal).
+    With changed_ids, only those spaces are rebuilt and the rest of the
+    previous output is reused; without it everything is rebuilt.
+    """
+    with _lock:
+        manifest, version = load_manifest()
+        store = None
+        if spaces is None:
+            store = get_store(SP_NEW)
+        similar_version, similar = _similar(store, spaces)
+        # The writer thread may be changing spaces concurrently; hold the
+        # store lock while reading them (but not while writing the file)
+        with store.lock if store is not None else nullcontext():
+            if store is not None:
+                store.refresh()
+            source = id(store if store is not None else spaces)
+            generation = store.generation if store is not None else None
+            if (changed_ids is None or _state is None or _state['source'] != source
+                    or _state['generation'] != generation or _state['manifest'] != version
+                    or _state['similar'] != similar_version):
+                if store is not None:
+                    # snapshot plus any journaled changes not yet compacted
+                    spaces = store.spaces()
+                _rebuild(spaces, source, generation, manifest, version, similar_version, similar)
+                rebuilt = len(_state['ids'])
+            else:
+                lookup = store.get if store is not None else {str(s.get('id')): s for s in spaces}.get
+                rebuilt = 0
+                for space_id in changed_ids:
+                    key = str(space_id)
+                    s = lookup(key)
+                    if s is None:
+                        continue
+                    if key not in _state['fragments']:
+                        _state['ids'].append(key)
+                    _state['fragments'][key] = element_fragment(build_entry(s, manifest, _state['similar_ids']))
+                    rebuilt += 1
+        fragments = _state['fragments']
+        write_fragments(out, [fragments[k] for k in _state['ids']])
+        print(f"Exported {len(_state['ids'])} spaces to {out} ({rebuilt} rebuilt)")
 
 if __name__ == "__main__":
     export_optimized()
@@ -7,87 +7,174 @@ This includes:
 
 Timeline events are sorted chronologically and include:
 - space_id
-- type ('original' or 'update') 
-- images with taken_at timestamps
+- type ('original' or 'update')
+- images with taken_at timestamps (and width, height, placeholder and
+  srcset, see derivatives.py)
 - author info
 - action text
+
+The sorted event list is kept in memory between calls. When only some
+spaces changed, their events are removed and re-inserted with bisect
+instead of rebuilding and re-sorting the whole timeline.
 """
-import json, os
+import os, threading
+from contextlib import nullcontext
+from bisect import bisect_left
 from datetime import datetime
+from derivatives import load_manifest, responsive
+from space_store import get_store
+from export_optimized import element_fragment, write_fragments
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 SP_NEW = os.path.join(ROOT, 'spaces_new.json')
 OUT = os.path.join(ROOT, 'spaces_timeline.json')
 
-def export_timeline(spaces=None):
-    if spaces is None:
-        with open(SP_NEW, 'r', encoding='utf-8') as f:
-            spaces = json.load(f)
-    
-    timeline_events = []
-    
-    for space in spaces:
-        space_id = space.get('id')
-        
-        # Add original image as timeline event if it has taken_at
-        original_images = space.get('images', [])
-        if original_images and original_images[0].get('taken_at'):
-            timeline_events.append({
-                'space_id': space_id,
-                'type': 'original',
-                'images': [original_images[0]],
-                'taken_at': original_images[0]['taken_at'],
-                'author': space.get('created_by', 'Original'),
-                'text': 'Original state',
-                'action': 'original',
-                'description': space.get('description', '')
-            })
-        
-        # Add update events from published updates
-        updates = space.get('updates', [])
-        for update in updates:
-            # Only include updates that have images and timestamps
-            if (update.get('images') and 
-                len(update['images']) > 0 and 
-                update.get('created_at')):
-                
-                # Find primary image or use first image
-                primary_img = None
-                supplementary_imgs = []
-                
-                for img in update['images']:
-                    if img.get('role') == 'primary':
-                        primary_img = img
-                    else:
-                        supplementary_imgs.append(img)
-                
-                if not primary_img and update['images']:
-                    primary_img = update['images'][0]
-                    supplementary_imgs = update['images'][1:]
-                
-                if primary_img:
-                    # Use primary image's taken_at (EXIF time) instead of upload time
-                    image_taken_at = primary_img.get('taken_at', update['created_at'])
-                    timeline_event = {
-                        'space_id': space_id,
-                        'type': 'update',
-                        'images': [primary_img] + supplementary_imgs,
-                        'taken_at': image_taken_at,
-                        'author': update.get('author', 'Unknown'),
-                        'text': update.get('text', ''),
-                        'action': update.get('action', 'update'),
-                        'status': update.get('status', 'draft')
-                    }
-                    timeline_events.append(timeline_event)
-    
+# Previous output. Events are ordered by (taken_at, position of the space,
+# index of the event within the space), which is exactly the order the old
+# append-then-stable-sort produced.
+_state = None
+_lock = threading.Lock()
+
+
+def space_events(space, manifest=None):
+    """Timeline events for one space, in the order they used to be appended"""
+    manifest = manifest or {}
+    events = []
+    space_id = space.get('id')
+
+    # Add original image as timeline event if it has taken_at
+    original_images = space.get('images', [])
+    if original_images and original_images[0].get('taken_at'):
+        events.append({
+            'space_id': space_id,
+            'type': 'original',
+            'images': [responsive(original_images[0], manifest)],
+            'taken_at': original_images[0]['taken_at'],
+            'author': space.get('created_by', 'Original'),
+            'text': 'Original state',
+            'action': 'original',
+            'description': space.get('description', '')
+        })
+
+    # Add update events from published updates
+    updates = space.get('updates', [])
+    for update in updates:
+        # Only include updates that have images and timestamps
+        if (update.get('images') and
+            len(update['images']) > 0 and
+            update.get('created_at')):
+
+            # Find primary image or use first image
+            primary_img = None
+            supplementary_imgs = []
+
+            for img in update['images']:
+                if img.get('role') == 'primary':
+                    primary_img = img
+                else:
+                    supplementary_imgs.append(img)
+
+            if not primary_img and update['images']:
+                primary_img = update['images'][0]
+                supplementary_imgs = update['images'][1:]
+
+            if primary_img:
+                # Use primary image's taken_at (EXIF time) instead of upload time
+                image_taken_at = primary_img.get('taken_at', update['created_at'])
+                events.append({
+                    'space_id': space_id,
+                    'type': 'update',
+                    'images': [responsive(im, manifest) for im in [primary_img] + supplementary_imgs],
+                    'taken_at': image_taken_at,
+                    'author': update.get('author', 'Unknown'),
+                    'text': update.get('text', ''),
+                    'action': update.get('action', 'update'),
+                    'status': update.get('status', 'draft')
+                })
+    return events
+
+
+def _sort_keys(events, position):
+    return [(e.get('taken_at') or '', position, i) for i, e in enumerate(events)]
+
+
+def _insert_space(space, position, manifest):
+    events = space_events(space, manifest)
+    keys = _sort_keys(events, position)
+    for key, event in zip(keys, events):
+        i = bisect_left(_state['keys'], key)
+        _state['keys'].insert(i, key)
+        _state['events'].insert(i, event)
+        _state['fragments'].insert(i, element_fragment(event))
+    _state['by_space'][str(space.get('id'))] = keys
+    return len(events)
+
+
+def _remove_space(key):
+    for sort_key in _state['by_space'].pop(key, []):
+        i = bisect_left(_state['keys'], sort_key)
+        del _state['keys'][i]
+        del _state['events'][i]
+        del _state['fragments'][i]
+
+
+def _rebuild(spaces, source, generation, manifest, version):
+    global _state
+    _state = {'source': source, 'generation': generation, 'manifest': version, 'keys': [], 'events': [],
+              'fragments': [], 'by_space': {}, 'positions': {}}
+    decorated = []
+    for position, space in enumerate(spaces):
+        events = space_events(space, manifest)
+        keys = _sort_keys(events, position)
+        _state['positions'][str(space.get('id'))] = position
+        _state['by_space'][str(space.get('id'))] = keys
+        decorated.extend(zip(keys, events))
     # Sort by taken_at timestamp
-    timeline_events.sort(key=lambda x: x.get('taken_at', ''))
-    
-    with open(OUT, 'w', encoding='utf-8') as f:
-        json.dump(timeline_events, f, ensure_ascii=False, indent=2)
-    
-    print(f"Exported {len(timeline_events)} timeline events to {OUT}")
-    return timeline_events
+    decorated.sort(key=lambda pair: pair[0])
+    _state['keys'] = [k for k, _ in decorated]
+    _state['events'] = [e for _, e in decorated]
+    _state['fragments'] = [element_fragment(e) for e in _state['events']]
+
+
+def export_timeline(spaces=None, changed_ids=None, out=OUT):
+    """Write spaces_timeline.json and return the sorted event list.
+
+    spaces defaults to the resident SpaceStore (snapshot plus journal).
+    With changed_ids, only the events of those spaces are replaced.
+    """
+    with _lock:
+        manifest, version = load_manifest()
+        store = None
+        if spaces is None:
+            store = get_store(SP_NEW)
+        with store.lock if store is not None else nullcontext():
+            if store is not None:
+                store.refresh()
+            source = id(store if store is not None else spaces)
+            generation = store.generation if store is not None else None
+            if (changed_ids is None or _state is None or _state['source'] != source
+                    or _state['generation'] != generation or _state['manifest'] != version):
+                if store is not None:
+                    # snapshot plus any journaled changes not yet compacted
+                    spaces = store.spaces()
+                _rebuild(spaces, source, generation, manifest, version)
+            else:
+                lookup = store.get if store is not None else {str(s.get('id')): s for s in spaces}.get
+                positions = _state['positions']
+                for space_id in changed_ids:
+                    key = str(space_id)
+                    space = lookup(key)
+                    if space is None:
+                        continue
+                    _remove_space(key)
+                    if key not in positions:
+                        positions[key] = len(positions)
+                    _insert_space(space, positions[key], manifest)
+
+        write_fragments(out, _state['fragments'])
+
+        print(f"Exported {len(_state['events'])} timeline events to {out}")
+        return _state['events']
 
 if __name__ == "__main__":
     export_timeline()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+In-process background export of spaces_optimized.json and spaces_timeline.json.
+
+The admin servers used to run export_optimized.py and export_timeline.py as
+child processes (a shell plus two cold interpreters) on every request and
+block the response until both finished. Now a request only marks the spaces
+it changed as dirty and returns as soon as its write is committed; one
+worker thread folds every dirty id that piled up meanwhile into a single
+incremental export run.
+
+Usage:
+    from export_worker import get_export_worker
+    EXPORTS = get_export_worker()
+    EXPORTS.request([space_id])   # or EXPORTS.request() for a full rebuild
+    EXPORTS.status()              # generation, duration of the last run, ...
+"""
+import threading
+import time
+from datetime import datetime
+
+from export_optimized import export_optimized
+from export_timeline import export_timeline
+
+
+class ExportWorker:
+    """Coalescing queue of dirty space ids plus the thread that exports them"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._dirty = set()
+        self._full = False
+        # Set after a failed run: the exporters' cached output may be stale
+        self._needs_full = False
+        self._running = False
+        self._thread = None
+        self.generation = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_duration_ms = None
+        self.last_changed = None
+        self.last_error = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='export-worker', daemon=True)
+            self._thread.start()
+
+    def request(self, changed_ids=None):
+        """Schedule an export of the given space ids (None means everything)"""
+        with self._cond:
+            if changed_ids is None:
+                self._full = True
+            else:
+                self._dirty.update(changed_ids)
+            self._ensure_started()
+            self._cond.notify()
+
+    def wait_idle(self, timeout=None):
+        """Block until nothing is queued or running (used by scripts and tests)"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._dirty or self._full or self._running:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._dirty or self._full):
+                    self._cond.wait()
+                full, changed = self._full or self._needs_full, self._dirty
+                self._full, self._needs_full, self._dirty = False, False, set()
+                self._running = True
+            started = time.time()
+            self.last_started_at = datetime.utcnow().isoformat()
+            ids = None if full else sorted(changed, key=str)
+            try:
+                export_optimized(changed_ids=ids)
+                export_timeline(changed_ids=ids)
+                self.last_error = None
+            except Exception as e:
+                print(f"⚠️  Warning: Could not update export files: {e}")
+                self.last_error = str(e)
+                with self._cond:
+                    self._needs_full = True
+            self.generation += 1
+            self.last_changed = len(changed) if not full else None
+            self.last_duration_ms = round((time.time() - started) * 1000, 1)
+            self.last_finished_at = datetime.utcnow().isoformat()
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            pending = len(self._dirty)
+            full_pending = self._full
+            running = self._running
+        return {
+            'generation': self.generation,
+            'last_started_at': self.last_started_at,
+            'last_finished_at': self.last_finished_at,
+            'last_duration_ms': self.last_duration_ms,
+            'last_changed_spaces': self.last_changed,
+            'last_error': self.last_error,
+            'running': running,
+            'pending_spaces': pending,
+            'full_export_pending': full_pending,
+        }
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_export_worker():
+    """Return the process-wide export worker"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ExportWorker()
+    return _worker
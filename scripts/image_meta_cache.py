@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Persistent metadata cache for the files under img/.
+
+One SQLite row per image (img/.meta_cache.db, git-ignored) holds its EXIF
+capture time, pixel size, EXIF orientation, sha256 and the status of assets
+derived from it (thumbnails, resized copies, ...). A row is keyed by the
+path relative to the repo root and is only trusted while the file's size
+and mtime_ns are unchanged; otherwise the file is inspected again and its
+derived-asset status is dropped. A maintenance pass over the whole tree
+therefore only opens the files that changed since the last one.
+
+Usage:
+    from image_meta_cache import get_cache
+    meta = get_cache().get('img/12-foo/DSC1084.jpg')
+    meta['taken_at'], meta['width'], meta['sha256'], meta['derived']
+    get_cache().set_derived(path, 'thumbnail', {'path': 'img/thumbnails/x.jpg'})
+
+    python3 scripts/image_meta_cache.py scan [dir]   # refresh rows; prints hits/misses
+    python3 scripts/image_meta_cache.py prune        # forget files that are gone
+    python3 scripts/image_meta_cache.py stats
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import codec
+from exif_reader import image_info
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMG_DIR = os.path.join(ROOT, 'img')
+CACHE_PATH = os.path.join(IMG_DIR, '.meta_cache.db')
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.heic')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,          -- relative to the repo root, '/' separated
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    taken_at TEXT,
+    width INTEGER,
+    height INTEGER,
+    orientation INTEGER,
+    sha256 TEXT,
+    derived TEXT NOT NULL DEFAULT '{}'   -- {asset name: info}
+);
+"""
+FIELDS = ('path', 'size', 'mtime_ns', 'taken_at', 'width', 'height', 'orientation', 'sha256', 'derived')
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ImageMetaCache:
+    """Image metadata rows, revalidated against (size, mtime_ns) on every read"""
+
+    def __init__(self, db_path=CACHE_PATH, root=ROOT):
+        self.db_path = db_path
+        self.root = root
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # a lost row is only recomputed, so no fsync per write
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def rel(self, path):
+        """Cache key of a path (absolute, or relative to the repo root)"""
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        return path.replace('\\', '/')
+
+    def _row(self, key):
+        row = self._conn.execute(f"SELECT {', '.join(FIELDS)} FROM images WHERE path = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        meta = dict(zip(FIELDS, row))
+        meta['derived'] = codec.loads(meta['derived'])
+        return meta
+
+    def get(self, path, **known):
+        """Metadata of one file, inspecting it only if it changed; None if it does not exist.
+
+        known fills in fields the file itself no longer carries when it has
+        to be inspected (e.g. taken_at of an upload whose EXIF was stripped
+        by re-encoding).
+        """
+        key = self.rel(path)
+        full = os.path.join(self.root, key)
+        try:
+            st = os.stat(full)
+        except FileNotFoundError:
+            self.forget(key)
+            return None
+        with self.lock:
+            meta = self._row(key)
+            if meta is not None and meta['size'] == st.st_size and meta['mtime_ns'] == st.st_mtime_ns:
+                self.hits += 1
+                return meta
+            self.misses += 1
+        try:
+            info = image_info(full)
+        except OSError as e:
+            print(f"⚠️  Warning: could not inspect {key}: {e}")
+            info = {}
+        meta = {'path': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                'taken_at': info.get('taken_at'), 'width': info.get('width'),
+                'height': info.get('height'), 'orientation': info.get('orientation'),
+                'sha256': file_sha256(full), 'derived': {}}
+        for field, value in known.items():
+            if meta.get(field) is None:
+                meta[field] = value
+        self._store(meta)
+        return meta
+
+    def put(self, path, **fields):
+        """Record a file the caller just wrote and already knows everything about, without reading it"""
+        key = self.rel(path)
+        st = os.stat(os.path.join(self.root, key))
+        meta = {'path': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'taken_at': None,
+                'width': None, 'height': None, 'orientation': None, 'sha256': None, 'derived': {}}
+        meta.update(fields)
+        self._store(meta)
+        return meta
+
+    def _store(self, meta):
+        with self.lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO images ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                [codec.dumps(meta[f]).decode() if f == 'derived' else meta[f] for f in FIELDS])
+
+    def set_derived(self, path, name, info=True):
+        """Record that asset `name` was made from the current version of path"""
+        meta = self.get(path)
+        if meta is None:
+            return None
+        meta['derived'][name] = info
+        with self.lock:
+            # only if the file was not replaced meanwhile
+            self._conn.execute('UPDATE images SET derived = ? WHERE path = ? AND size = ? AND mtime_ns = ?',
+                               (codec.dumps(meta['derived']).decode(), meta['path'], meta['size'], meta['mtime_ns']))
+        return meta
+
+    def forget(self, path):
+        with self.lock:
+            self._conn.execute('DELETE FROM images WHERE path = ?', (self.rel(path),))
+
+    def scan(self, directory=IMG_DIR, exts=IMAGE_EXTS):
+        """Metadata of every image under directory (a dict keyed by path)"""
+        out = {}
+        for dirpath, dirnames, names in os.walk(directory):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for name in sorted(names):
+                if name.lower().endswith(exts):
+                    meta = self.get(os.path.join(dirpath, name))
+                    if meta is not None:
+                        out[meta['path']] = meta
+        return out
+
+    def prune(self):
+        """Drop rows of files that no longer exist. Returns how many."""
+        with self.lock:
+            paths = [p for p, in self._conn.execute('SELECT path FROM images')]
+        gone = [p for p in paths if not os.path.exists(os.path.join(self.root, p))]
+        with self.lock:
+            self._conn.executemany('DELETE FROM images WHERE path = ?', [(p,) for p in gone])
+        return len(gone)
+
+    def stats(self):
+        with self.lock:
+            rows, derived = self._conn.execute("SELECT COUNT(*), SUM(derived != '{}') FROM images").fetchone()
+        return {'rows': rows, 'with_derived': derived or 0, 'hits': self.hits, 'misses': self.misses}
+
+
+def get_cache(db_path=CACHE_PATH):
+    """The cache for this process (ingest workers each open their own connection)"""
+    key = (db_path, os.getpid())
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ImageMetaCache(db_path)
+        return cache
+
+
+def main(argv):
+    cmd = argv[1] if len(argv) > 1 else 'stats'
+    cache = get_cache()
+    if cmd == 'scan':
+        started = time.perf_counter()
+        found = cache.scan(argv[2] if len(argv) > 2 else IMG_DIR)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f'{len(found)} images in {elapsed:.0f} ms: {cache.misses} inspected, {cache.hits} unchanged')
+    elif cmd == 'prune':
+        print(f'Forgot {cache.prune()} missing files')
+    elif cmd == 'stats':
+        s = cache.stats()
+        print(f"{s['rows']} images cached, {s['with_derived']} with derived assets ({cache.db_path})")
+    else:
+        raise SystemExit('Usage: image_meta_cache.py scan [dir] | prune | stats')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
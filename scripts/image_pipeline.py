@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+One pass over a new image: store it and make everything derived from it.
+
+An upload used to be opened once per step: saved, decoded and re-encoded by
+optimize_image, opened again for its EXIF date, decoded again for its
+thumbnail and once more for its derivatives, then read again for the
+metadata cache's sha256. process_image() reads the EXIF header once,
+decodes the pixels once (at a reduced JPEG scale when nothing needs more,
+see image_resize.py), turns them upright per the EXIF orientation, and from
+those pixels writes
+    the stored file (re-encoded at MAX_SIZE when optimizing, else moved as is)
+    its thumbnail (img/thumbnails/..., as regenerate_thumbnails.py makes them)
+    its responsive variants (img/derived/..., see derivatives.py)
+    its placeholder (a tiny data: URI, see derivatives.placeholder)
+and records the result in the metadata cache without reading the files back.
+It returns one record:
+    {'src', 'taken_at', 'width', 'height', 'sha256', 'thumbnail', 'placeholder', 'variants'}
+(width/height as displayed; placeholder and variants as in the derivatives
+manifest).
+
+ingest.py runs it on the worker pool and merges the variants into the
+derivatives manifest.
+"""
+import hashlib
+import io
+import os
+
+from derivatives import (WIDTHS, header_entry, ladder_spec, load_manifest, placeholder, supported_formats,
+                         write_ladder)
+from exif_reader import image_info
+from image_meta_cache import file_sha256, get_cache
+from image_resize import downscale, draft, fit_within, scaled, write_atomic
+from regenerate_thumbnails import QUALITY as THUMB_QUALITY, SCALE as THUMB_SCALE, thumbnail_for
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MAX_SIZE = 1080
+QUALITY = 80
+
+
+def _rel(path):
+    return os.path.relpath(path, ROOT).replace('\\', '/')
+
+
+def _place(src, dest):
+    if src != dest:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(src, dest)
+
+
+def _write(dest, data):
+    write_atomic(dest, lambda f: f.write(data))
+
+
+def _header(path):
+    try:
+        return image_info(path)
+    except OSError as e:
+        print(f"Error reading EXIF from {path}: {e}")
+        return {}
+
+
+def _thumbnail(img, size, dest):
+    """Save the thumbnail of upright pixels img (full size `size`) for the stored file dest"""
+    path = thumbnail_for(dest)
+    ext = os.path.splitext(dest)[1].lower()
+    fmt = 'JPEG' if ext in ('.jpg', '.jpeg') else Image.registered_extensions().get(ext)
+    if fmt is None:
+        return None
+    out = io.BytesIO()
+    downscale(img, scaled(size, THUMB_SCALE)).save(out, fmt, quality=THUMB_QUALITY)
+    _write(path, out.getvalue())
+    return _rel(path)
+
+
+def existing_record(dest):
+    """The record of an image stored earlier (e.g. an upload of bytes already in the blob store)"""
+    meta = get_cache().get(dest)
+    if meta is None:
+        return None
+    src = meta['path']
+    entry = load_manifest()[0].get(src) or header_entry(meta) or {}
+    thumb = meta['derived'].get('thumbnail')
+    return {'src': src, 'taken_at': meta['taken_at'], 'width': entry.get('width'),
+            'height': entry.get('height'), 'sha256': meta['sha256'],
+            'thumbnail': thumb.get('path') if isinstance(thumb, dict) else None,
+            'placeholder': entry.get('placeholder'), 'variants': entry.get('variants', {})}
+
+
+def _current_record(path):
+    meta = get_cache().get(path)
+    if meta is None or meta['derived'].get('ladder') != ladder_spec(WIDTHS, supported_formats()):
+        return None
+    thumb = meta['derived'].get('thumbnail')
+    if not isinstance(thumb, dict) or thumb.get('sha256') != meta['sha256'] \
+            or not os.path.exists(os.path.join(ROOT, thumb['path'])):
+        return None
+    record = existing_record(path)
+    return record if record['placeholder'] else None
+
+
+def process_image(src, dest, optimize=False, exif=True, sha=None):
+    """Store src as dest (the same path processes a file in place) and derive its assets.
+
+    sha is the sha256 of src when the caller already has it (an upload hashed
+    while staging); it is only used when the bytes are stored unchanged.
+    Without Pillow, or if the image cannot be decoded, the file is stored as
+    it is and only its metadata is recorded. A file processed in place that
+    already has its current thumbnail and variants is not decoded again.
+    """
+    if src == dest and not optimize and Image is not None:
+        record = _current_record(dest)
+        if record is not None:
+            if not exif:
+                record['taken_at'] = None
+            return record
+    info = _header(src)
+    taken = info.get('taken_at') if exif else None
+    cache = get_cache()
+    if Image is not None:
+        try:
+            return _process(src, dest, optimize, taken, info, sha, cache)
+        except Exception as e:
+            print(f'Image processing failed for {os.path.basename(src)}: {e}')
+    # _process moves src or removes it once dest is written; a failure after
+    # that (thumbnail, variants) keeps the stored file and records it as it is
+    if os.path.exists(src):
+        _place(src, dest)
+    meta = cache.get(dest, taken_at=taken)
+    size = header_entry(meta) or {}
+    return {'src': meta['path'], 'taken_at': taken, 'width': size.get('width'), 'height': size.get('height'),
+            'sha256': meta['sha256'], 'thumbnail': None, 'placeholder': None, 'variants': {}}
+
+
+def _process(src, dest, optimize, taken, info, sha, cache):
+    formats = supported_formats()
+    with Image.open(src) as im:
+        orientation = im.getexif().get(0x0112, 1)
+        file_size = im.size
+        full = file_size[::-1] if orientation in (5, 6, 7, 8) else file_size
+        stored = fit_within(full, MAX_SIZE) if optimize else full
+        # decode only as many pixels as the largest output needs
+        needed = stored[0] if optimize else min(full[0], max(WIDTHS))
+        draft(im, scaled(im.size, needed / full[0]))
+        pixels = ImageOps.exif_transpose(im).convert('RGB')
+
+    if optimize:
+        base = downscale(pixels, stored)
+        out = io.BytesIO()
+        base.save(out, 'JPEG', quality=QUALITY, optimize=True)
+        data = out.getvalue()
+        sha = hashlib.sha256(data).hexdigest()
+        _write(dest, data)
+        if src != dest:
+            os.remove(src)
+        # the re-encoded file is upright and carries no EXIF
+        file_meta = {'width': stored[0], 'height': stored[1], 'orientation': None}
+    else:
+        base = pixels
+        _place(src, dest)
+        sha = sha or file_sha256(dest)
+        file_meta = {'width': info.get('width') or file_size[0], 'height': info.get('height') or file_size[1],
+                     'orientation': info.get('orientation')}
+
+    thumb = _thumbnail(base, stored, dest)
+    variants = write_ladder(base, stored, sha, WIDTHS, formats)
+    derived = {'ladder': ladder_spec(WIDTHS, formats)}
+    if thumb:
+        derived['thumbnail'] = {'path': thumb, 'sha256': sha}
+    cache.put(dest, taken_at=taken, sha256=sha, derived=derived, **file_meta)
+    return {'src': _rel(dest), 'taken_at': taken, 'width': stored[0], 'height': stored[1],
+            'sha256': sha, 'thumbnail': thumb, 'placeholder': placeholder(base), 'variants': variants}
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Upload ingest: store files by content, then process them on a process pool.
+
+The request thread only streams each upload to a staging file, hashing it
+as it goes (I/O). Bytes that are already stored become references to the
+existing blob (see blob_store.py) and are not processed again. Every new
+file gets one pass of image_pipeline.process_image() (EXIF, a single
+decode, the optimized original, thumbnail and responsive variants) on a
+pool of worker processes, one per core, and the image objects come back in
+upload order:
+    {'src': 'img/blobs/<ab>/<sha256>.<ext>', 'taken_at': ..., 'role': ...}
+With meta=True the per-image records of process_image() come back too.
+
+Workers come from a forkserver (spawn where that is not available), never a
+fork of the threaded admin server. A single file is processed in the calling
+process, where the pool would only add overhead. INGEST_WORKERS overrides
+the pool size; 1 disables the pool.
+
+Usage:
+    import ingest
+    images = ingest.save_uploads(request.files.getlist('files'), optimize=True,
+                                 manifest=request.form.get('files_manifest'))
+    objs, records = ingest.process(paths, meta=True)  # files already on disk
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import codec
+import derivatives
+from blob_store import OPTIMIZED, clean_ext, get_blob_store
+from image_pipeline import existing_record, process_image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def workers():
+    env = os.environ.get('INGEST_WORKERS')
+    if env:
+        return max(1, int(env))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_pool():
+    """The process-wide ingest pool (None when there is only one worker)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None and workers() > 1:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=workers(), mp_context=ctx)
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def image_obj(path, taken_at, role=None):
+    obj = {'src': os.path.relpath(path, ROOT).replace('\\', '/'), 'taken_at': taken_at}
+    if role is not None:
+        obj['role'] = role
+    return obj
+
+
+def _map(fn, *args):
+    """[fn(*a) for a in zip(*args)], on the pool when there is more than one call"""
+    calls = list(zip(*args))
+    pool = get_pool() if len(calls) > 1 else None
+    if pool is not None:
+        try:
+            return list(pool.map(fn, *args))
+        except BrokenProcessPool:
+            # a worker died (e.g. out of memory on a huge image): redo the batch here
+            print('⚠️  Warning: ingest pool broke; processing this upload in the request thread')
+            _reset_pool(pool)
+    return [fn(*a) for a in calls]
+
+
+def _results(paths, records, role, default_now, meta):
+    """Image objects (and records) for paths; sizes, placeholders and variants go into the derivatives manifest"""
+    fresh = {r['src']: {'width': r['width'], 'height': r['height'], 'sha256': r['sha256'],
+                        'placeholder': r['placeholder'], 'variants': r['variants']}
+             for r in records.values() if r and r['width']}
+    if fresh:
+        derivatives.record(fresh)
+    now = datetime.utcnow().isoformat() if default_now else None
+    objs = [image_obj(p, records[p]['taken_at'] or now, role) for p in paths]
+    return (objs, [records[p] for p in paths]) if meta else objs
+
+
+def process(paths, optimize=False, exif=True, role=None, default_now=False, meta=False):
+    """Process files on disk in place (see image_pipeline.py); image objects in the order of paths.
+
+    exif=False skips reading the capture time. With default_now, files without a
+    timestamp get the current UTC time (what admin_simple always did).
+    """
+    paths = list(paths)
+    # the same path twice is processed once
+    unique = list(dict.fromkeys(paths))
+    n = len(unique)
+    records = dict(zip(unique, _map(process_image, unique, unique, [optimize] * n, [exif] * n)))
+    return _results(paths, records, role, default_now, meta)
+
+
+def _store_blob(staged, dest, optimize, exif, sha):
+    """Runs in a worker: turn a staging file into its blob (see blob_store.py)"""
+    if not os.path.exists(staged) and os.path.exists(dest):
+        # already done by a worker before the pool broke
+        record = existing_record(dest)
+        if record is None:
+            raise LookupError(f'stored image {os.path.basename(dest)} is no longer readable')
+        if not exif:
+            record['taken_at'] = None
+        return record
+    return process_image(staged, dest, optimize, exif, sha)
+
+
+def stage_uploads(files, manifest=None):
+    """Stream uploads into blob staging, hashing them.
+
+    Returns ([(sha256, filename)] in order, {sha256: staging path}). A
+    manifest (JSON text or list of {'sha256', 'name'}) lists every image of
+    the request in order, including ones the client did not send because
+    HEAD /blob/<sha256> said the server has them.
+    """
+    from werkzeug.utils import secure_filename  # only the servers need it
+    store = get_blob_store()
+    order, staged = [], {}
+    for f in files:
+        if f.filename:
+            sha, tmp = store.stage(f.stream)
+            if sha in staged:
+                store.discard(tmp)
+            else:
+                staged[sha] = tmp
+            order.append((sha, secure_filename(f.filename)))
+    if isinstance(manifest, (str, bytes)):
+        manifest = codec.loads(manifest) if manifest.strip() else None
+    if manifest:
+        order = [(str(m.get('sha256', '')).lower(), secure_filename(m.get('name') or '')) for m in manifest]
+    return order, staged
+
+
+def _store_jobs(jobs, optimize, exif):
+    """{dest: record} of (staged file, blob path, sha256) jobs, run on the pool"""
+    if not jobs:
+        return {}
+    n = len(jobs)
+    results = _map(_store_blob, [j[0] for j in jobs], [j[1] for j in jobs],
+                   [optimize] * n, [exif] * n, [j[2] for j in jobs])
+    return dict(zip((j[1] for j in jobs), results))
+
+
+def store_uploads(order, staged, optimize=False, exif=True, role=None, default_now=False, meta=False):
+    """Store staged uploads as blobs (existing ones become references); image objects in order.
+
+    Raises LookupError if an image is neither uploaded nor stored.
+    """
+    store = get_blob_store()
+    dests, jobs = {}, []
+    # uploads whose bytes were already stored, kept until their blob has been read
+    spare = {}
+    try:
+        for sha, name in order:
+            if sha in dests:
+                continue
+            existing = store.find(sha, optimize)
+            if existing is not None:
+                dests[sha] = existing
+                if sha in staged:
+                    spare[sha] = staged.pop(sha)
+                continue
+            original = store.find(sha) if optimize and sha not in staged else None
+            if sha in staged:
+                src = staged.pop(sha)
+            elif original is not None:
+                src = store.stage_copy(original)
+            else:
+                raise LookupError(f'image {name or sha} was neither uploaded nor stored before')
+            dests[sha] = store.path(sha, OPTIMIZED if optimize else clean_ext(name))
+            jobs.append((src, dests[sha], sha))
+    except BaseException:
+        for job in jobs:
+            store.discard(job[0])
+        for tmp in spare.values():
+            store.discard(tmp)
+        raise
+    finally:
+        for tmp in staged.values():
+            store.discard(tmp)
+    try:
+        records = _store_jobs(jobs, optimize, exif)
+        again = []
+        for sha, dest in dests.items():
+            if dest in records:
+                continue
+            record = existing_record(dest)
+            if record is None:
+                # the blob went away since find() (e.g. blob_store.py gc): store the upload again
+                if sha not in spare:
+                    raise LookupError(f'stored image {os.path.basename(dest)} is no longer readable')
+                again.append((spare.pop(sha), dest, sha))
+                continue
+            if not exif:
+                record['taken_at'] = None
+            records[dest] = record
+        records.update(_store_jobs(again, optimize, exif))
+    finally:
+        for tmp in spare.values():
+            store.discard(tmp)
+    return _results([dests[sha] for sha, _ in order], records, role, default_now, meta)
+
+
+def save_uploads(files, optimize=False, exif=True, role=None, default_now=False, manifest=None, meta=False):
+    """stage_uploads() + store_uploads(): uploaded FileStorage objects to image objects"""
+    order, staged = stage_uploads(files, manifest)
+    return store_uploads(order, staged, optimize=optimize, exif=exif, role=role,
+                         default_now=default_now, meta=meta)
@@ -4,26 +4,21 @@
 Usage:
   python scripts/mark_taken.py <id> --by "Name" [--date ISO_DATETIME] [--note "reason/contact"]
 
-This updates `spaces_new.json` (canonical) and writes a compatibility copy to `spaces.json`.
+This journals the change to `spaces_new.json` (canonical, compacted on exit) and writes a
+compatibility copy to `spaces.json`.
 """
-import json
+import codec
 import os
 import sys
 from datetime import datetime
+from space_store import get_store
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 SP_NEW = os.path.join(ROOT, 'spaces_new.json')
 SP = os.path.join(ROOT, 'spaces.json')
 
-def load(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def write_both(data):
-    with open(SP_NEW, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    with open(SP, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def write_compat(data):
+    codec.dump(data, SP)
 
 def usage():
     print(__doc__)
@@ -52,22 +47,17 @@ def main(argv):
     if date is None:
         date = datetime.utcnow().isoformat()
 
-    data = load(SP_NEW if os.path.exists(SP_NEW) else SP)
-    found = False
-    for space in data:
-        if str(space.get('id')) == id_:
-            space['status'] = 'taken'
-            space['taken_by'] = by
-            space['taken_at'] = date
-            if note:
-                space['taken_note'] = note
-            found = True
-            break
-
-    if not found:
+    store = get_store(SP_NEW)
+    space = store.get(id_)
+    if space is None:
         print('ID not found in data:', id_); sys.exit(1)
 
-    write_both(data)
+    fields = {'status': 'taken', 'taken_by': by, 'taken_at': date}
+    if note:
+        fields['taken_note'] = note
+    store.apply('mark_taken', space.get('id'), {'set': fields})
+
+    write_compat(store.spaces())
     print('Marked id', id_, 'as taken by', by)
 
 if __name__ == '__main__':
@@ -1,57 +1,173 @@
 #!/usr/bin/env python3
 """
 Thumbnail Maintenance Script for nai-ken-ten-kai
-Regenerates thumbnails for all images in the img/ directory
+Builds thumbnails for every image under img/, including update, instruction
+and blob folders: img/<path> gets img/thumbnails/<path> (25% size).
+
+A thumbnail is skipped when image_meta_cache.py recorded it for the source's
+current sha256, or when it is newer than its source. The rest are made on the
+ingest process pool. Thumbnails whose source is gone are removed.
+
+Thumbnails are upright (EXIF orientation applied), like the ones
+image_pipeline.py writes on upload and the derived variants.
+
+Usage:
+    python3 scripts/regenerate_thumbnails.py [--force] [--dry-run]
 """
 
+import argparse
 import os
 import sys
-from PIL import Image
+import time
+
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
 
 # Add the scripts directory to the path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'scripts'))
+from image_meta_cache import IMAGE_EXTS, get_cache
+from image_resize import downscale, in_progress, open_scaled, save_image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMG_DIR = os.path.join(ROOT, 'img')
+THUMBNAIL_DIR = os.path.join(IMG_DIR, 'thumbnails')
+# generated or temporary trees, not sources
+SKIP_DIRS = {THUMBNAIL_DIR, os.path.join(IMG_DIR, 'derived'), os.path.join(IMG_DIR, 'blobs', 'staging')}
+
+SCALE = 0.25
+QUALITY = 85
+
 
 def generate_thumbnail(image_path, thumbnail_path):
     """Generate a thumbnail for the given image"""
     try:
-        with Image.open(image_path) as img:
-            # Calculate new size (25% of original)
-            width, height = img.size
-            new_size = (int(width * 0.25), int(height * 0.25))
-
-            # Resize image
-            thumbnail = img.resize(new_size, Image.Resampling.LANCZOS)
+        # 25% of original; a JPEG decodes at 1/2 scale
+        img, new_size = open_scaled(image_path, scale=SCALE)
+        with img:
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                new_size = new_size[::-1]
+            thumbnail = downscale(ImageOps.exif_transpose(img), new_size)
 
-            # Save thumbnail
-            thumbnail.save(thumbnail_path, 'JPEG', quality=85)
+            # Save thumbnail (same name and format as the source)
+            if thumbnail_path.lower().endswith(('.jpg', '.jpeg')):
+                save_image(thumbnail.convert('RGB'), thumbnail_path, 'JPEG', quality=QUALITY)
+            else:
+                save_image(thumbnail, thumbnail_path, img.format, quality=QUALITY)
             return True
     except Exception as e:
         print(f"Error generating thumbnail for {image_path}: {e}")
         return False
 
-def regenerate_all_thumbnails():
-    """Regenerate all thumbnails"""
-    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    img_dir = os.path.join(root_dir, 'img')
-    thumbnail_dir = os.path.join(img_dir, 'thumbnails')
 
-    # Ensure thumbnail directory exists
-    os.makedirs(thumbnail_dir, exist_ok=True)
+def source_images(img_dir=IMG_DIR):
+    """Every source image under img_dir, sorted"""
+    for dirpath, dirnames, names in os.walk(img_dir):
+        dirnames[:] = sorted(d for d in dirnames
+                             if not d.startswith('.') and os.path.join(dirpath, d) not in SKIP_DIRS)
+        for name in sorted(names):
+            if name.lower().endswith(IMAGE_EXTS) and not name.startswith('.'):
+                yield os.path.join(dirpath, name)
+
+
+def thumbnail_for(image_path):
+    return os.path.join(THUMBNAIL_DIR, os.path.relpath(image_path, IMG_DIR))
+
+
+def up_to_date(cache, image_path, thumbnail_path):
+    """Is the thumbnail current? Adopts existing thumbnails newer than their source."""
+    try:
+        thumb_mtime = os.stat(thumbnail_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    meta = cache.get(image_path)
+    if meta is None:
+        return False
+    recorded = meta['derived'].get('thumbnail')
+    if isinstance(recorded, dict) and recorded.get('sha256') == meta['sha256']:
+        return True
+    if thumb_mtime >= meta['mtime_ns']:
+        cache.set_derived(image_path, 'thumbnail',
+                          {'path': cache.rel(thumbnail_path), 'sha256': meta['sha256']})
+        return True
+    return False
+
+
+def orphans():
+    """Thumbnails whose source image no longer exists (not counting thumbnails still being written)"""
+    for dirpath, _, names in os.walk(THUMBNAIL_DIR):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            if not in_progress(path) and not os.path.exists(os.path.join(IMG_DIR, os.path.relpath(path, THUMBNAIL_DIR))):
+                yield path
+
+
+def regenerate_all_thumbnails(force=False, dry_run=False):
+    """Make missing and stale thumbnails, remove orphaned ones"""
+    from ingest import _map
+    started = time.perf_counter()
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    cache = get_cache()
+
+    print("🔄 Regenerating thumbnails...")
+    todo, skipped = [], 0
+    for image_path in source_images():
+        thumbnail_path = thumbnail_for(image_path)
+        if not force and up_to_date(cache, image_path, thumbnail_path):
+            skipped += 1
+        else:
+            todo.append((image_path, thumbnail_path))
+
+    gone = list(orphans())
+    if dry_run:
+        for image_path, _ in todo:
+            print(f"  would generate {os.path.relpath(image_path, IMG_DIR)}")
+        for path in gone:
+            print(f"  would remove {os.path.relpath(path, IMG_DIR)}")
+        print(f"📸 {len(todo)} to generate, {skipped} up to date, {len(gone)} orphaned")
+        return
 
-    print("🔄 Regenerating all thumbnails...")
+    if todo and Image is None:
+        print("⚠️  Warning: Pillow is not installed; no thumbnails generated")
+        todo = []
+    results = _map(generate_thumbnail, [t[0] for t in todo], [t[1] for t in todo])
     count = 0
+    for (image_path, thumbnail_path), ok in zip(todo, results):
+        if ok:
+            count += 1
+            meta = cache.get(image_path)
+            cache.set_derived(image_path, 'thumbnail',
+                              {'path': cache.rel(thumbnail_path), 'sha256': meta and meta['sha256']})
+            print(f"  ✅ Generated thumbnail for {os.path.relpath(image_path, IMG_DIR)}")
 
-    # Process all JPG files in img directory (excluding update folders)
-    for filename in os.listdir(img_dir):
-        if filename.endswith('.jpg') and not filename.startswith('update-'):
-            image_path = os.path.join(img_dir, filename)
-            thumbnail_path = os.path.join(thumbnail_dir, filename)
+    for path in gone:
+        # an ingest may have started writing it while the thumbnails were made
+        if in_progress(path):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        print(f"  🗑️  Removed orphaned {os.path.relpath(path, IMG_DIR)}")
+    # drop folders the removals left empty
+    for dirpath, _, _ in sorted(os.walk(THUMBNAIL_DIR), key=lambda w: -len(w[0])):
+        if dirpath != THUMBNAIL_DIR and not os.listdir(dirpath):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                # a writer put a file in it meanwhile
+                pass
 
-            if generate_thumbnail(image_path, thumbnail_path):
-                count += 1
-                print(f"  ✅ Generated thumbnail for {filename}")
+    elapsed = time.perf_counter() - started
+    failed = len(todo) - count
+    print(f"📸 Regenerated {count} thumbnails, {skipped} up to date, {len(gone)} orphans removed"
+          + (f", {failed} failed" if failed else "") + f" in {elapsed:.2f}s")
 
-    print(f"📸 Regenerated {count} thumbnails")
 
 if __name__ == '__main__':
-    regenerate_all_thumbnails()
+    ap = argparse.ArgumentParser(description='Build thumbnails for everything under img/')
+    ap.add_argument('--force', action='store_true', help='regenerate every thumbnail')
+    ap.add_argument('--dry-run', action='store_true', help='only list what would change')
+    args = ap.parse_args()
+    regenerate_all_thumbnails(force=args.force, dry_run=args.dry_run)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Resized copies of images under img/, made on first request and kept in a
+size-bounded LRU disk cache (img/.resize_cache/, git-ignored).
+
+admin.py serves them as /img/<path>?w=<width>&fmt=<webp|jpeg>. A variant is
+keyed by the source path, its size and mtime, the width and the format, so
+a replaced source gets new variants and new ETags. Concurrent requests for
+the same variant wait for the one that renders it (single flight) instead
+of decoding the source again. When the cache grows past RESIZE_CACHE_MB
+(default 256), the least recently served files are deleted.
+
+Usage:
+    from resize_cache import get_resize_cache
+    path, etag, mimetype = get_resize_cache().get(abs_path, width=320, fmt='webp')
+
+    python3 scripts/resize_cache.py stats|clear
+"""
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from image_resize import downscale, draft, save_image, scaled
+
+try:
+    from PIL import Image, ImageOps, features
+except Exception:
+    Image = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(ROOT, 'img', '.resize_cache')
+
+MIN_WIDTH = 16
+MAX_WIDTH = 4096
+# widths are rounded up to a multiple of this, so odd sizes share files
+WIDTH_STEP = 16
+FORMATS = {'jpeg': ('.jpg', 'image/jpeg', 82), 'webp': ('.webp', 'image/webp', 78)}
+ORIENTATION = 0x0112
+
+
+class UnsupportedImage(Exception):
+    """The source is not an image Pillow can decode"""
+
+
+def snap_width(width):
+    width = min(max(int(width), MIN_WIDTH), MAX_WIDTH)
+    return -(-width // WIDTH_STEP) * WIDTH_STEP
+
+
+def formats():
+    """The FORMATS this Pillow can write"""
+    if Image is None:
+        return ()
+    return tuple(f for f in FORMATS if features.check('jpg' if f == 'jpeg' else f))
+
+
+class ResizeCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=None):
+        self.root = root
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('RESIZE_CACHE_MB', 256)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        # name -> size, least recently served first
+        self._lru = OrderedDict()
+        self._bytes = 0
+        # key -> Event of the render in progress
+        self._inflight = {}
+        os.makedirs(root, exist_ok=True)
+        entries = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.endswith('.part'):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime_ns, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._lru[name] = size
+            self._bytes += size
+
+    def key(self, source, width, fmt):
+        """Cache key (also the ETag) of a variant of the current version of source"""
+        st = os.stat(source)
+        raw = f'{os.path.relpath(source, ROOT)}\0{st.st_size}\0{st.st_mtime_ns}\0{width}\0{fmt}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:40]
+
+    def get(self, source, width, fmt='jpeg'):
+        """(path, etag, mimetype) of source at width px (never enlarged) in fmt.
+
+        Raises FileNotFoundError for a missing source, ValueError for an
+        unknown format and UnsupportedImage for a file that is not an image.
+        """
+        if fmt not in formats():
+            raise ValueError(f'unsupported format {fmt!r}')
+        width = snap_width(width)
+        key = self.key(source, width, fmt)
+        ext, mimetype, _ = FORMATS[fmt]
+        name = key + ext
+        path = os.path.join(self.root, name)
+        while True:
+            with self.lock:
+                size = self._lru.get(name)
+                if size is not None:
+                    self.hits += 1
+                    self._lru.move_to_end(name)
+                else:
+                    wait = self._inflight.get(key)
+                    if wait is None:
+                        done = self._inflight[key] = threading.Event()
+                        self.misses += 1
+                        break
+            if size is None:
+                # another request is rendering this variant: use its file
+                wait.wait()
+                continue
+            try:
+                # recency survives restarts through the mtime
+                os.utime(path)
+                return path, key, mimetype
+            except FileNotFoundError:
+                with self.lock:
+                    if self._lru.pop(name, None) is not None:
+                        self._bytes -= size
+        try:
+            size = self._render(source, path, width, fmt)
+            with self.lock:
+                self._lru[name] = size
+                self._bytes += size
+                self._evict(keep=name)
+        finally:
+            with self.lock:
+                del self._inflight[key]
+            done.set()
+        return path, key, mimetype
+
+    def _render(self, source, path, width, fmt):
+        _, _, quality = FORMATS[fmt]
+        try:
+            with Image.open(source) as im:
+                rotated = im.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8)
+                full_w, full_h = im.size[::-1] if rotated else im.size
+                width = min(width, full_w)
+                draft(im, scaled(im.size, width / full_w))
+                img = ImageOps.exif_transpose(im).convert('RGB')
+        except FileNotFoundError:
+            raise
+        except (OSError, SyntaxError, ValueError) as e:
+            # UnidentifiedImageError is an OSError; broken headers raise the others
+            raise UnsupportedImage(f'{os.path.basename(source)} is not a readable image: {e}') from e
+        img = downscale(img, (width, max(1, round(full_h * width / full_w))))
+        save_image(img, path, fmt.upper(), quality=quality)
+        return os.path.getsize(path)
+
+    def _evict(self, keep):
+        while self._bytes > self.max_bytes and len(self._lru) > 1:
+            name, size = next(iter(self._lru.items()))
+            if name == keep:
+                self._lru.move_to_end(name)
+                continue
+            del self._lru[name]
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            for name in self._lru:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+            self._lru.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'files': len(self._lru), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_resize_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResizeCache()
+        return _cache
+
+
+def main(argv):
+    cmd = argv[1] if len(argv) > 1 else 'stats'
+    cache = get_resize_cache()
+    if cmd == 'stats':
+        s = cache.stats()
+        print(f"{s['files']} files, {s['bytes'] / (1024 * 1024):.1f} of "
+              f"{s['max_bytes'] / (1024 * 1024):.0f} MB ({cache.root})")
+    elif cmd == 'clear':
+        cache.clear()
+        print('Cleared')
+    else:
+        raise SystemExit('Usage: resize_cache.py stats | clear')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+"Spaces like this": nearest neighbours of each space by the CLIP embedding
+of its first image.
+
+Vectors come from the embedding cache (clip_embeddings.py); nothing is
+encoded here, so only spaces whose first image has been embedded take part
+(`python3 scripts/clip_embeddings.py update`, or a catagorize_space.py run).
+Embeddings are normalized, so similarity is a dot product. Below IVF_MIN
+spaces a query is one matrix-vector product over all of them and an
+argpartition for the top k. From IVF_MIN on, the index also clusters the
+vectors with k-means (about sqrt(n) clusters) and a query only scores the
+members of its NPROBE nearest clusters (an inverted file, as in FAISS's
+IVF-Flat), which keeps it well under a millisecond at 50k spaces.
+
+The index of a store is rebuilt when the first image hashes of its spaces
+that have an embedding change: a new space, a first image replaced, or new
+rows in the embedding cache. The store replaces the header of every space
+it writes, so only spaces whose header object changed are looked at again.
+admin.py serves /api/space/<id>/similar?k=; export_optimized.py writes the
+SIMILAR_K most similar ids of every space as 'similar' (all_similar() is
+computed once per index).
+
+Usage:
+    from similar_spaces import get_similar_index
+    index = get_similar_index(store)             # rebuilt only when needed
+    index.similar(12, k=8)                       # [(id, score), ...]
+
+    python3 scripts/similar_spaces.py <id> [k]
+"""
+import math
+import os
+import sys
+import threading
+
+import numpy as np
+
+from clip_embeddings import get_embedding_cache, space_image
+from image_meta_cache import get_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+SIMILAR_K = 6
+IVF_MIN = 20000
+NPROBE = 10
+KMEANS_ITERATIONS = 10
+# query rows scored at a time by all_similar()
+BLOCK = 1024
+
+# spaces changed since the last look above which they are read in one pass
+BULK_READ = 100
+
+_index = None
+# id -> (header, first image sha256 or None) as of the last get_similar_index()
+_firsts = {}
+_builds = 0
+_index_lock = threading.Lock()
+
+
+def _top(scores, k):
+    """Column indices of the k highest scores of each row, best first"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((len(scores), 0), dtype=np.intp)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1)
+
+
+class SimilarityIndex:
+    """Top-k cosine similarity over the rows of vectors (normalized), one row per id"""
+
+    def __init__(self, ids, vectors, ivf=None, seed=0, shas=None):
+        global _builds
+        _builds += 1
+        # tells indexes apart (export_optimized.py rebuilds when it changes)
+        self.version = _builds
+        self.shas = shas
+        self._all_similar = {}
+        self.ids = list(ids)
+        self.pos = {space_id: i for i, space_id in enumerate(self.ids)}
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.centroids = None
+        if ivf if ivf is not None else len(self.ids) >= IVF_MIN:
+            self._cluster(seed)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cluster(self, seed):
+        """k-means (spherical) on a sample, then every vector into the list of its centroid"""
+        n = len(self.ids)
+        nlist = max(1, int(math.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[np.sort(rng.choice(n, min(n, nlist * 64), replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assign = (sample @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            used = np.bincount(assign, minlength=nlist) > 0
+            # an empty cluster keeps its old centroid
+            centroids[used] = sums[used]
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        assign = np.concatenate([(self.vectors[i:i + BLOCK * 8] @ centroids.T).argmax(axis=1)
+                                 for i in range(0, n, BLOCK * 8)])
+        self.centroids = centroids
+        self.members = np.argsort(assign, kind='stable')
+        self.offsets = np.searchsorted(assign[self.members], np.arange(nlist + 1))
+
+    def _lists(self, clusters):
+        return np.concatenate([self.members[self.offsets[c]:self.offsets[c + 1]] for c in clusters])
+
+    def search(self, vector, k, exclude=None):
+        """[(id, score)] of the k rows most similar to vector, leaving out row exclude"""
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.centroids is None:
+            candidates = None
+            scores = self.vectors @ vector
+        else:
+            probe = _top((self.centroids @ vector)[None], NPROBE)[0]
+            candidates = self._lists(probe)
+            scores = self.vectors[candidates] @ vector
+        if exclude is not None:
+            if candidates is None:
+                scores[exclude] = -np.inf
+            else:
+                scores[candidates == exclude] = -np.inf
+        best = _top(scores[None], k + 1)[0]
+        rows = best if candidates is None else candidates[best]
+        return [(self.ids[r], float(scores[b])) for r, b in zip(rows, best)
+                if r != exclude][:k]
+
+    def similar(self, space_id, k=SIMILAR_K):
+        """[(id, score)] of the k spaces most like space_id; None if it has no embedding"""
+        i = self.pos.get(space_id)
+        if i is None:
+            return None
+        return self.search(self.vectors[i], k, exclude=i)
+
+    def all_similar(self, k=SIMILAR_K):
+        """{id: [k most similar ids]} of every space (computed once per k; treat as read-only)"""
+        out = self._all_similar.get(k)
+        if out is None:
+            out = self._all_similar[k] = self._compute_all_similar(k)
+        return out
+
+    def _compute_all_similar(self, k):
+        """all_similar() in blocks of matrix products.
+
+        Exact below IVF_MIN. With clusters, the members of each cluster are
+        scored together against the lists of the NPROBE clusters nearest to
+        its centroid.
+        """
+        out = {}
+        if self.centroids is None:
+            for start in range(0, len(self.ids), BLOCK):
+                scores = self.vectors[start:start + BLOCK] @ self.vectors.T
+                rows = np.arange(len(scores))
+                scores[rows, start + rows] = -np.inf
+                for i, best in zip(range(start, start + len(scores)), _top(scores, k)):
+                    out[self.ids[i]] = [self.ids[j] for j in best if j != i]
+            return out
+        probes = _top(self.centroids @ self.centroids.T, NPROBE)
+        for c, probe in enumerate(probes):
+            members = self.members[self.offsets[c]:self.offsets[c + 1]]
+            if not len(members):
+                continue
+            candidates = self._lists(probe)
+            scores = self.vectors[members] @ self.vectors[candidates].T
+            scores[members[:, None] == candidates[None, :]] = -np.inf
+            for i, best in zip(members, _top(scores, k)):
+                out[self.ids[i]] = [self.ids[candidates[j]] for j in best if candidates[j] != i]
+        return out
+
+
+def first_images(spaces):
+    """(ids, shas) of the spaces whose first image is in the embedding cache"""
+    cache = get_embedding_cache('image')
+    meta = get_cache()
+    ids, shas = [], []
+    for space in spaces:
+        path = space_image(space)
+        m = meta.get(path) if path else None
+        if m is not None and m['sha256'] in cache:
+            ids.append(space.get('id'))
+            shas.append(m['sha256'])
+    return ids, shas
+
+
+def _store_first_images(store):
+    """first_images() of a store, reading only spaces whose header changed since the last call"""
+    global _firsts
+    cache = get_embedding_cache('image')
+    meta = get_cache()
+    headers = store.headers()
+    changed = [h.get('id') for h in headers
+               if _firsts.get(h.get('id'), (None,))[0] is not h]
+    if len(changed) > BULK_READ:
+        spaces = {s.get('id'): s for s in store.spaces()}
+        read = spaces.get
+    else:
+        read = store.get
+    firsts, ids, shas = {}, [], []
+    for header in headers:
+        sid = header.get('id')
+        entry = _firsts.get(sid)
+        if entry is None or entry[0] is not header:
+            space = read(sid)
+            path = space_image(space) if space is not None else None
+            m = meta.get(path) if path else None
+            entry = (header, m['sha256'] if m is not None else None)
+        firsts[sid] = entry
+        if entry[1] is not None and entry[1] in cache:
+            ids.append(sid)
+            shas.append(entry[1])
+    _firsts = firsts
+    return ids, shas
+
+
+def _index_of(ids, shas):
+    """The last index if it has these ids and shas, else a new one (call with _index_lock held)"""
+    global _index
+    if _index is None or _index.shas != shas or _index.ids != ids:
+        _index = SimilarityIndex(ids, get_embedding_cache('image').vectors(shas), shas=shas)
+    return _index
+
+
+def get_similar_index(store):
+    """The index of store's spaces, rebuilt when the embedded first images changed"""
+    with _index_lock:
+        # nothing embedded yet: no need to look at the spaces
+        if not len(get_embedding_cache('image')):
+            return _index_of([], [])
+        return _index_of(*_store_first_images(store))
+
+
+def index_of(spaces):
+    """get_similar_index() of a list of spaces (every first image is looked up)"""
+    with _index_lock:
+        if not len(get_embedding_cache('image')):
+            return _index_of([], [])
+        return _index_of(*first_images(spaces))
+
+
+def main(argv):
+    if len(argv) < 2:
+        raise SystemExit('Usage: similar_spaces.py <id> [k]')
+    from space_store import get_store
+    space_id = int(argv[1])
+    k = int(argv[2]) if len(argv) > 2 else SIMILAR_K
+    index = get_similar_index(get_store(SP_NEW))
+    found = index.similar(space_id, k)
+    if found is None:
+        raise SystemExit(f'Space {space_id} has no embedding (run clip_embeddings.py update)')
+    for other, score in found:
+        print(f'{other}\t{score:.3f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
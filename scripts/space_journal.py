@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Append-only mutation journal for spaces_new.json.
+
+Every admin mutation is recorded as one typed JSON line instead of rewriting
+the whole spaces file:
+
+    {"seq": 12, "ts": "...", "op": "mark_taken", "id": 42,
+     "set": {...}, "unset": [...], "extend": {...}}
+
+Operations: create_space, mark_taken, add_update, publish, unpublish,
+instructions, revert. Each append is a single write + fsync, so the cost of
+a mutation scales with the size of the change, not the size of the dataset.
+
+The SpaceStore folds the journal into a fresh spaces_new.json snapshot when
+the journal grows past a size or age threshold (and on exit). A compaction
+first appends a "checkpoint" line carrying the sha256 of the new snapshot,
+then atomically replaces the snapshot, then truncates the journal to that
+checkpoint. On load, the store replays only the records after the newest
+checkpoint that matches the snapshot on disk, so a crash at any step never
+applies an operation twice.
+
+Usage:
+    python3 scripts/space_journal.py status
+    python3 scripts/space_journal.py compact
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+import codec
+from space_model import is_mapping
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+OPS = ('create_space', 'mark_taken', 'add_update', 'publish', 'unpublish', 'instructions', 'revert', 'describe',
+       'exif_dates')
+
+
+def journal_path_for(snapshot_path):
+    """spaces_new.json -> spaces_new.journal.jsonl"""
+    return os.path.splitext(snapshot_path)[0] + '.journal.jsonl'
+
+
+def fsync_dir(path):
+    """Make a rename inside a directory durable (no-op where unsupported)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """Write bytes to a temp file, fsync it and rename it over path"""
+    tmp = f'{path}.tmp.{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+def encode_record(rec):
+    return codec.dumps(rec) + b'\n'
+
+
+def apply_patch(space, rec):
+    """Apply one non-create journal record to a space dict in place"""
+    if rec.get('pop_update'):
+        updates = space.get('updates') or []
+        if updates:
+            updates.pop()
+    drop = rec.get('drop_image')
+    if drop:
+        imgs = space.get('images') or []
+        if imgs and is_mapping(imgs[0]) and imgs[0].get('src') == drop:
+            imgs.pop(0)
+    for key, items in (rec.get('extend') or {}).items():
+        if space.get(key) is None:
+            space[key] = []
+        space[key].extend(items)
+    for key, value in (rec.get('set') or {}).items():
+        space[key] = value
+    for key in rec.get('unset') or []:
+        space.pop(key, None)
+
+
+class SpaceJournal:
+    """The journal file plus a sidecar lock file shared by all processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._lock_file = None
+        self._lock_depth = 0
+
+    @contextmanager
+    def locked(self):
+        """Exclusive cross-process lock (the journal itself gets replaced on compaction).
+
+        Re-entrant within the thread that holds it; callers serialise threads
+        with their own lock first.
+        """
+        if fcntl is None:
+            yield
+            return
+        if self._lock_depth == 0:
+            self._lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def stat(self):
+        """(inode, size) of the journal, or None if it does not exist"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    def read(self, offset=0):
+        """Return (records, end_offset) for complete lines from offset on.
+
+        A torn last line (crash mid-append) is ignored and left in place.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = data.rfind(b'\n') + 1
+        records = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(codec.loads(line))
+            except codec.DecodeError as e:
+                print(f"⚠️  Warning: skipping bad journal line in {self.path}: {e}")
+        return records, offset + end
+
+    def append(self, records):
+        """Append records with a single write + fsync. Returns the new file size."""
+        data = b''.join(encode_record(r) for r in records)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    def rewrite(self, records):
+        """Atomically replace the journal with the given records"""
+        atomic_write(self.path, b''.join(encode_record(r) for r in records))
+
+
+def replay_start(records, snapshot_sha):
+    """Index of the first record to replay on top of a snapshot with this hash.
+
+    Records after the newest checkpoint matching the snapshot are replayed.
+    If no checkpoint matches (first run, or the snapshot was edited by hand),
+    every operation in the journal is replayed.
+    """
+    for i in range(len(records) - 1, -1, -1):
+        rec = records[i]
+        if rec.get('op') == 'checkpoint' and rec.get('sha256') == snapshot_sha:
+            return i + 1
+    return 0
+
+
+def main(argv):
+    from space_store import get_store, SP_NEW
+    cmd = argv[1] if len(argv) > 1 else 'status'
+    store = get_store(SP_NEW, backend='json')
+    if cmd == 'compact':
+        store.compact(force=True)
+        print('Compacted journal into', store.path)
+    elif cmd == 'status':
+        records, _ = store.journal.read()
+        ops = [r for r in records if r.get('op') != 'checkpoint']
+        st = store.journal.stat()
+        print(f"{store.journal.path}: {st[1] if st else 0} bytes, {len(ops)} pending operations")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
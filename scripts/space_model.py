@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory model for spaces: Space, Update, ImageRef, TakenArtist.
+
+A parsed spaces_new.json is mostly small dicts (one per image, update and
+artist), each with its own hash table, and the same short strings repeated
+in every one of them ('published', 'primary', 'update', author and artist
+names). The records here keep the known fields in __slots__, intern those
+enum-like strings, and share one key-order tuple per distinct layout, so a
+record costs a fraction of the dict it replaces.
+
+Records behave like the dicts the scripts already use (get, [], in, keys,
+items, setdefault, pop, ==), so code written against plain dicts keeps
+working. Unknown keys are kept in a per-record dict, and to_dict() gives
+back the keys in their original order, so
+    codec.dumps_pretty([Space.from_dict(s) for s in spaces])
+is byte for byte the file they were read from. codec encodes records
+directly (it calls to_dict()).
+
+from_dict() runs once per image, update and artist of every load, so each
+record class compiles one builder per key layout it meets (as namedtuple and
+dataclasses generate their code) that unpacks d.values() straight into the
+slots, with no per-key lookups. from_dicts() builds a whole file's worth
+with the cyclic garbage collector paused: records hold no cycles, and
+otherwise its passes over the growing heap cost more than the building.
+
+Usage:
+    from space_model import Space, is_mapping, plain
+    space = Space.from_dict(codec.loads(raw))
+    space['status'] = 'taken'
+    space.adopt()        # after appending plain dicts to images/updates/...
+    jsonify(plain(payload))
+"""
+import gc
+import sys
+
+_intern = sys.intern
+_MISSING = object()
+# one shared tuple per distinct key order
+_layouts = {}
+# compiled from_dict() builders per record class; further layouts use the generic loop
+MAX_BUILDERS = 256
+
+
+def _layout(keys):
+    return _layouts.setdefault(keys, keys)
+
+
+class Record:
+    """Slotted, dict-compatible record; subclasses list FIELDS, CHILDREN and INTERNED"""
+    __slots__ = ('_keys', '_extra')
+    FIELDS = ()
+    # key -> record class of the dict elements in that list
+    CHILDREN = {}
+    # keys whose string values are interned
+    INTERNED = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.FIELDS)
+        # key layout -> builder(d)
+        cls._builders = {}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Build a record from a parsed dict; dict elements of child lists become records too"""
+        keys = tuple(d)
+        build = cls._builders.get(keys)
+        if build is None:
+            if len(cls._builders) >= MAX_BUILDERS:
+                return cls._from_dict(d)
+            build = cls._builders[keys] = cls._compile(keys)
+        return build(d)
+
+    @classmethod
+    def from_dicts(cls, items):
+        """[from_dict(d) for d in items], without garbage collector passes in between"""
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return [cls.from_dict(d) for d in items]
+        finally:
+            if enabled:
+                gc.enable()
+
+    @classmethod
+    def _compile(cls, keys):
+        """Generated from_dict() for dicts with exactly these keys, in this order"""
+        env = {'new': cls.__new__, 'cls': cls, 'intern': _intern, 'keys': _layout(keys)}
+        lines = ['def build(d):', '    self = new(cls)']
+        if keys:
+            lines.append('    (' + ''.join(f'v{i}, ' for i in range(len(keys))) + ') = d.values()')
+        extra = []
+        for i, k in enumerate(keys):
+            v = f'v{i}'
+            if k in cls.CHILDREN:
+                env[f'sub{i}'] = cls.CHILDREN[k].from_dict
+                v = f'[sub{i}(x) if type(x) is dict else x for x in {v}] if type({v}) is list else {v}'
+            elif k in cls.INTERNED:
+                v = f'intern({v}) if type({v}) is str else {v}'
+            if k in cls._fields:
+                lines.append(f'    self.{k} = {v}')
+            else:
+                extra.append(f'{k!r}: {v}')
+        lines.append('    self._keys = keys')
+        lines.append(f"    self._extra = {{{', '.join(extra)}}}" if extra else '    self._extra = None')
+        lines.append('    return self')
+        exec('\n'.join(lines), env)
+        return env['build']
+
+    @classmethod
+    def _from_dict(cls, d):
+        """from_dict() for any layout, key by key"""
+        self = cls.__new__(cls)
+        fields, children, interned = cls._fields, cls.CHILDREN, cls.INTERNED
+        extra = None
+        for k, v in d.items():
+            if k in children and type(v) is list:
+                sub = children[k]
+                v = [sub.from_dict(x) if type(x) is dict else x for x in v]
+            elif k in interned and type(v) is str:
+                v = _intern(v)
+            if k in fields:
+                setattr(self, k, v)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+        self._keys = _layout(tuple(d))
+        self._extra = extra
+        return self
+
+    def to_dict(self):
+        """Plain dict in the original key order (child records converted, other values shared)"""
+        out = {}
+        fields, children = self._fields, self.CHILDREN
+        for k in self._keys:
+            v = getattr(self, k) if k in fields else self._extra[k]
+            if k in children and type(v) is list:
+                v = [x.to_dict() if isinstance(x, Record) else x for x in v]
+            out[k] = v
+        return out
+
+    def adopt(self):
+        """Convert plain dicts placed in child lists (e.g. by apply_patch) into records"""
+        for k, sub in self.CHILDREN.items():
+            v = self.get(k)
+            if type(v) is list:
+                for i, x in enumerate(v):
+                    if type(x) is dict:
+                        v[i] = sub.from_dict(x)
+                    elif isinstance(x, Record):
+                        x.adopt()
+        return self
+
+    # -- dict interface ---------------------------------------------------
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return getattr(self, key, default)
+        extra = self._extra
+        return extra.get(key, default) if extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.CHILDREN and type(value) is list:
+            sub = self.CHILDREN[key]
+            value = [sub.from_dict(x) if type(x) is dict else x for x in value]
+        elif key in self.INTERNED and type(value) is str:
+            value = _intern(value)
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        if key not in self._keys:
+            self._keys = _layout(self._keys + (key,))
+
+    def __delitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key in self._fields:
+            delattr(self, key)
+        else:
+            del self._extra[key]
+        self._keys = _layout(tuple(k for k in self._keys if k != key))
+
+    def pop(self, key, default=_MISSING):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self._keys:
+            self[key] = default
+        return self[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return [self[k] for k in self._keys]
+
+    def items(self):
+        return [(k, self[k]) for k in self._keys]
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class ImageRef(Record):
+    FIELDS = ('src', 'taken_at', 'role')
+    __slots__ = FIELDS
+    INTERNED = frozenset({'role'})
+
+
+class Update(Record):
+    FIELDS = ('author', 'text', 'action', 'images', 'created_at', 'status')
+    __slots__ = FIELDS
+    CHILDREN = {'images': ImageRef}
+    INTERNED = frozenset({'author', 'action', 'status'})
+
+
+class TakenArtist(Record):
+    FIELDS = ('name', 'taken_at', 'instructions', 'instruction_images')
+    __slots__ = FIELDS
+    CHILDREN = {'instruction_images': ImageRef}
+    INTERNED = frozenset({'name'})
+
+
+class Space(Record):
+    FIELDS = (
+        'id', 'description', 'images', 'status', 'location', 'element', 'style',
+        'has_hook', 'clip_type', 'clip_activity', 'description_ja', 'taken_at',
+        'taken_by', 'instruction_text', 'instruction_images', 'updates',
+        'modified_by', 'modified_at', 'note', 'created_by', 'created_at',
+        'taken_artists', 'taken_note', 'unpublished_at',
+    )
+    __slots__ = FIELDS
+    CHILDREN = {'images': ImageRef, 'updates': Update,
+                'taken_artists': TakenArtist, 'instruction_images': ImageRef}
+    INTERNED = frozenset({'status', 'location', 'element', 'style', 'clip_type',
+                          'clip_activity', 'taken_by', 'modified_by', 'created_by'})
+
+
+def is_mapping(obj):
+    """True for plain dicts and records (the image/update/artist entries can be either)"""
+    return isinstance(obj, (dict, Record))
+
+
+def plain(obj):
+    """Deep copy of obj with every record turned into a dict (for jsonify and friends)"""
+    if isinstance(obj, Record):
+        obj = obj.to_dict()
+    if isinstance(obj, dict):
+        return {k: plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [plain(v) for v in obj]
+    return obj
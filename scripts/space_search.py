@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Search spaces by what their photo shows: /api/search?q= in admin.py.
+
+The query is encoded by the CLIP text tower (clip_embeddings.py); the last
+QUERY_CACHE query embeddings are kept in an LRU, so a repeated query skips
+the model. It is scored against the first-image embeddings of the spaces
+through the similar-spaces index (similar_spaces.py: one matrix-vector
+product, or the nearest clusters past IVF_MIN spaces). On top of that, each
+query word found in a space's description, description_ja, clip_type or
+clip_activity adds its share of TEXT_WEIGHT, so a word of the caption (or
+a Japanese query against description_ja) still counts. Without torch, or
+before any image is embedded, the text match alone ranks the spaces.
+
+The text of each space is lowercased once and kept while its header object
+is unchanged (the store replaces the header of a space it writes). While
+the header list as a whole is unchanged, the rows each query word was found
+in are kept too, so a repeated word costs nothing.
+
+Usage:
+    from space_search import search
+    results, mode = search('a hook on a white wall', store)
+    # [(id, score), ...] best first; mode 'clip+text' or 'text'
+
+    python3 scripts/space_search.py "a hook on a white wall" [limit]
+"""
+import collections
+import functools
+import heapq
+import operator
+import os
+import sys
+import threading
+import time
+
+from space_model import is_mapping
+
+try:
+    import similar_spaces
+    from clip_embeddings import encode_texts, torch
+except Exception:
+    # needs numpy
+    similar_spaces = None
+    torch = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+LIMIT = 20
+QUERY_CACHE = 256
+# spaces taken from the embedding index before text scores are added
+CANDIDATES = 200
+TEXT_WEIGHT = 0.1
+TEXT_FIELDS = ('description', 'description_ja', 'clip_type', 'clip_activity')
+STOPWORDS = frozenset({'a', 'an', 'the', 'on', 'in', 'at', 'of', 'to', 'and', 'or', 'with', 'for', 'by'})
+
+# id -> (header, lowercased text)
+_texts = {}
+# the last header list with its texts and the hits of each query term in them
+_table = None
+_texts_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE)
+def _query_embedding(q):
+    vector = encode_texts([q])[0]
+    vector.setflags(write=False)
+    return vector
+
+
+def query_embedding(q):
+    """Normalized CLIP text embedding of q (LRU cached); None without torch"""
+    if similar_spaces is None or torch is None:
+        return None
+    return _query_embedding(' '.join(q.lower().split()))
+
+
+def _space_text(header):
+    parts = []
+    for field in TEXT_FIELDS:
+        value = header.get(field)
+        if is_mapping(value):
+            parts.extend(str(v) for v in value.values() if v)
+        elif value:
+            parts.append(str(value))
+    return ' | '.join(parts).lower()
+
+
+class _TextTable:
+    """Texts of one header list, with the rows of each term looked up in them"""
+
+    def __init__(self, headers, ids, texts):
+        self.headers = headers
+        self.ids = ids
+        self.texts = texts
+        self.hits = {}
+
+    def rows(self, term):
+        rows = self.hits.get(term)
+        if rows is None:
+            if len(self.hits) >= QUERY_CACHE:
+                self.hits.clear()
+            rows = self.hits[term] = [i for i, text in enumerate(self.texts) if term in text]
+        return rows
+
+
+def _text_table(headers):
+    """The _TextTable of headers; the last one is reused while every header is the same object"""
+    global _table
+    headers = list(headers)
+    with _texts_lock:
+        table = _table
+        if (table is not None and len(table.headers) == len(headers)
+                and all(map(operator.is_, headers, table.headers))):
+            return table
+        ids, texts = [], []
+        for header in headers:
+            sid = header.get('id')
+            cached = _texts.get(sid)
+            if cached is None or cached[0] is not header:
+                cached = _texts[sid] = (header, _space_text(header))
+            ids.append(sid)
+            texts.append(cached[1])
+        _table = _TextTable(headers, ids, texts)
+        return _table
+
+
+def query_terms(q):
+    return [t for t in dict.fromkeys(q.lower().split()) if t not in STOPWORDS]
+
+
+def text_scores(q, headers):
+    """{id: share of the query terms found in the space's texts}, for spaces with any"""
+    terms = query_terms(q)
+    if not terms:
+        return {}
+    table = _text_table(headers)
+    found = collections.Counter()
+    for term in terms:
+        found.update(table.rows(term))
+    ids = table.ids
+    return {ids[i]: n / len(terms) for i, n in found.items()}
+
+
+def search(q, store, limit=LIMIT):
+    """([(id, score)] best first, mode) of the spaces of store matching q"""
+    q = ' '.join(q.split())
+    if not q:
+        return [], 'text'
+    text = text_scores(q, store.headers())
+    clip, mode = {}, 'text'
+    try:
+        vector = query_embedding(q)
+    except Exception as e:
+        print(f'⚠️  Warning: could not encode query {q!r}: {e}')
+        vector = None
+    if vector is not None:
+        index = similar_spaces.get_similar_index(store)
+        if len(index):
+            mode = 'clip+text'
+            clip = dict(index.search(vector, max(limit, CANDIDATES)))
+            # text matches outside the candidates still get their image score
+            rest = [sid for sid in text if sid not in clip and sid in index.pos]
+            if len(rest) > CANDIDATES:
+                # one product over every row beats gathering most of them
+                scores = (index.vectors @ vector).tolist()
+                clip.update((sid, scores[index.pos[sid]]) for sid in rest)
+            elif rest:
+                scores = index.vectors[[index.pos[sid] for sid in rest]] @ vector
+                clip.update(zip(rest, scores.tolist()))
+    scores = dict(clip)
+    for sid, share in text.items():
+        scores[sid] = scores.get(sid, 0.0) + TEXT_WEIGHT * share
+    return heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1]), mode
+
+
+def main(argv):
+    if len(argv) < 2:
+        raise SystemExit('Usage: space_search.py "<query>" [limit]')
+    from space_store import get_store
+    store = get_store(SP_NEW)
+    limit = int(argv[2]) if len(argv) > 2 else LIMIT
+    for attempt in ('cold', 'warm'):
+        started = time.perf_counter()
+        results, mode = search(argv[1], store, limit)
+        print(f'{attempt}: {len(results)} results ({mode}) in {(time.perf_counter() - started) * 1000:.1f} ms')
+    for sid, score in results:
+        print(f'{sid}\t{score:.3f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
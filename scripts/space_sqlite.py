@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+SQLite backend for the space store.
+
+Same interface as SpaceStore in space_store.py (spaces/get/by_status/
+by_artist/next_id/apply/batch/compact/write), so the admin servers, the
+writer thread and the exporters work unchanged. Enable it with
+
+    SPACES_BACKEND=sqlite python3 scripts/admin.py
+
+The database lives next to the snapshot (spaces_new.db). Each space is one
+row in `spaces` holding its scalar fields; its images, updates (and the
+images of each update) and taken_artists are rows in their own tables, so
+a point read or an edit touches one space's rows instead of the whole
+catalogue. Each row keeps the element's JSON text and each space row keeps
+its key order, so rebuilding the JSON gives byte-identical output.
+
+spaces_new.json, spaces_optimized.json and spaces_timeline.json are
+generated from the database. compact() rewrites spaces_new.json (with the
+same backup hook and 10 minute / exit triggers as the journal), and the
+export worker keeps the other two up to date.
+
+On first use the database is filled from spaces_new.json plus any pending
+journal records.
+
+Usage:
+    python3 scripts/space_sqlite.py status
+    python3 scripts/space_sqlite.py import [--force]   # (re)load from spaces_new.json
+    python3 scripts/space_sqlite.py export             # write all three JSON files
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import codec
+from space_journal import OPS, apply_patch, atomic_write
+from space_model import Space, is_mapping
+from space_store import COMPACT_SECONDS, SP_NEW, SpaceStore, dump_snapshot, space_header
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spaces (
+    id TEXT PRIMARY KEY,
+    pos INTEGER NOT NULL,
+    num_id INTEGER,
+    status TEXT,
+    taken_by TEXT,
+    header BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spaces_pos ON spaces(pos);
+CREATE INDEX IF NOT EXISTS spaces_status ON spaces(status);
+CREATE INDEX IF NOT EXISTS spaces_taken_by ON spaces(taken_by);
+
+CREATE TABLE IF NOT EXISTS images (
+    space_id TEXT NOT NULL,
+    update_idx INTEGER NOT NULL,  -- -1 for the space's own images
+    idx INTEGER NOT NULL,
+    src TEXT,
+    doc BLOB NOT NULL,
+    PRIMARY KEY (space_id, update_idx, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS images_src ON images(src);
+
+CREATE TABLE IF NOT EXISTS updates (
+    space_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    author TEXT,
+    status TEXT,
+    created_at TEXT,
+    doc BLOB NOT NULL,
+    PRIMARY KEY (space_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS updates_author ON updates(author);
+
+CREATE TABLE IF NOT EXISTS taken_artists (
+    space_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT,
+    doc BLOB NOT NULL,
+    PRIMARY KEY (space_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS taken_artists_name ON taken_artists(name);
+"""
+
+# Stands in for a list that lives in a child table, keeping the key's position
+ROWS = {'$rows': 1}
+CHILD_KEYS = ('images', 'updates', 'taken_artists')
+
+
+def db_path_for(snapshot_path):
+    """spaces_new.json -> spaces_new.db"""
+    return os.path.splitext(snapshot_path)[0] + '.db'
+
+
+def _num(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _src(img):
+    return img.get('src') if is_mapping(img) else img if isinstance(img, str) else None
+
+
+def _header(obj, keys):
+    return codec.dumps({k: (ROWS if k in keys and isinstance(v, list) else v) for k, v in obj.items()})
+
+
+class SQLiteSpaceStore:
+    """Spaces kept in SQLite, with a resident list for full scans.
+
+    spaces() is cached and patched in place by this process's own writes;
+    get(), by_status() and by_artist() are indexed queries. Changes
+    committed by other processes are noticed through PRAGMA data_version.
+    """
+
+    def __init__(self, path=SP_NEW, db_path=None):
+        self.path = path
+        self.db_path = db_path or db_path_for(path)
+        self.lock = threading.RLock()
+        self.compact_seconds = COMPACT_SECONDS
+        self.on_compact = None
+        self.generation = 0
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+        self._data_version = None
+        self._all = None
+        self._positions = {}
+        self._reserved_id = 0
+        self._seq = 0
+        self._pending_since = None
+        # Set once this process wrote; only writers regenerate the snapshot at exit
+        self._journaled = False
+        if not self._conn.execute('SELECT 1 FROM spaces LIMIT 1').fetchone():
+            self.import_json()
+
+    # -- reading rows ----------------------------------------------------
+
+    def _children(self, space_id=None):
+        """Child rows grouped by space: {key: {space_id: [...]}, 'update_images': {...}}"""
+        where, args = ('WHERE space_id = ?', (space_id,)) if space_id is not None else ('', ())
+        images, update_images, updates, artists = {}, {}, {}, {}
+        for sid, uidx, doc in self._conn.execute(
+                f'SELECT space_id, update_idx, doc FROM images {where} ORDER BY space_id, update_idx, idx', args):
+            target = images.setdefault(sid, []) if uidx < 0 else update_images.setdefault((sid, uidx), [])
+            target.append(codec.loads(doc))
+        for sid, doc in self._conn.execute(
+                f'SELECT space_id, doc FROM updates {where} ORDER BY space_id, idx', args):
+            updates.setdefault(sid, []).append(codec.loads(doc))
+        for sid, doc in self._conn.execute(
+                f'SELECT space_id, doc FROM taken_artists {where} ORDER BY space_id, idx', args):
+            artists.setdefault(sid, []).append(codec.loads(doc))
+        return {'images': images, 'updates': updates, 'taken_artists': artists,
+                'update_images': update_images}
+
+    def _assemble(self, sid, header, children):
+        space = codec.loads(header)
+        for key in CHILD_KEYS:
+            if space.get(key) == ROWS:
+                space[key] = children[key].get(sid, [])
+        for i, upd in enumerate(space.get('updates') or []):
+            if isinstance(upd, dict) and upd.get('images') == ROWS:
+                upd['images'] = children['update_images'].get((sid, i), [])
+        return Space.from_dict(space)
+
+    def _read(self, space_id):
+        sid = str(space_id)
+        row = self._conn.execute('SELECT header FROM spaces WHERE id = ?', (sid,)).fetchone()
+        if row is None:
+            return None
+        return self._assemble(sid, row[0], self._children(sid))
+
+    def _read_many(self, where='', args=()):
+        rows = self._conn.execute(f'SELECT id, header FROM spaces {where} ORDER BY pos', args).fetchall()
+        if not rows:
+            return []
+        if len(rows) <= 32:
+            # a few spaces: indexed lookups beat scanning every child table
+            return [self._assemble(sid, header, self._children(sid)) for sid, header in rows]
+        children = self._children()
+        return [self._assemble(sid, header, children) for sid, header in rows]
+
+    # -- writing rows ----------------------------------------------------
+
+    def _write_images(self, sid, uidx, images, start=0):
+        self._conn.executemany(
+            'INSERT INTO images (space_id, update_idx, idx, src, doc) VALUES (?, ?, ?, ?, ?)',
+            [(sid, uidx, start + i, _src(img), codec.dumps(img)) for i, img in enumerate(images)])
+
+    def _write_updates(self, sid, updates, start=0):
+        for i, upd in enumerate(updates, start):
+            doc = _header(upd, ('images',)) if is_mapping(upd) else codec.dumps(upd)
+            self._conn.execute(
+                'INSERT INTO updates (space_id, idx, author, status, created_at, doc) VALUES (?, ?, ?, ?, ?, ?)',
+                (sid, i, upd.get('author') if is_mapping(upd) else None,
+                 upd.get('status') if is_mapping(upd) else None,
+                 upd.get('created_at') if is_mapping(upd) else None, doc))
+            if is_mapping(upd) and isinstance(upd.get('images'), list):
+                self._write_images(sid, i, upd['images'])
+
+    def _write_artists(self, sid, artists, start=0):
+        self._conn.executemany(
+            'INSERT INTO taken_artists (space_id, idx, name, doc) VALUES (?, ?, ?, ?)',
+            [(sid, start + i, a.get('name') if is_mapping(a) else None, codec.dumps(a))
+             for i, a in enumerate(artists)])
+
+    def _delete_rows(self, sid, key, start=0):
+        if key == 'images':
+            self._conn.execute('DELETE FROM images WHERE space_id = ? AND update_idx < 0 AND idx >= ?', (sid, start))
+        elif key == 'updates':
+            self._conn.execute('DELETE FROM updates WHERE space_id = ? AND idx >= ?', (sid, start))
+            self._conn.execute('DELETE FROM images WHERE space_id = ? AND update_idx >= ?', (sid, start))
+        else:
+            self._conn.execute('DELETE FROM taken_artists WHERE space_id = ? AND idx >= ?', (sid, start))
+
+    def _write_rows(self, sid, key, items, start=0):
+        if key == 'images':
+            self._write_images(sid, -1, items, start)
+        elif key == 'updates':
+            self._write_updates(sid, items, start)
+        else:
+            self._write_artists(sid, items, start)
+
+    def _write_header(self, space, pos):
+        sid = str(space.get('id'))
+        self._conn.execute(
+            'INSERT OR REPLACE INTO spaces (id, pos, num_id, status, taken_by, header) VALUES (?, ?, ?, ?, ?, ?)',
+            (sid, pos, _num(space.get('id')), space.get('status'), space.get('taken_by'),
+             _header(space, CHILD_KEYS)))
+
+    def _insert_space(self, space, pos):
+        self._write_header(space, pos)
+        sid = str(space.get('id'))
+        for key in CHILD_KEYS:
+            if isinstance(space.get(key), list):
+                self._write_rows(sid, key, space[key])
+
+    def _save_patch(self, space, rec, lengths):
+        """Write the rows a patch touched; lengths are the child list sizes before it"""
+        sid = str(space.get('id'))
+        pos = self._conn.execute('SELECT pos FROM spaces WHERE id = ?', (sid,)).fetchone()[0]
+        self._write_header(space, pos)
+        replaced = set(rec.get('set') or {}) | set(rec.get('unset') or [])
+        if rec.get('drop_image'):
+            replaced.add('images')
+        for key in CHILD_KEYS:
+            items = space.get(key) if isinstance(space.get(key), list) else []
+            if key in replaced:
+                self._delete_rows(sid, key)
+                self._write_rows(sid, key, items)
+                continue
+            start = lengths[key]
+            if key == 'updates' and rec.get('pop_update') and start:
+                # the last update was removed (and maybe replaced by an extend)
+                start -= 1
+                self._delete_rows(sid, key, start)
+            if len(items) > start:
+                # extend: only the new elements get rows
+                self._write_rows(sid, key, items[start:], start)
+
+    # -- store interface -------------------------------------------------
+
+    def refresh(self):
+        """Notice commits from other processes. Returns True if the cache was dropped."""
+        with self.lock:
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if version == self._data_version:
+                return False
+            changed = self._data_version is not None
+            self._data_version = version
+            if changed:
+                self._all = None
+                self.generation += 1
+            return changed
+
+    def invalidate(self):
+        with self.lock:
+            self._all = None
+            self.generation += 1
+
+    def spaces(self):
+        with self.lock:
+            self.refresh()
+            if self._all is None:
+                self._all = self._read_many()
+                self._positions = {str(s.get('id')): i for i, s in enumerate(self._all)}
+            return self._all
+
+    def headers(self):
+        """Every space without its images and updates (for listings)"""
+        with self.lock:
+            if self._all is not None and not self.refresh():
+                return [space_header(s) for s in self._all]
+            artists = {}
+            for sid, doc in self._conn.execute('SELECT space_id, doc FROM taken_artists ORDER BY space_id, idx'):
+                artists.setdefault(sid, []).append(codec.loads(doc))
+            out = []
+            for sid, header in self._conn.execute('SELECT id, header FROM spaces ORDER BY pos'):
+                space = codec.loads(header)
+                if space.get('taken_artists') == ROWS:
+                    space['taken_artists'] = artists.get(sid, [])
+                out.append(space_header(space))
+            return out
+
+    def get(self, space_id):
+        with self.lock:
+            self.refresh()
+            if self._all is not None:
+                i = self._positions.get(str(space_id))
+                return self._all[i] if i is not None else None
+            return self._read(space_id)
+
+    def by_status(self, status):
+        with self.lock:
+            if status == 'available':
+                return self._read_many("WHERE status = ? OR status IS NULL OR status = ''", (status,))
+            return self._read_many('WHERE status = ?', (status,))
+
+    def by_artist(self, name):
+        with self.lock:
+            return self._read_many(
+                'WHERE taken_by = ? OR id IN (SELECT space_id FROM taken_artists WHERE name = ?)', (name, name))
+
+    def next_id(self):
+        """Reserve the next free space id (never handed out twice by this process)"""
+        with self.lock:
+            max_id = self._conn.execute('SELECT MAX(num_id) FROM spaces').fetchone()[0] or 0
+            new_id = max(max_id, self._reserved_id) + 1
+            self._reserved_id = new_id
+            return new_id
+
+    def _cache_put(self, space):
+        if self._all is None:
+            return
+        sid = str(space.get('id'))
+        i = self._positions.get(sid)
+        if i is None:
+            self._positions[sid] = len(self._all)
+            self._all.append(space)
+        else:
+            self._all[i] = space
+
+    def _apply(self, op, space_id=None, patch=None, space=None):
+        if op not in OPS:
+            raise ValueError(f'unknown journal operation: {op}')
+        self._conn.execute('SAVEPOINT apply_op')
+        try:
+            rec, result = self._apply_rows(op, space_id, patch, space)
+        except BaseException:
+            # undo this mutation's rows; the cached copy may be half-patched
+            self._conn.execute('ROLLBACK TO apply_op')
+            self._conn.execute('RELEASE apply_op')
+            self._all = None
+            raise
+        self._conn.execute('RELEASE apply_op')
+        self._seq = rec['seq']
+        self._cache_put(result)
+        return rec, result
+
+    def _apply_rows(self, op, space_id, patch, space):
+        rec = {'seq': self._seq + 1, 'ts': datetime.utcnow().isoformat(), 'op': op}
+        if op == 'create_space':
+            if self._conn.execute('SELECT 1 FROM spaces WHERE id = ?', (str(space.get('id')),)).fetchone():
+                raise ValueError(f"space {space.get('id')} already exists")
+            pos = self._conn.execute('SELECT COALESCE(MAX(pos), -1) + 1 FROM spaces').fetchone()[0]
+            result = Space.from_dict(space)
+            self._insert_space(result, pos)
+        else:
+            result = self.get(space_id)
+            if result is None:
+                raise KeyError(f'space {space_id} not found')
+            rec.update(patch or {})
+            lengths = {k: len(result[k]) if isinstance(result.get(k), list) else 0 for k in CHILD_KEYS}
+            apply_patch(result, rec)
+            result.adopt()
+            self._save_patch(result, rec, lengths)
+        return rec, result
+
+    @contextmanager
+    def batch(self):
+        """Run several mutations in one SQLite transaction (one fsync)"""
+        with self.lock:
+            self.refresh()
+            self._conn.execute('BEGIN IMMEDIATE')
+            batch = SQLiteBatch(self)
+            try:
+                yield batch
+            except BaseException:
+                if batch.records:
+                    # keep what was applied before the error, like the journal does
+                    self._commit(batch.records)
+                else:
+                    self._conn.execute('ROLLBACK')
+                raise
+            if batch.records:
+                self._commit(batch.records)
+            else:
+                self._conn.execute('ROLLBACK')
+
+    def _commit(self, records):
+        try:
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            self.invalidate()
+            raise
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        self._journaled = True
+        if self._pending_since is None:
+            self._pending_since = time.time()
+        if time.time() - self._pending_since >= self.compact_seconds:
+            self.compact()
+
+    def apply(self, op, space_id=None, patch=None, space=None):
+        """Apply one typed mutation (see SpaceStore.apply) in its own transaction"""
+        with self.batch() as batch:
+            return batch.apply(op, space_id, patch, space=space)
+
+    def compact(self, force=False):
+        """Regenerate spaces_new.json from the database. Returns True if written."""
+        with self.lock:
+            if self._pending_since is None and not force:
+                return False
+            data = dump_snapshot(self.spaces())
+            if self.on_compact is not None:
+                self.on_compact(self)
+            atomic_write(self.path, data)
+            self._pending_since = None
+            return True
+
+    def write(self, spaces):
+        """Replace the whole dataset in one transaction and regenerate the snapshot"""
+        with self.lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for table in ('spaces', 'images', 'updates', 'taken_artists'):
+                    self._conn.execute(f'DELETE FROM {table}')
+                for pos, space in enumerate(spaces):
+                    self._insert_space(space, pos)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            self._all = None
+            self.generation += 1
+            self._pending_since = time.time()
+            self.compact(force=True)
+
+    def import_json(self, path=None):
+        """Load spaces_new.json (snapshot plus pending journal) into the database"""
+        json_store = SpaceStore(path or self.path)
+        spaces = json_store.spaces()
+        # Fold pending journal records into the snapshot so they are not
+        # replayed a second time if the JSON backend is used again later
+        json_store.compact()
+        with self.lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for table in ('spaces', 'images', 'updates', 'taken_artists'):
+                    self._conn.execute(f'DELETE FROM {table}')
+                for pos, space in enumerate(spaces):
+                    self._insert_space(space, pos)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            self._all = None
+            self.generation += 1
+        return len(spaces)
+
+    def status(self):
+        with self.lock:
+            counts = {table: self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                      for table in ('spaces', 'images', 'updates', 'taken_artists')}
+        counts['db'] = self.db_path
+        return counts
+
+
+class SQLiteBatch:
+    """Handle passed to code running inside SQLiteSpaceStore.batch()"""
+
+    def __init__(self, store):
+        self.store = store
+        self.records = []
+
+    def get(self, space_id):
+        return self.store.get(space_id)
+
+    def next_id(self):
+        return self.store.next_id()
+
+    def apply(self, op, space_id=None, patch=None, space=None):
+        rec, result = self.store._apply(op, space_id, patch, space=space)
+        self.records.append(rec)
+        return result
+
+
+def main(argv):
+    from space_store import get_store
+    cmd = argv[1] if len(argv) > 1 else 'status'
+    store = get_store(SP_NEW, backend='sqlite')
+    if cmd == 'status':
+        for key, value in store.status().items():
+            print(f'{key}: {value}')
+    elif cmd == 'import':
+        if '--force' not in argv:
+            print('Refusing to overwrite the database without --force')
+            sys.exit(1)
+        print(f'Imported {store.import_json()} spaces into {store.db_path}')
+    elif cmd == 'export':
+        from export_optimized import export_optimized
+        from export_timeline import export_timeline
+        store.compact(force=True)
+        print('Wrote', store.path)
+        export_optimized()
+        export_timeline()
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
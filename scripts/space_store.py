@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+Process-resident store for spaces_new.json.
+
+The store keeps one header per space in memory (the space without its
+images and updates), indexed by id, status and artist name. Headers and the
+byte range of every space in the snapshot come from a sidecar written at
+compaction (spaces_new.index.json), so loading does not parse any update
+history; get() pages a single space in from its byte range. The file is only
+re-read when its inode, mtime or size changes (for example after a manual
+edit or a compaction by another process). Headers and spaces are
+space_model records, which read like the dicts in the file.
+
+Mutations go through apply() or batch(), which patch the in-memory copy and
+append the records to the journal (see space_journal.py) with one fsync per
+batch. The snapshot file is rewritten only when the journal is compacted.
+In the admin servers all mutations are funnelled through the single writer
+thread in space_writer.py.
+
+Usage:
+    from space_store import get_store
+    store = get_store()
+    space = store.get(42)
+    store.apply('mark_taken', 42, {'set': {'status': 'taken', 'taken_by': 'Name'}})
+"""
+import atexit
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import codec
+from space_journal import OPS, SpaceJournal, apply_patch, atomic_write, journal_path_for, replay_start
+from space_model import Space
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SP_NEW = os.path.join(ROOT, 'spaces_new.json')
+
+# Fold the journal into a new snapshot once it is this big or this old
+COMPACT_BYTES = 256 * 1024
+COMPACT_SECONDS = 10 * 60
+
+# Kept out of the resident headers and paged in from the snapshot on demand
+PAGED_KEYS = ('images', 'updates')
+# How many clean full spaces stay in memory
+PAGE_CACHE = 256
+
+# Storage backend used by get_store(): 'json' or 'sqlite'
+BACKEND = os.environ.get('SPACES_BACKEND', 'json')
+
+
+def artist_names(space):
+    """Names of everyone who took this space (legacy taken_by + taken_artists)"""
+    names = []
+    if space.get('taken_by'):
+        names.append(space['taken_by'])
+    for artist in space.get('taken_artists') or []:
+        name = artist.get('name')
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def dump_snapshot(spaces):
+    """Serialise spaces the way the canonical file has always been written"""
+    return codec.dumps_pretty(spaces)
+
+
+def element_bytes(space):
+    """One space as it appears inside the indent-2 snapshot list"""
+    return b'  ' + codec.dumps_pretty(space).replace(b'\n', b'\n  ')
+
+
+def snapshot_offsets(spaces, raw):
+    """(begin, end) of every space in raw, or None if raw is not in canonical layout"""
+    offsets, pos = [], 2
+    for space in spaces:
+        part = element_bytes(space)
+        if raw[pos:pos + len(part)] != part:
+            return None
+        offsets.append((pos, pos + len(part)))
+        pos += len(part) + 2
+    return offsets if raw[pos - 2:] == b'\n]' else None
+
+
+def space_header(space):
+    """Everything about a space except its (growing) images and updates"""
+    return Space.from_dict({k: v for k, v in space.items() if k not in PAGED_KEYS})
+
+
+def index_path_for(snapshot_path):
+    """spaces_new.json -> spaces_new.index.json"""
+    return os.path.splitext(snapshot_path)[0] + '.index.json'
+
+
+class SpaceStore:
+    """Spaces from a JSON snapshot + journal, with id/status/artist indexes.
+
+    Only a header per space (everything except its images and updates) is
+    kept for every space. Full spaces are paged in from the snapshot on
+    get() through a small LRU, using the byte offsets recorded in the
+    index sidecar; spaces changed since the last compaction stay pinned in
+    memory until the next one.
+
+    Treat the objects returned by spaces()/get()/headers() as read-only and
+    change them through apply(), so every change is journaled.
+    """
+
+    def __init__(self, path=SP_NEW, journal_path=None):
+        self.path = path
+        self.journal = SpaceJournal(journal_path or journal_path_for(path))
+        self.index_path = index_path_for(path)
+        self.lock = threading.RLock()
+        self.compact_bytes = COMPACT_BYTES
+        self.compact_seconds = COMPACT_SECONDS
+        self.page_cache = PAGE_CACHE
+        # Called with the store right before a new snapshot replaces the old one
+        self.on_compact = None
+        self._order = []
+        self._headers = {}
+        self._offsets = {}
+        self._pinned = {}
+        self._pages = OrderedDict()
+        self._by_status = {}
+        self._by_artist = {}
+        self._max_id = 0
+        self._reserved_id = 0
+        self._stat_key = None
+        self._journal_key = None
+        self._journal_offset = 0
+        self._seq = 0
+        self._pending_since = None
+        self._journaled = False
+        self._loaded = False
+        # Bumped whenever the data changes behind the writer's back (reloads,
+        # records from other processes) so derived caches know to rebuild
+        self.generation = 0
+
+    def _file_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # -- loading -------------------------------------------------------
+
+    def _read_index(self, key):
+        """Headers and offsets from the sidecar if it describes this snapshot"""
+        try:
+            index = codec.load(self.index_path)
+        except (OSError, *codec.DecodeError):
+            return None
+        if key is None or index.get('size') != key[2]:
+            return None
+        if index.get('mtime_ns') != key[1]:
+            # touched (git checkout, copy) but maybe not changed
+            with open(self.path, 'rb') as f:
+                if hashlib.sha256(f.read()).hexdigest() != index.get('sha256'):
+                    return None
+            self._write_index(index['sha256'], index['spaces'])
+        return index
+
+    def _write_index(self, sha, entries):
+        key = self._file_key()
+        index = {'sha256': sha, 'size': key[2], 'mtime_ns': key[1], 'spaces': entries}
+        try:
+            atomic_write(self.index_path, codec.dumps(index))
+        except OSError as e:
+            print(f"⚠️  Warning: could not write {self.index_path}: {e}")
+
+    def _reset(self):
+        self._order, self._headers, self._offsets = [], {}, {}
+        self._pinned, self._pages = {}, OrderedDict()
+
+    def _load(self):
+        """Read the snapshot (or just its index) and replay the journal tail"""
+        key = self._file_key()
+        index = self._read_index(key)
+        if index is not None:
+            self._reset()
+            for sid, begin, end, header in index['spaces']:
+                self._order.append(sid)
+                self._headers[sid] = Space.from_dict(header)
+                self._offsets[sid] = (begin, end)
+            sha = index['sha256']
+        else:
+            raw = b''
+            spaces = []
+            if key is not None:
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+                try:
+                    spaces = Space.from_dicts(codec.loads(raw))
+                except codec.DecodeError as e:
+                    # Keep serving the last good copy rather than an empty list
+                    print(f"⚠️  Warning: could not parse {self.path}: {e}")
+                    if self._loaded:
+                        return
+            sha = hashlib.sha256(raw).hexdigest()
+            self._reset()
+            offsets = snapshot_offsets(spaces, raw) if spaces else None
+            for i, space in enumerate(spaces):
+                sid = str(space.get('id'))
+                self._order.append(sid)
+                self._headers[sid] = space_header(space)
+                if offsets is None:
+                    # not in canonical layout: keep everything resident until compaction
+                    self._pinned[sid] = space
+                else:
+                    self._offsets[sid] = offsets[i]
+                    self._remember(sid, space)
+            if offsets is not None:
+                self._write_index(sha, [[sid, *self._offsets[sid], self._headers[sid]] for sid in self._order])
+        records, end = self.journal.read(0)
+        self._stat_key = key
+        self._journal_key = self.journal.stat()
+        self._journal_offset = end
+        self.reindex()
+        start = replay_start(records, sha)
+        self._seq = max((r.get('seq', 0) for r in records), default=0)
+        replayed = 0
+        for rec in records[start:]:
+            if rec.get('op') != 'checkpoint':
+                self._apply_record(rec)
+                replayed += 1
+        self._pending_since = time.time() if replayed else None
+        self._loaded = True
+        self.generation += 1
+
+    def _catch_up(self):
+        """Apply records another process appended since our last read"""
+        records, end = self.journal.read(self._journal_offset)
+        for rec in records:
+            if rec.get('op') != 'checkpoint' and rec.get('seq', 0) > self._seq:
+                self._apply_record(rec)
+                self.generation += 1
+                if self._pending_since is None:
+                    self._pending_since = time.time()
+            self._seq = max(self._seq, rec.get('seq', 0))
+        self._journal_offset = end
+        self._journal_key = self.journal.stat()
+
+    def refresh(self):
+        """Pick up changes made on disk. Returns True if anything was reloaded."""
+        key = self._file_key()
+        jkey = self.journal.stat()
+        if self._loaded and key == self._stat_key and jkey == self._journal_key:
+            return False
+        with self.lock:
+            key = self._file_key()
+            jkey = self.journal.stat()
+            if self._loaded and key == self._stat_key and jkey == self._journal_key:
+                return False
+            same_journal = (jkey is not None and self._journal_key is not None
+                            and jkey[0] == self._journal_key[0] and jkey[1] >= self._journal_offset)
+            if self._loaded and key == self._stat_key and same_journal:
+                self._catch_up()
+            else:
+                self._load()
+            return True
+
+    def invalidate(self):
+        """Drop the in-memory copy; the next access reloads from disk."""
+        with self.lock:
+            self._loaded = False
+            self._stat_key = None
+
+    # -- paging --------------------------------------------------------
+
+    def _remember(self, sid, space):
+        """Keep a clean full space in the LRU"""
+        self._pages[sid] = space
+        self._pages.move_to_end(sid)
+        while len(self._pages) > self.page_cache:
+            self._pages.popitem(last=False)
+
+    def _open_snapshot(self):
+        """The snapshot file, checked to be the one the offsets were taken from.
+
+        Another process may have compacted it since our last refresh(); then
+        it is reloaded first (bumping generation), so callers holding offsets
+        from before must look them up again.
+        """
+        for _ in range(3):
+            f = open(self.path, 'rb')
+            st = os.fstat(f.fileno())
+            if (st.st_ino, st.st_mtime_ns, st.st_size) == self._stat_key:
+                return f
+            f.close()
+            self._load()
+        raise OSError(f"{self.path} keeps changing while it is read")
+
+    def _read_page(self, sid, raw=None):
+        """The space at its offsets in the snapshot (raw, if given), or None if the snapshot was reloaded"""
+        if raw is None:
+            generation = self.generation
+            with self._open_snapshot() as f:
+                if self.generation != generation:
+                    return None
+                begin, end = self._offsets[sid]
+                f.seek(begin)
+                return Space.from_dict(codec.loads(f.read(end - begin)))
+        begin, end = self._offsets[sid]
+        return Space.from_dict(codec.loads(raw[begin:end]))
+
+    def _full(self, sid, raw=None, cache=True):
+        """The complete space for an id, paging it in if needed"""
+        space = self._pinned.get(sid)
+        if space is not None:
+            return space
+        space = self._pages.get(sid)
+        if space is not None:
+            self._pages.move_to_end(sid)
+            return space
+        if sid not in self._offsets:
+            return None
+        space = self._read_page(sid, raw)
+        if space is None:
+            # reloaded: the space may be pinned, paged in or gone by now
+            return self._full(sid, raw, cache)
+        if cache:
+            self._remember(sid, space)
+        return space
+
+    # -- indexes -------------------------------------------------------
+
+    def _index(self, sid, header):
+        try:
+            self._max_id = max(self._max_id, int(header.get('id', 0)))
+        except (TypeError, ValueError):
+            pass
+        self._by_status.setdefault(header.get('status') or 'available', {})[sid] = header
+        for name in artist_names(header):
+            self._by_artist.setdefault(name, {})[sid] = header
+
+    def _unindex(self, sid, header):
+        self._by_status.get(header.get('status') or 'available', {}).pop(sid, None)
+        for name in artist_names(header):
+            self._by_artist.get(name, {}).pop(sid, None)
+
+    def reindex(self):
+        """Rebuild the status/artist indexes from the headers."""
+        with self.lock:
+            self._by_status, self._by_artist = {}, {}
+            self._max_id = 0
+            for sid in self._order:
+                self._index(sid, self._headers[sid])
+
+    # -- reads ---------------------------------------------------------
+
+    def headers(self):
+        """Every space without its images and updates (cheap; for listings)"""
+        self.refresh()
+        with self.lock:
+            return [self._headers[sid] for sid in self._order]
+
+    def spaces(self):
+        """Every full space, in file order (pages in everything; prefer get()/headers())"""
+        self.refresh()
+        with self.lock:
+            raw = None
+            if len(self._pinned) + len(self._pages) < len(self._order):
+                with self._open_snapshot() as f:
+                    raw = f.read()
+            return [self._full(sid, raw, cache=False) for sid in self._order]
+
+    def get(self, space_id):
+        self.refresh()
+        with self.lock:
+            return self._full(str(space_id))
+
+    def by_status(self, status):
+        self.refresh()
+        with self.lock:
+            return [self._full(sid) for sid in list(self._by_status.get(status, {}))]
+
+    def by_artist(self, name):
+        self.refresh()
+        with self.lock:
+            return [self._full(sid) for sid in list(self._by_artist.get(name, {}))]
+
+    def next_id(self):
+        """Reserve the next free space id (never handed out twice by this process)"""
+        self.refresh()
+        with self.lock:
+            new_id = max(self._max_id, self._reserved_id) + 1
+            self._reserved_id = new_id
+            return new_id
+
+    # -- writes --------------------------------------------------------
+
+    def _apply_record(self, rec):
+        if rec['op'] == 'create_space':
+            space = Space.from_dict(rec['space'])
+            sid = str(space.get('id'))
+            self._order.append(sid)
+        else:
+            sid = str(rec.get('id'))
+            space = self._full(sid)
+            if space is None:
+                print(f"⚠️  Warning: journal record {rec.get('seq')} targets unknown space {rec.get('id')}")
+                return None
+            self._unindex(sid, self._headers[sid])
+            apply_patch(space, rec)
+            space.adopt()
+            # changed since the snapshot: keep it in memory until compaction
+            self._pages.pop(sid, None)
+        self._pinned[sid] = space
+        self._headers[sid] = space_header(space)
+        self._index(sid, self._headers[sid])
+        return space
+
+    def _make_record(self, op, space_id=None, patch=None, space=None):
+        if op not in OPS:
+            raise ValueError(f'unknown journal operation: {op}')
+        rec = {'seq': self._seq + 1, 'ts': datetime.utcnow().isoformat(), 'op': op}
+        if op == 'create_space':
+            if str(space.get('id')) in self._headers:
+                raise ValueError(f"space {space.get('id')} already exists")
+            rec['id'] = space.get('id')
+            rec['space'] = space
+        else:
+            if str(space_id) not in self._headers:
+                raise KeyError(f'space {space_id} not found')
+            rec['id'] = space_id
+            rec.update(patch or {})
+        return rec
+
+    @contextmanager
+    def batch(self):
+        """Group several mutations into one journal append + fsync.
+
+        Holds the store lock and the cross-process journal lock for the
+        duration. Each batch.apply() is visible in memory immediately; all
+        records are written when the block exits.
+        """
+        with self.lock, self.journal.locked():
+            self.refresh()
+            batch = Batch(self)
+            try:
+                yield batch
+            finally:
+                if batch.records:
+                    self._commit(batch.records)
+
+    def _commit(self, records):
+        try:
+            size = self.journal.append(records)
+        except Exception:
+            # memory is ahead of disk; start over from what was persisted
+            self.invalidate()
+            raise
+        self._journaled = True
+        self._journal_offset = size
+        self._journal_key = self.journal.stat()
+        if self._pending_since is None:
+            self._pending_since = time.time()
+        self._maybe_compact(size)
+
+    def apply(self, op, space_id=None, patch=None, space=None):
+        """Journal one typed mutation and apply it to the in-memory copy.
+
+        patch may contain 'set' (dict), 'unset' (list), 'extend' (dict of
+        lists), 'pop_update' (bool) and 'drop_image' (src); create_space
+        takes the new space dict instead. Returns the affected space.
+        """
+        with self.batch() as batch:
+            return batch.apply(op, space_id, patch, space=space)
+
+    def _maybe_compact(self, journal_size):
+        age = time.time() - self._pending_since if self._pending_since else 0
+        if journal_size >= self.compact_bytes or age >= self.compact_seconds:
+            self.compact()
+
+    def compact(self, force=False):
+        """Fold the journal into a fresh snapshot. Returns True if one was written."""
+        with self.lock, self.journal.locked():
+            self.refresh()
+            if self._pending_since is None and not force:
+                return False
+            # Unchanged spaces are copied from the old snapshot without parsing
+            raw = b''
+            if len(self._pinned) < len(self._order):
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+            parts, offsets, pos = [], {}, 2
+            for sid in self._order:
+                if sid in self._pinned:
+                    part = element_bytes(self._pinned[sid])
+                else:
+                    begin, end = self._offsets[sid]
+                    part = raw[begin:end]
+                parts.append(part)
+                offsets[sid] = (pos, pos + len(part))
+                pos += len(part) + 2
+            data = b'[\n' + b',\n'.join(parts) + b'\n]' if parts else b'[]'
+            sha = hashlib.sha256(data).hexdigest()
+            checkpoint = {'seq': self._seq, 'ts': datetime.utcnow().isoformat(), 'op': 'checkpoint',
+                          'sha256': sha}
+            if self.on_compact is not None:
+                self.on_compact(self)
+            # Mark the snapshot we are about to install, then install it,
+            # then drop the records it already contains.
+            self.journal.append([checkpoint])
+            atomic_write(self.path, data)
+            self.journal.rewrite([checkpoint])
+            self._offsets = offsets
+            for sid, space in self._pinned.items():
+                self._remember(sid, space)
+            self._pinned = {}
+            self._stat_key = self._file_key()
+            self._write_index(sha, [[sid, *offsets[sid], self._headers[sid]] for sid in self._order])
+            self._journal_key = self.journal.stat()
+            self._journal_offset = self._journal_key[1]
+            self._pending_since = None
+            return True
+
+    def write(self, spaces):
+        """Replace the whole dataset (bulk maintenance scripts) and compact."""
+        with self.lock:
+            self._reset()
+            for space in spaces:
+                sid = str(space.get('id'))
+                self._order.append(sid)
+                self._headers[sid] = space_header(space)
+                self._pinned[sid] = space
+            self.reindex()
+            self._pending_since = time.time()
+            self.compact(force=True)
+
+
+class Batch:
+    """Handle passed to code running inside SpaceStore.batch()"""
+
+    def __init__(self, store):
+        self.store = store
+        self.records = []
+
+    def get(self, space_id):
+        return self.store._full(str(space_id))
+
+    def next_id(self):
+        return self.store.next_id()
+
+    def apply(self, op, space_id=None, patch=None, space=None):
+        rec = self.store._make_record(op, space_id, patch, space=space)
+        self.store._seq = rec['seq']
+        result = self.store._apply_record(rec)
+        self.records.append(rec)
+        return result
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _compact_all():
+    # Only fold journals this process wrote to; readers leave them alone
+    for store in list(_stores.values()):
+        if not store._journaled:
+            continue
+        try:
+            store.compact()
+        except Exception as e:
+            print(f"⚠️  Warning: could not compact {store.path}: {e}")
+
+
+atexit.register(_compact_all)
+
+
+def get_store(path=SP_NEW, backend=None):
+    """Return the process-wide store for a file path.
+
+    backend is 'json' (snapshot + journal) or 'sqlite' (space_sqlite.py);
+    it defaults to the SPACES_BACKEND environment variable, then 'json'.
+    """
+    path = os.path.abspath(path)
+    backend = backend or BACKEND
+    with _stores_lock:
+        store = _stores.get((path, backend))
+        if store is None:
+            if backend == 'sqlite':
+                from space_sqlite import SQLiteSpaceStore
+                store = SQLiteSpaceStore(path)
+            elif backend == 'json':
+                store = SpaceStore(path)
+            else:
+                raise ValueError(f'unknown SPACES_BACKEND: {backend}')
+            _stores[(path, backend)] = store
+    return store
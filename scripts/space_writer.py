@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Group-commit writer for the space store.
+
+Flask's threaded server can run several mutating requests at once. Instead
+of each request doing its own read-modify-write, requests hand a function to
+the single writer thread and wait for its result:
+
+    WRITER = get_writer(STORE)
+
+    def mark(tx):
+        space = tx.get(42)
+        if space.get('taken_by'):
+            raise ValueError('already taken')
+        tx.apply('mark_taken', 42, {'set': {'status': 'taken', 'taken_by': name}})
+        return space
+
+    WRITER.transact(mark)
+
+The writer drains everything that queued up while it was flushing, runs the
+functions one after another against the live store (so each sees the
+previous one's changes), and then commits the whole batch with one journal
+append + fsync. Requests are only answered after their batch is durable.
+Snapshots written on compaction go through temp file + fsync + os.replace,
+so a crash never leaves a truncated spaces_new.json.
+
+Functions must check their preconditions before calling tx.apply(); records
+already applied when a function raises are still committed.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# How long a request waits for its commit before giving up
+COMMIT_TIMEOUT = 30
+
+
+class SpaceWriter:
+    """Single thread that owns all writes to one SpaceStore"""
+
+    def __init__(self, store):
+        self.store = store
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.mutations = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='space-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, fn):
+        """Queue fn(tx) for the writer thread. Returns a Future for its result."""
+        future = Future()
+        self._queue.put((fn, future))
+        self._ensure_started()
+        return future
+
+    def transact(self, fn, timeout=COMMIT_TIMEOUT):
+        """Run fn(tx) on the writer thread and wait until its batch is committed"""
+        return self.submit(fn).result(timeout)
+
+    def apply(self, op, space_id=None, patch=None, space=None):
+        """Commit a single mutation that does not depend on the current state"""
+        return self.transact(lambda tx: tx.apply(op, space_id, patch, space=space))
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # Everything that arrived during the previous flush goes into this batch
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.time()
+            outcomes = []
+            try:
+                with self.store.batch() as tx:
+                    for fn, future in items:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            outcomes.append((future, fn(tx), None))
+                        except Exception as e:
+                            outcomes.append((future, None, e))
+                    records = len(tx.records)
+            except Exception as e:
+                # The batch could not be made durable (or not even started:
+                # lock, fsync or disk errors on entering it); fail every request in it
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.mutations += records
+            self.last_batch_size = len(outcomes)
+            self.last_commit_ms = round((time.time() - started) * 1000, 1)
+            for future, result, error in outcomes:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def status(self):
+        return {
+            'batches': self.batches,
+            'mutations': self.mutations,
+            'last_batch_size': self.last_batch_size,
+            'last_commit_ms': self.last_commit_ms,
+            'queued': self._queue.qsize(),
+        }
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(store):
+    """Return the process-wide writer for a store"""
+    with _writers_lock:
+        writer = _writers.get(id(store))
+        if writer is None:
+            writer = _writers[id(store)] = SpaceWriter(store)
+    return writer
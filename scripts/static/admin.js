@@ -22,6 +22,30 @@ function clearPublishForm() {
   document.getElementById('update-preview').innerHTML = '';
 }
 
+// Content-addressed uploads: every image is listed by sha256 in `<field>_manifest`,
+// and only the bytes the server does not have yet (HEAD /blob/<sha>) are sent
+async function sha256Hex(file) {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function appendImages(fd, field, files, optimize) {
+  fd.delete(field);
+  if (!window.crypto || !crypto.subtle) {
+    // hashing needs a secure context (localhost is one); just upload everything
+    for (const f of files) fd.append(field, f);
+    return;
+  }
+  const manifest = [];
+  for (const f of files) {
+    const sha = await sha256Hex(f);
+    manifest.push({sha256: sha, name: f.name});
+    const res = await fetch(`/blob/${sha}${optimize ? '?optimize=1' : ''}`, {method: 'HEAD'});
+    if (!res.ok) fd.append(field, f);
+  }
+  fd.append(field + '_manifest', JSON.stringify(manifest));
+}
+
 // File upload preview functions
 function setupFileUpload(uploadAreaId, fileInputId, previewId) {
   const uploadArea = document.getElementById(uploadAreaId);
@@ -82,12 +106,9 @@ document.getElementById('mark-spaces').addEventListener('click', async function(
   if (note) fd.append('taken_note', note);
   if (instructionText) fd.append('instruction_text', instructionText);
 
-  // Add instruction files
-  for (let i = 0; i < instructionFiles.length; i++) {
-    fd.append('instruction_files', instructionFiles[i]);
-  }
-
   try {
+    // Add instruction files
+    if (instructionFiles.length) await appendImages(fd, 'instruction_files', instructionFiles, true);
     const res = await fetch('/mark_multiple', {method: 'POST', body: fd});
     const j = await res.json();
     if (j.ok) {
@@ -132,12 +153,9 @@ document.getElementById('publish-update').addEventListener('click', async functi
   fd.append('author', author);
   if (updateText) fd.append('update_text', updateText);
 
-  // Add update files
-  for (let i = 0; i < updateFiles.length; i++) {
-    fd.append('update_files', updateFiles[i]);
-  }
-
   try {
+    // Add update files
+    await appendImages(fd, 'update_files', updateFiles, true);
     const res = await fetch('/publish_update', {method: 'POST', body: fd});
     const j = await res.json();
     if (j.ok) {
@@ -170,7 +188,7 @@ document.getElementById('save').addEventListener('click', async function(){
   const form = document.getElementById('upload');
   const fd = new FormData(form);
   const files = document.getElementById('files').files;
-  for (let i=0;i<files.length;i++) fd.append('files', files[i]);
+  await appendImages(fd, 'files', files, false);
   const res = await fetch('/save', {method:'POST', body: fd});
   const j = await res.json();
   if (j && j.preview && document.getElementById('dry_run').checked) {
@@ -10,12 +10,14 @@ Usage:
 
 If no ids are supplied, entries for all ids present in spaces_new.json are synced.
 """
-import json
 import os
 import sys
 import time
 import shutil
 
+import codec
+from space_store import get_store
+
 ROOT = os.path.dirname(__file__)
 SPACES = os.path.join(ROOT, '..', 'spaces.json')
 SPACES_NEW = os.path.join(ROOT, '..', 'spaces_new.json')
@@ -23,8 +25,7 @@ SPACES_NEW = os.path.join(ROOT, '..', 'spaces_new.json')
 def load(path):
     if not os.path.exists(path):
         return []
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return codec.load(path)
 
 def main():
     if not os.path.exists(SPACES_NEW):
@@ -32,7 +33,8 @@ def main():
         sys.exit(1)
 
     spaces = load(SPACES)
-    spaces_new = load(SPACES_NEW)
+    # includes journaled changes that are not yet folded into the file
+    spaces_new = get_store(SPACES_NEW).spaces()
 
     spaces_map = {str(s['id']): s for s in spaces}
     spaces_new_map = {str(s['id']): s for s in spaces_new}
@@ -60,8 +62,7 @@ def main():
         return int(k) if k.isdigit() else k
 
     out_list = [spaces_map[k] for k in sorted(spaces_map.keys(), key=sort_key)]
-    with open(SPACES, 'w', encoding='utf-8') as f:
-        json.dump(out_list, f, ensure_ascii=False, indent=2)
+    codec.dump(out_list, SPACES)
 
     print('Wrote', len(out_list), 'spaces to', SPACES)
 
@@ -1,4 +1,6 @@
 // Spaces Catalog JavaScript
+// Image helpers (imageSrc, pictureHtml, setImage) are in images.js.
+
 document.addEventListener('DOMContentLoaded', function() {
   // Ensure body allows scrolling (reset any leftover modal states)
   document.body.style.overflow = '';
@@ -326,7 +328,6 @@ document.addEventListener('DOMContentLoaded', function() {
 
       // For nai-ken-kai, show only the original image
       const imageObj = space.original_image || (space.images && space.images.length > 0 ? space.images[0] : null);
-      const image = imageObj && (typeof imageObj === 'string' ? imageObj : imageObj.src);
 
       // Special handling for shared space (140)
       let statusClass, statusText;
@@ -364,7 +365,7 @@ document.addEventListener('DOMContentLoaded', function() {
       const descEn = space.description || '';
       const descJa = space.description_ja || '';
       card.innerHTML = `
-        <img src="${image}" alt="${space.id}" class="space-image" loading="lazy">
+        ${pictureHtml(imageObj, `alt="${space.id}" class="space-image" loading="lazy"`, '(max-width: 640px) 100vw, 400px')}
         <div class="space-info">
           <div class="space-badges">${badges}</div>
           <p class="space-description">
@@ -396,7 +397,7 @@ document.addEventListener('DOMContentLoaded', function() {
   function openSpaceModal(space) {
     // Set image - handle both data structures
     const modalImageObj = space.original_image || (space.images && space.images[0]);
-    modalImage.src = modalImageObj && (typeof modalImageObj === 'string' ? modalImageObj : modalImageObj.src);
+    setImage(modalImage, modalImageObj, '(max-width: 800px) 100vw, 800px');
     modalImage.alt = space.id;
     // Always clear modal content first
     modalInfo.innerHTML = '';
@@ -435,8 +436,7 @@ document.addEventListener('DOMContentLoaded', function() {
         let imgsHtml = '';
         if (Array.isArray(u.images)) {
           imgsHtml = '<div class="update-images">' + u.images.map((im, idx) => {
-            const src = (typeof im === 'string') ? im : (im.src || '');
-            return `<img src="${src}" class="update-thumb" data-spaceid="${space.id}" data-update-index="${ui}" data-img-index="${idx}" loading="lazy"/>`;
+            return pictureHtml(im, `class="update-thumb" data-spaceid="${space.id}" data-update-index="${ui}" data-img-index="${idx}" loading="lazy"`, '60px');
           }).join('') + '</div>';
         }
         udiv.innerHTML = `<div class="update-header"><strong>${author}</strong>${action}</div>${txt}${imgsHtml}`;
@@ -453,8 +453,7 @@ document.addEventListener('DOMContentLoaded', function() {
           const upd = space.updates[upIdx];
           const imgObj = upd.images && upd.images[imgIdx];
           if (imgObj) {
-            const src = (typeof imgObj === 'string') ? imgObj : imgObj.src;
-            modalImage.src = src;
+            setImage(modalImage, imgObj, '(max-width: 800px) 100vw, 800px');
             // show update metadata in modalInfo (replace existing info for clarity)
             const metaHtml = `<h2>${space.id} — ${upd.author || ''}</h2>` + (upd.action ? `<div><em>${upd.action}</em></div>` : '') + (upd.text ? `<div class="update-text">${upd.text}</div>` : '');
             // keep badges above, but replace lower info
@@ -468,6 +467,26 @@ document.addEventListener('DOMContentLoaded', function() {
         });
       });
     }
+    // Spaces whose photo looks alike (precomputed by scripts/similar_spaces.py)
+    if (Array.isArray(space.similar) && space.similar.length) {
+      const similarHtml = document.createElement('div');
+      similarHtml.className = 'space-similar';
+      similarHtml.innerHTML = '<h3>' + (currentLang === 'ja' ? '似ているスペース' : 'Spaces like this') + '</h3>';
+      const thumbs = document.createElement('div');
+      thumbs.className = 'update-images';
+      thumbs.innerHTML = space.similar
+        .map(id => spaces.find(s => s.id === id))
+        .filter(other => other && other.original_image)
+        .map(other => pictureHtml(other.original_image, `class="update-thumb" data-similar-id="${other.id}" alt="${other.id}" title="${other.id}" loading="lazy"`, '60px'))
+        .join('');
+      thumbs.addEventListener('click', function(ev) {
+        const id = ev.target.getAttribute && ev.target.getAttribute('data-similar-id');
+        const other = id && spaces.find(s => String(s.id) === id);
+        if (other) openSpaceModal(other);
+      });
+      similarHtml.appendChild(thumbs);
+      modalInfo.appendChild(similarHtml);
+    }
   }
 
   if (modalClose) {
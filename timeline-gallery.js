@@ -1,6 +1,8 @@
 // Timeline gallery: group images by 30-minute intervals, show timestamp on left, images in row
 // Assumes spaces.json: [{ id, images: [{src, taken_at}], ... }]
 
+// Image helpers (imageSrc, pictureHtml, setImage) are in images.js.
+
 function parseTime(ts) {
   // Returns a Date object or null
   if (!ts) return null;
@@ -48,7 +50,7 @@ fetch('spaces_timeline.json')
         allPosts.push({
           id: spaceId,
           type: event.type,
-          src: event.images[0].src,
+          image: event.images[0],
           taken_at: event.taken_at,
           author: event.author || 'Unknown',
           text: event.text || (event.type === 'original' ? 'Original state' : ''),
@@ -97,7 +99,7 @@ fetch('spaces_timeline.json')
         timeGroups[timeStr].forEach(post => {
           const imgEl = document.createElement('img');
           imgEl.className = 'timeline-img';
-          imgEl.src = post.src;
+          setImage(imgEl, post.image, '100px');
           imgEl.alt = post.id;
           imgEl.onclick = () => {
             // Find the space events for this post
@@ -115,9 +117,9 @@ fetch('spaces_timeline.json')
                 const description = orig.description ? `<br><small style="font-size: 0.8em; color: #666; font-style: italic;">"${orig.description}" — Generated by BLIP-2</small><br>` : '';
                 events.push({
                   type: 'original',
-                  img: orig.images[0].src,
+                  img: orig.images[0],
                   info: `<b>Space ${spaceId}</b><br><small>${timestamp}</small>${description}`,
-                  supp: orig.images.slice(1).map(im => im.src)
+                  supp: orig.images.slice(1)
                 });
               }
             });
@@ -131,9 +133,9 @@ fetch('spaces_timeline.json')
                 const updateText = upd.text ? `<br><small style="font-size: 0.8em; color: #666; font-style: italic;">"${upd.text}"</small><br>` : '';
                 events.push({
                   type: 'update',
-                  img: upd.images[0].src,
+                  img: upd.images[0],
                   info: `${authorInfo}<small>${timestamp}</small>${updateText}`,
-                  supp: upd.images.slice(1).map(im => im.src)
+                  supp: upd.images.slice(1)
                 });
               }
             });
@@ -146,9 +148,9 @@ fetch('spaces_timeline.json')
                 <div class="update-modal-timeline">
                   ${events.map(ev => `
                     <div class="update-modal-event">
-                      <img src="${ev.img}" alt="zoomed" loading="lazy">
+                      ${pictureHtml(ev.img, 'alt="zoomed" loading="lazy"', '96vw')}
                       <div class="event-info">${ev.info}</div>
-                      ${ev.supp.length ? `<div class="event-supp">${ev.supp.map(s => `<img src="${s}" alt="supp" loading="lazy">`).join('')}</div>` : ''}
+                      ${ev.supp.length ? `<div class="event-supp">${ev.supp.map(s => pictureHtml(s, 'alt="supp" loading="lazy"', '140px')).join('')}</div>` : ''}
                     </div>
                   `).join('')}
                 </div>